@@ -0,0 +1,474 @@
+"""
+Dental AI Service - Offline Benchmark Suite
+
+Boots the FastAPI app in-process against local stand-ins (mongomock-motor for
+MongoDB, fakeredis for Redis, a small scikit-learn symptom model and a stub
+intent backend) and drives the main endpoints at a fixed concurrency. Reports
+throughput and p50/p95/p99 latency per scenario, optionally as JSON for
+comparison against an earlier run. Needs no network, GPU or model files.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --scenarios chat,symptom_analysis --requests 5000 --concurrency 64
+    python benchmark.py --json results.json --baseline previous.json
+    python benchmark.py --scenarios chat --serialization 20000
+
+Requirements (in addition to the service's):
+- httpx
+- mongomock-motor
+- fakeredis
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import pickle
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+SCENARIOS = (
+    "chat",
+    "symptom_analysis",
+    "appointments",
+    "patient_get",
+    "patient_create",
+    "patient_update",
+)
+
+CHAT_MESSAGES = [
+    "Hello, I'd like some help",
+    "Can I book a cleaning next week?",
+    "My tooth hurts when I drink something cold",
+    "How much does a crown cost?",
+    "Do you accept Delta Dental insurance?",
+    "Where is the clinic located?",
+    "What are your opening hours on Saturday?",
+    "My face has severe swelling and I can't sleep",
+    "Thanks, goodbye!",
+]
+
+SYMPTOMS = [
+    "sharp_pain", "dull_pain", "throbbing", "sensitivity_hot", "sensitivity_cold",
+    "swelling", "bleeding", "bad_taste", "bad_breath", "loose_tooth",
+    "discoloration", "broken_tooth", "difficulty_chewing", "jaw_pain", "headache", "fever",
+]
+
+INSURANCE_PROVIDERS = ["delta_dental", "cigna", "aetna", "metlife", "none", None]
+
+APPOINTMENT_TYPES = ["consultation", "cleaning", "checkup", "filling", "crown",
+                     "root_canal", "extraction", "whitening", "emergency"]
+
+APPOINTMENT_TIMES = ["8:00 AM", "9:00 AM", "10:30 AM", "11:00 AM", "1:00 PM", "2:15 PM", "3:00 PM", "4:00 PM"]
+
+# ==================== STAND-INS ====================
+
+class HashingIntentBackend:
+    """
+    Stub intent classifier: hashed bag of words times a fixed random weight
+    matrix. Deterministic, CPU-only and cheap, but batched like the real model.
+    """
+
+    name = "stub"
+    n_features = 256
+
+    def __init__(self):
+        rng = np.random.default_rng(0)
+        self.weights = rng.standard_normal((self.n_features, 10)).astype(np.float32)
+
+    def load(self) -> str:
+        return "stub-intent-1"
+
+    def predict(self, messages: List[str]) -> List[int]:
+        features = np.zeros((len(messages), self.n_features), dtype=np.float32)
+        for row, message in enumerate(messages):
+            for token in message.lower().split():
+                # crc32 rather than hash(), which PYTHONHASHSEED randomizes per process
+                features[row, zlib.crc32(token.encode("utf-8")) % self.n_features] += 1.0
+        return (features @ self.weights).argmax(axis=1).tolist()
+
+def write_symptom_model(svc: Any, directory: str) -> str:
+    """
+    Train a small random forest on synthetic rows and save it, with its feature
+    schema, where the service expects a model.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(0)
+    X = (rng.random((500, svc.symptom_feature_encoder.width)) > 0.8).astype(np.float32)
+    y = rng.integers(0, 10, size=500)
+    classifier = RandomForestClassifier(n_estimators=20, max_depth=8, random_state=0).fit(X, y)
+    path = os.path.join(directory, "symptom_classifier.pkl")
+    with open(path, "wb") as f:
+        pickle.dump(classifier, f)
+    svc.symptom_feature_encoder.write_schema(os.path.splitext(path)[0] + ".schema.json")
+    return path
+
+def load_service(workdir: str) -> Any:
+    """
+    Import the service with models configured for the benchmark and swap its
+    database and cache clients for in-process stand-ins.
+    """
+    from mongomock_motor import AsyncMongoMockClient
+    import fakeredis
+
+    os.environ.setdefault("MODEL_LOAD_MODE", "blocking")
+    os.environ["INTENT_BACKEND"] = "stub"
+    os.environ["SYMPTOM_MODEL_PATH"] = os.path.join(workdir, "symptom_classifier.pkl")
+    os.environ.pop("SYMPTOM_SCHEMA_PATH", None)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import dental_ai_service as svc
+
+    svc.INTENT_BACKENDS["stub"] = HashingIntentBackend
+    write_symptom_model(svc, workdir)
+    svc.db = AsyncMongoMockClient().dental_ai_db
+    svc.redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    return svc
+
+async def seed(svc: Any, patients: int) -> Dict[str, Any]:
+    """
+    Create a user with a bearer token and `patients` patient records.
+    """
+    await svc.db.users.insert_one({"_id": "benchmark-user", "email": "bench@example.com"})
+    token = svc.create_access_token({"sub": "benchmark-user"}, datetime.timedelta(hours=4))
+    rng = random.Random(0)
+    await svc.db.patients.insert_many([
+        {
+            "patient_id": f"P{i:06d}",
+            "name": f"Patient {i}",
+            "date_of_birth": datetime.datetime(1950 + i % 50, 1 + i % 12, 1 + i % 28),
+            "email": f"patient{i}@example.com",
+            "phone": f"555-{i:07d}",
+            "insurance_provider": rng.choice(INSURANCE_PROVIDERS),
+            "allergies": [],
+            "medications": [],
+            "created_at": datetime.datetime.now(),
+            "updated_at": datetime.datetime.now(),
+        }
+        for i in range(patients)
+    ])
+    return {"token": token, "patient_ids": [f"P{i:06d}" for i in range(patients)]}
+
+# ==================== SCENARIOS ====================
+
+def patient_payload(patient_id: str, rng: random.Random) -> Dict[str, Any]:
+    return {
+        "patient_id": patient_id,
+        "name": f"Patient {patient_id}",
+        "date_of_birth": "1985-06-15",
+        "email": f"{patient_id.lower()}@example.com",
+        "phone": "555-0100",
+        "insurance_provider": rng.choice(INSURANCE_PROVIDERS),
+    }
+
+def build_scenarios(fixtures: Dict[str, Any], days: int) -> Dict[str, Callable]:
+    """
+    Map scenario names to request factories taking (request index, rng) and
+    returning (method, url, kwargs).
+    """
+    auth = {"token": fixtures["token"]}
+    patient_ids = fixtures["patient_ids"]
+    first_day = datetime.date.today() + datetime.timedelta(days=1)
+
+    def chat(i, rng):
+        body = {"message": rng.choice(CHAT_MESSAGES), "conversation_id": f"bench-{i % 200}"}
+        if i % 4 == 0:
+            # A share of unique messages so the intent model is exercised, not only the cache
+            body["message"] = f"{body['message']} ({i})"
+        return "POST", "/api/chat", {"json": body}
+
+    def symptom_analysis(i, rng):
+        body = {
+            "pain_level": rng.randint(1, 10),
+            "symptoms": rng.sample(SYMPTOMS, rng.randint(1, 4)),
+            "duration_days": rng.randint(1, 14),
+            "patient_id": rng.choice(patient_ids),
+        }
+        return "POST", "/api/symptom-analysis", {"json": body}
+
+    def appointments(i, rng):
+        body = {
+            "patient_id": rng.choice(patient_ids),
+            "appointment_type": rng.choice(APPOINTMENT_TYPES),
+            "preferred_date": (first_day + datetime.timedelta(days=rng.randrange(days))).isoformat(),
+            "preferred_time": rng.choice(APPOINTMENT_TIMES),
+            "insurance_provider": rng.choice(INSURANCE_PROVIDERS),
+        }
+        return "POST", "/api/appointments", {"json": body}
+
+    def patient_get(i, rng):
+        return "GET", f"/api/patients/{rng.choice(patient_ids)}", {"headers": auth}
+
+    def patient_create(i, rng):
+        return "POST", "/api/patients", {"json": patient_payload(f"N{i:08d}", rng), "headers": auth}
+
+    def patient_update(i, rng):
+        patient_id = rng.choice(patient_ids)
+        return "PUT", f"/api/patients/{patient_id}", {"json": patient_payload(patient_id, rng), "headers": auth}
+
+    return {
+        "chat": chat,
+        "symptom_analysis": symptom_analysis,
+        "appointments": appointments,
+        "patient_get": patient_get,
+        "patient_create": patient_create,
+        "patient_update": patient_update,
+    }
+
+# ==================== SERIALIZATION ====================
+
+SERIALIZATION_CASES = (
+    # (case, response model, method, url)
+    ("symptom_analysis", "SymptomAnalysisResponse", "POST", "/api/symptom-analysis"),
+    ("chat", "ChatResponse", "POST", "/api/chat"),
+    ("appointments", "AppointmentResponse", "POST", "/api/appointments"),
+    ("estimates", "EstimateResponse", "POST", "/api/estimates"),
+    ("availability", "AvailabilityResponse", "GET", "/api/availability"),
+)
+
+async def serialization_cases(svc: Any, client: Any, fixtures: Dict[str, Any],
+                              factories: Dict[str, Callable]) -> Dict[str, tuple]:
+    """
+    Representative response objects, captured from live requests: case -> (route, content
+    the endpoint used to return, content it returns now).
+    """
+    from fastapi.routing import APIRoute
+
+    routes = {(method, route.path): route for route in svc.app.routes if isinstance(route, APIRoute)
+              for method in route.methods}
+    rng = random.Random(0)
+    requests = {
+        "symptom_analysis": factories["symptom_analysis"](0, rng)[2],
+        "chat": factories["chat"](1, rng)[2],
+        "appointments": factories["appointments"](0, rng)[2],
+        "estimates": {"json": {}},
+        "availability": {"params": {"appointment_type": "cleaning",
+                                    "start_date": (datetime.date.today() + datetime.timedelta(days=1)).isoformat(),
+                                    "limit": 50}},
+    }
+    cases = {}
+    for name, model_name, method, url in SERIALIZATION_CASES:
+        response = await client.request(method, url, **requests[name])
+        response.raise_for_status()
+        model = getattr(svc, model_name).parse_raw(response.content)
+        cases[name] = (routes[(method, url)], model, model)
+
+    doc = await svc.db.patients.find_one({"patient_id": fixtures["patient_ids"][0]})
+    doc.update({
+        "address": "1 Main Street, Springfield",
+        "medical_history": {"conditions": ["hypertension"], "surgeries": [], "notes": "none"},
+        "allergies": ["penicillin", "latex"],
+        "medications": ["lisinopril"],
+        "last_visit": datetime.datetime(2024, 3, 1),
+    })
+    route = routes[("GET", "/api/patients/{patient_id}")]
+    cases["patient_get"] = (route, doc, svc.patient_document_payload(doc))
+    return cases
+
+async def run_serialization(svc: Any, cases: Dict[str, tuple], iterations: int) -> Dict[str, Any]:
+    """
+    Per-response serialization cost of the previous path (response_model
+    re-validation, jsonable_encoder and the stdlib encoder; patients built into a
+    PatientRecord first) against FastJSONResponse, and whether the bodies match.
+    """
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+
+    async def before(route, content):
+        if isinstance(content, dict):
+            content = svc.PatientRecord(**content)
+        encoded = await serialize_response(field=route.response_field, response_content=content)
+        return JSONResponse(encoded).body
+
+    async def after(route, content):
+        return svc.FastJSONResponse(content).body
+
+    results = {}
+    for name, (route, old_content, new_content) in cases.items():
+        timings = {}
+        for label, render, content in (("before", before, old_content), ("after", after, new_content)):
+            await render(route, content)
+            started = time.perf_counter()
+            for _ in range(iterations):
+                body = await render(route, content)
+            timings[label] = ((time.perf_counter() - started) / iterations * 1e6, body)
+        (before_us, before_body), (after_us, after_body) = timings["before"], timings["after"]
+        results[name] = {
+            "bytes": len(after_body),
+            "before_us": round(before_us, 2),
+            "after_us": round(after_us, 2),
+            "speedup": round(before_us / after_us, 2) if after_us else None,
+            "identical": before_body == after_body,
+        }
+        print(
+            f"{name:<18} serialize {before_us:>8.2f} us -> {after_us:>7.2f} us  "
+            f"({results[name]['speedup']}x, {len(after_body)} bytes, "
+            f"{'identical' if results[name]['identical'] else 'DIFFERENT'})",
+            file=sys.stderr
+        )
+    return results
+
+# ==================== RUNNER ====================
+
+def summarize(latencies_ms: List[float], statuses: Dict[str, int], elapsed: float) -> Dict[str, Any]:
+    values = np.asarray(latencies_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) if len(values) else (0.0, 0.0, 0.0)
+    return {
+        "requests": len(values),
+        "elapsed_seconds": round(elapsed, 4),
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(float(values.mean()), 3) if len(values) else 0.0,
+            "p50": round(float(p50), 3),
+            "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3),
+            "max": round(float(values.max()), 3) if len(values) else 0.0,
+        },
+        "status_codes": dict(sorted(statuses.items())),
+    }
+
+async def run_scenario(client: Any, factory: Callable, requests: int, concurrency: int,
+                       warmup: int, seed_value: int) -> Dict[str, Any]:
+    """
+    Send `requests` requests from `concurrency` workers sharing one counter and
+    return the latency summary. The first `warmup` requests are not measured.
+    """
+    rng = random.Random(seed_value)
+    for i in range(warmup):
+        method, url, kwargs = factory(-1 - i, rng)
+        await client.request(method, url, **kwargs)
+
+    counter = iter(range(requests))
+    latencies_ms: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async def worker(worker_id: int):
+        worker_rng = random.Random(seed_value * 1000 + worker_id)
+        for i in counter:
+            method, url, kwargs = factory(i, worker_rng)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies_ms.append((time.perf_counter() - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    return summarize(latencies_ms, statuses, time.perf_counter() - started)
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Relative change per scenario against a previous JSON report (negative latency
+    and positive throughput changes are improvements).
+    """
+    changes = {}
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        change = {}
+        for key in ("p50", "p95", "p99"):
+            before = previous["latency_ms"][key]
+            change[f"{key}_pct"] = round((current["latency_ms"][key] - before) / before * 100, 1) if before else None
+        before = previous["throughput_rps"]
+        change["throughput_pct"] = round((current["throughput_rps"] - before) / before * 100, 1) if before else None
+        changes[name] = change
+    return changes
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    with tempfile.TemporaryDirectory(prefix="dental-ai-bench-") as workdir:
+        svc = load_service(workdir)
+        logging.getLogger("dental_ai_service").setLevel(args.log_level.upper())
+
+        await svc.app.router.startup()
+        try:
+            fixtures = await seed(svc, args.patients)
+            factories = build_scenarios(fixtures, args.days)
+            # Unhandled errors are reported as 500s rather than aborting the run
+            transport = httpx.ASGITransport(app=svc.app, raise_app_exceptions=False)
+            results: Dict[str, Any] = {
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "config": {
+                    "requests": args.requests,
+                    "concurrency": args.concurrency,
+                    "warmup": args.warmup,
+                    "patients": args.patients,
+                    "seed": args.seed,
+                },
+                "scenarios": {},
+            }
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                for offset, name in enumerate(args.scenarios):
+                    summary = await run_scenario(
+                        client, factories[name], args.requests, args.concurrency,
+                        args.warmup, args.seed + offset
+                    )
+                    results["scenarios"][name] = summary
+                    latency = summary["latency_ms"]
+                    print(
+                        f"{name:<18} {summary['throughput_rps']:>9.1f} req/s  "
+                        f"p50 {latency['p50']:>8.2f} ms  p95 {latency['p95']:>8.2f} ms  "
+                        f"p99 {latency['p99']:>8.2f} ms  {summary['status_codes']}",
+                        file=sys.stderr
+                    )
+                if args.serialization:
+                    cases = await serialization_cases(svc, client, fixtures, factories)
+                    results["serialization"] = await run_serialization(svc, cases, args.serialization)
+        finally:
+            await svc.app.router.shutdown()
+    return results
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmark for the Dental AI Service")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=1000, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent in-flight requests")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests before each scenario")
+    parser.add_argument("--patients", type=int, default=1000, help="Patient records to seed")
+    parser.add_argument("--days", type=int, default=20, help="Days ahead that appointment requests spread over")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Write the report to this file ('-' for stdout)")
+    parser.add_argument("--baseline", help="Previous JSON report to compare against")
+    parser.add_argument("--serialization", type=int, default=0, metavar="ITERATIONS",
+                        help="Also time response serialization alone, old path vs new, over this many iterations")
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = sorted(set(args.scenarios) - set(SCENARIOS))
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    return args
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["comparison"] = compare(results, json.load(f))
+        for name, change in results["comparison"].items():
+            print(f"{name:<18} vs baseline: {change}", file=sys.stderr)
+    if args.json == "-":
+        print(json.dumps(results, indent=2))
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -9,43 +9,68 @@ Requirements:
 - Python 3.9+
 - FastAPI
 - scikit-learn
-- pandas
 - numpy
-- tensorflow
 - transformers
 - pymongo
 - redis
 - pydantic
+- orjson (optional, faster response encoding)
 """
 
+import io
 import os
+import re
+import csv
+import sys
+import hmac
 import json
+import time
+import random
+import pickle
+import bisect
+import asyncio
+import codecs
+import cProfile
 import logging
+import hashlib
+import uuid
 import datetime
-from typing import Dict, List, Optional, Union, Any
+import functools
+import threading
+import multiprocessing
+from collections import OrderedDict
+from types import MappingProxyType
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Union, Any
 from enum import Enum
 
 # FastAPI for API endpoints
-from fastapi import FastAPI, HTTPException, Depends, Header, Body, Query, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Body, Query, Request, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, EmailStr
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, EmailStr, ValidationError
+from pydantic.fields import SHAPE_DICT, SHAPE_LIST
 
-# ML and data processing
+# Fast JSON encoding for responses (optional; the stdlib encoder is used without it)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ML and data processing (transformers is imported when the models are loaded)
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-import tensorflow as tf
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
 
 # Database connections
 import motor.motor_asyncio
 import redis.asyncio as redis
+from pymongo import IndexModel, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from bson import ObjectId, json_util
 
 # Authentication and security
 import jwt
 from passlib.context import CryptContext
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 # Initialize logging
 logging.basicConfig(
@@ -186,6 +211,21 @@ class ChatResponse(BaseModel):
     suggested_actions: List[str] = []
     emergency_detected: bool = False
 
+class ConversationMessage(BaseModel):
+    seq: int
+    timestamp: datetime.datetime
+    user_message: str
+    bot_response: str
+    intent: Optional[str] = None
+    emergency_detected: bool = False
+
+class ConversationPage(BaseModel):
+    conversation_id: str
+    total_messages: int
+    offset: int
+    limit: int
+    messages: List[ConversationMessage]
+
 class AppointmentRequest(BaseModel):
     patient_id: str
     appointment_type: AppointmentType
@@ -205,6 +245,34 @@ class AppointmentResponse(BaseModel):
     insurance_coverage: Optional[float] = None
     patient_responsibility: Optional[float] = None
 
+class AvailableSlot(BaseModel):
+    date: datetime.date
+    time: str
+    doctor: str
+
+class AvailabilityResponse(BaseModel):
+    appointment_type: AppointmentType
+    duration_minutes: int
+    start_date: datetime.date
+    end_date: datetime.date
+    slots: List[AvailableSlot]
+
+class EstimateRequest(BaseModel):
+    treatments: List[str] = []
+    appointment_types: List[AppointmentType] = []
+    insurance_providers: List[InsuranceProvider] = []
+
+class EstimateItem(BaseModel):
+    item: str
+    kind: str
+    cost: float
+
+class EstimateResponse(BaseModel):
+    items: List[EstimateItem]
+    insurance_providers: List[InsuranceProvider]
+    coverage: List[List[float]]
+    patient_responsibility: List[List[float]]
+
 class PatientRecord(BaseModel):
     patient_id: str
     name: str
@@ -224,6 +292,24 @@ class PatientRecord(BaseModel):
     created_at: datetime.datetime = Field(default_factory=datetime.datetime.now)
     updated_at: datetime.datetime = Field(default_factory=datetime.datetime.now)
 
+class PatientImportError(BaseModel):
+    line: int
+    patient_id: Optional[str] = None
+    error: str
+
+class PatientImportReport(BaseModel):
+    import_id: str
+    status: str
+    format: str
+    bytes_received: int
+    rows: int
+    inserted: int
+    failed: int
+    errors: List[PatientImportError]
+    errors_truncated: bool
+    started_at: datetime.datetime
+    finished_at: Optional[datetime.datetime] = None
+
 # ==================== DATABASE CONNECTIONS ====================
 
 # MongoDB connection
@@ -231,570 +317,4392 @@ MONGO_CONNECTION_STRING = os.getenv("MONGO_CONNECTION_STRING", "mongodb://localh
 mongo_client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_CONNECTION_STRING)
 db = mongo_client.dental_ai_db
 
+# Indexes every collection needs, created at startup (and by `ensure-indexes`)
+MONGO_INDEXES: Dict[str, List[IndexModel]] = {
+    "patients": [IndexModel("patient_id", unique=True)],
+    "appointments": [
+        IndexModel("appointment_id", unique=True),
+        IndexModel([("patient_id", 1), ("date", 1)]),
+    ],
+    "appointment_slots": [
+        IndexModel([("doctor", 1), ("date", 1), ("slot", 1)], unique=True),
+        IndexModel("appointment_id"),
+    ],
+    "conversations": [IndexModel("conversation_id", unique=True)],
+    "conversation_messages": [IndexModel([("conversation_id", 1), ("bucket", 1)], unique=True)],
+}
+
+async def ensure_indexes(collections: Optional[List[str]] = None) -> Dict[str, List[str]]:
+    """
+    Create the declared indexes on the given collections (all by default);
+    indexes that already exist are left alone. Returns index names per collection.
+    """
+    created = {}
+    for name in collections or MONGO_INDEXES:
+        created[name] = await db[name].create_indexes(MONGO_INDEXES[name])
+    return created
+
+def bson_datetime(value: datetime.datetime) -> datetime.datetime:
+    """
+    A datetime at BSON's millisecond precision, i.e. as Mongo will return it.
+    """
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+def mongo_dates(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    BSON has no date type: store top-level date values as midnight datetimes, and
+    truncate datetimes to milliseconds so cached copies match the stored document.
+    """
+    return {
+        key: datetime.datetime.combine(value, datetime.time.min) if type(value) is datetime.date
+        else bson_datetime(value) if isinstance(value, datetime.datetime) else value
+        for key, value in doc.items()
+    }
+
 # Redis connection for caching
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
 
-# ==================== AI MODELS ====================
+# ==================== INSTRUMENTATION ====================
 
-# Load pre-trained models
-try:
-    # NLP model for intent classification
-    tokenizer = AutoTokenizer.from_pretrained("distilbert-base-uncased")
-    model = AutoModelForSequenceClassification.from_pretrained("./models/intent_classifier")
-    
-    # Symptom analysis model
-    symptom_classifier = RandomForestClassifier()
-    with open("./models/symptom_classifier.pkl", "rb") as f:
-        import pickle
-        symptom_classifier = pickle.load(f)
-    
-    # Sentiment analysis for emergency detection
-    sentiment_analyzer = pipeline("sentiment-analysis")
-    
-    logger.info("AI models loaded successfully")
-except Exception as e:
-    logger.error(f"Error loading AI models: {e}")
-    # Use fallback models or methods
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Histogram bucket upper bounds in seconds
+METRICS_LATENCY_BUCKETS = tuple(sorted(float(b) for b in os.getenv(
+    "METRICS_LATENCY_BUCKETS", "0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+).split(",")))
 
-# ==================== AUTHENTICATION ====================
+class Histogram:
+    """
+    Cumulative-bucket latency histogram in the Prometheus layout.
+    """
 
-# JWT settings
-SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-for-jwt")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # One slot per bucket plus +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+class _Span:
+    __slots__ = ("histogram", "started")
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
 
-async def get_current_user(token: str = Header(...)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except jwt.PyJWTError:
-        raise credentials_exception
-    
-    user = await db.users.find_one({"_id": user_id})
-    if user is None:
-        raise credentials_exception
-    return user
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
 
-# ==================== CORE AI FUNCTIONS ====================
+class _NoopSpan:
+    __slots__ = ()
 
-async def analyze_symptoms(request: SymptomAnalysisRequest) -> SymptomAnalysisResponse:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+class MetricsRegistry:
     """
-    Analyze dental symptoms using machine learning to provide diagnosis and recommendations.
+    In-process counters and latency histograms, rendered in the Prometheus text format.
+
+    `span(stage)` times a block into the stage latency histogram. When metrics are
+    disabled every call returns immediately and `span` hands back a shared no-op
+    context manager. Component statistics that are already tracked elsewhere
+    (cache hit counts, pool saturation) are read by collectors at scrape time
+    rather than counted twice on the hot path.
     """
-    try:
-        # Prepare features for the model
-        features = {
-            "pain_level": request.pain_level,
-            "duration_days": request.duration_days or 1,
-        }
-        
-        # One-hot encode symptoms
-        all_possible_symptoms = [
-            "sharp_pain", "dull_pain", "throbbing", "sensitivity_hot", 
-            "sensitivity_cold", "swelling", "bleeding", "bad_taste",
-            "bad_breath", "loose_tooth", "discoloration", "broken_tooth",
-            "difficulty_chewing", "jaw_pain", "headache", "fever"
-        ]
-        
-        for symptom in all_possible_symptoms:
-            features[symptom] = 1 if symptom in request.symptoms else 0
-            
-        # Add tooth location if provided
-        if request.tooth_location:
-            tooth_features = {f"location_{loc.value}": 1 if loc == request.tooth_location else 0 
-                             for loc in ToothLocation}
-            features.update(tooth_features)
-        
-        # Convert to numpy array for prediction
-        feature_vector = np.array([[v for v in features.values()]])
-        
-        # Make prediction
-        condition_probs = symptom_classifier.predict_proba(feature_vector)[0]
-        condition_indices = condition_probs.argsort()[-3:][::-1]  # Top 3 conditions
-        
-        # Map indices to condition names
-        all_conditions = [
-            "Cavity", "Gum Disease", "Tooth Fracture", "Abscess", 
-            "Pulpitis", "Impacted Tooth", "Tooth Sensitivity", 
-            "TMJ Disorder", "Bruxism", "Oral Cancer"
-        ]
-        
-        possible_conditions = [all_conditions[i] for i in condition_indices]
-        
-        # Determine urgency based on symptoms and pain level
-        urgency = UrgencyLevel.LOW
-        if request.pain_level >= 8 or "swelling" in request.symptoms or "fever" in request.symptoms:
-            urgency = UrgencyLevel.EMERGENCY
-        elif request.pain_level >= 6 or "throbbing" in request.symptoms:
-            urgency = UrgencyLevel.HIGH
-        elif request.pain_level >= 4:
-            urgency = UrgencyLevel.MEDIUM
-            
-        # Generate recommendations
-        recommendations = []
-        needs_immediate = urgency == UrgencyLevel.EMERGENCY
-        
-        if needs_immediate:
-            recommendations.append("Seek immediate emergency dental care")
-            recommendations.append("Take over-the-counter pain medication as directed")
-            recommendations.append("Apply cold compress for swelling")
-        elif urgency == UrgencyLevel.HIGH:
-            recommendations.append("Schedule an appointment within 24-48 hours")
-            recommendations.append("Take over-the-counter pain medication as needed")
-            recommendations.append("Avoid hot, cold, or sweet foods and beverages")
-        else:
-            recommendations.append("Schedule a regular dental appointment")
-            recommendations.append("Maintain good oral hygiene")
-            recommendations.append("Monitor symptoms and seek care if they worsen")
-            
-        # Treatment options based on conditions
-        treatment_mapping = {
-            "Cavity": ["Filling", "Crown", "Root Canal"],
-            "Gum Disease": ["Deep Cleaning", "Antibiotics", "Gum Surgery"],
-            "Tooth Fracture": ["Bonding", "Crown", "Extraction"],
-            "Abscess": ["Drainage", "Root Canal", "Antibiotics"],
-            "Pulpitis": ["Root Canal", "Medication", "Extraction"],
-            "Impacted Tooth": ["Extraction", "Surgery", "Pain Management"],
-            "Tooth Sensitivity": ["Desensitizing Toothpaste", "Fluoride Treatment", "Bonding"],
-            "TMJ Disorder": ["Mouthguard", "Physical Therapy", "Medication"],
-            "Bruxism": ["Night Guard", "Stress Management", "Dental Correction"],
-            "Oral Cancer": ["Biopsy", "Surgery", "Radiation Therapy"]
-        }
-        
-        treatment_options = []
-        for condition in possible_conditions:
-            if condition in treatment_mapping:
-                treatment_options.extend(treatment_mapping[condition])
-                
-        # Remove duplicates while preserving order
-        treatment_options = list(dict.fromkeys(treatment_options))
-        
-        # Estimated costs (simplified)
-        cost_mapping = {
-            "Filling": 150.00,
-            "Crown": 1200.00,
-            "Root Canal": 1000.00,
-            "Deep Cleaning": 200.00,
-            "Antibiotics": 50.00,
-            "Gum Surgery": 1500.00,
-            "Bonding": 300.00,
-            "Extraction": 250.00,
-            "Surgery": 2000.00,
-            "Pain Management": 100.00,
-            "Desensitizing Toothpaste": 20.00,
-            "Fluoride Treatment": 35.00,
-            "Mouthguard": 400.00,
-            "Night Guard": 500.00,
-            "Physical Therapy": 150.00,
-            "Medication": 75.00,
-            "Stress Management": 100.00,
-            "Dental Correction": 1500.00,
-            "Biopsy": 800.00,
-            "Radiation Therapy": 5000.00
-        }
-        
-        estimated_costs = {treatment: cost_mapping.get(treatment, 0.0) for treatment in treatment_options}
-        
-        # Get insurance coverage if patient_id is provided
-        insurance_coverage = None
-        if request.patient_id:
-            patient = await db.patients.find_one({"patient_id": request.patient_id})
-            if patient and patient.get("insurance_provider"):
-                # Simplified coverage calculation
-                coverage_rates = {
-                    InsuranceProvider.DELTA_DENTAL: 0.8,
-                    InsuranceProvider.CIGNA: 0.7,
-                    InsuranceProvider.AETNA: 0.75,
-                    InsuranceProvider.METLIFE: 0.8,
-                    InsuranceProvider.GUARDIAN: 0.7,
-                    InsuranceProvider.UNITED_HEALTHCARE: 0.75,
-                    InsuranceProvider.HUMANA: 0.7,
-                    InsuranceProvider.BLUE_CROSS: 0.8,
-                    InsuranceProvider.OTHER: 0.6,
-                    InsuranceProvider.NONE: 0.0
-                }
-                
-                provider = InsuranceProvider(patient.get("insurance_provider"))
-                coverage_rate = coverage_rates.get(provider, 0.0)
-                insurance_coverage = {treatment: cost * coverage_rate for treatment, cost in estimated_costs.items()}
-        
-        # Create and return response
-        return SymptomAnalysisResponse(
-            possible_conditions=possible_conditions,
-            urgency=urgency,
-            recommendations=recommendations,
-            needs_immediate_attention=needs_immediate,
-            treatment_options=treatment_options,
-            estimated_costs=estimated_costs,
-            insurance_coverage=insurance_coverage
-        )
-        
-    except Exception as e:
-        logger.error(f"Error in symptom analysis: {e}")
-        # Fallback response
-        return SymptomAnalysisResponse(
-            possible_conditions=["Unable to determine - please consult a dentist"],
-            urgency=UrgencyLevel.MEDIUM,
-            recommendations=["Schedule an appointment with a dentist for proper diagnosis"],
-            needs_immediate_attention=False,
-            treatment_options=["Professional dental examination"],
-            estimated_costs={"Consultation": 75.00}
-        )
 
-async def process_chat_message(request: ChatRequest) -> ChatResponse:
+    def __init__(self, enabled: bool, buckets: tuple):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._histograms: Dict[tuple, Histogram] = {}
+        # Stage name -> histogram, so a span costs one dict lookup
+        self._stage_histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[tuple, float] = {}
+        self._help: Dict[str, tuple] = {}
+        self._collectors: List[Callable[[], List[tuple]]] = []
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[name] = (kind, help_text)
+
+    def _histogram(self, name: str, labels: tuple) -> Histogram:
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(self.buckets))
+        return histogram
+
+    def span(self, stage: str):
+        if not self.enabled:
+            return _NOOP_SPAN
+        histogram = self._stage_histograms.get(stage)
+        if histogram is None:
+            histogram = self._histogram("dental_ai_stage_duration_seconds", (("stage", stage),))
+            self._stage_histograms[stage] = histogram
+        return _Span(histogram)
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        self._histogram(name, tuple(sorted(labels.items()))).observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def register_collector(self, collector: Callable[[], List[tuple]]):
+        """
+        `collector()` returns (name, labels dict, value) samples for metrics
+        declared with `describe`.
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        samples: Dict[str, List[str]] = {}
+
+        def add(name: str, line: str):
+            samples.setdefault(name, []).append(line)
+
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = list(self._histograms.items())
+        for (name, labels), value in counters:
+            add(name, f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), histogram in histograms:
+            with histogram._lock:
+                counts = list(histogram.counts)
+                total = histogram.sum
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                add(name, f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            add(name, f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            add(name, f"{name}_count{_format_labels(labels)} {cumulative}")
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    add(name, f"{name}{_format_labels(tuple(sorted(labels.items())))} {float(value):g}")
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+
+        lines = []
+        for name in sorted(samples):
+            kind, help_text = self._help.get(name, ("untyped", ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples[name])
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry(METRICS_ENABLED, METRICS_LATENCY_BUCKETS)
+metrics.describe("dental_ai_stage_duration_seconds", "histogram", "Latency of named processing stages.")
+metrics.describe("dental_ai_http_requests_total", "counter", "HTTP requests by route, method and status.")
+metrics.describe("dental_ai_http_request_duration_seconds", "histogram", "HTTP request latency by route, including serialization.")
+metrics.describe("dental_ai_emergencies_total", "counter", "Chat messages flagged as dental emergencies.")
+metrics.describe("dental_ai_fallback_responses_total", "counter", "Requests answered with a fallback response after an error.")
+
+class MetricsMiddleware:
     """
-    Process a chat message using NLP to detect intent and generate appropriate responses.
+    ASGI middleware counting requests and timing them per route template.
+    Only installed when metrics are enabled.
     """
-    try:
-        # Check for emergency keywords first
-        emergency_keywords = [
-            "emergency", "severe pain", "unbearable", "bleeding", "swelling",
-            "accident", "broken", "knocked out", "can't sleep", "extreme"
-        ]
-        
-        message_lower = request.message.lower()
-        emergency_detected = any(keyword in message_lower for keyword in emergency_keywords)
-        
-        # Detect intent using the model
-        inputs = tokenizer(request.message, return_tensors="pt", truncation=True, padding=True)
-        outputs = model(**inputs)
-        
-        # Get predicted intent
-        intent_id = outputs.logits.argmax(-1).item()
-        
-        # Map intent ID to intent name
-        intent_mapping = {
-            0: "greeting",
-            1: "appointment_booking",
-            2: "symptom_inquiry",
-            3: "service_inquiry",
-            4: "cost_inquiry",
-            5: "insurance_inquiry",
-            6: "location_inquiry",
-            7: "hours_inquiry",
-            8: "general_question",
-            9: "farewell"
-        }
-        
-        detected_intent = intent_mapping.get(intent_id, "general_question")
-        
-        # Generate response based on intent
-        response_templates = {
-            "greeting": [
-                "Hello! Welcome to Bright Smile Dental Clinic. How can I assist you today?",
-                "Hi there! I'm your dental assistant. What can I help you with?",
-                "Welcome! How may I help with your dental needs today?"
-            ],
-            "appointment_booking": [
-                "I'd be happy to help you book an appointment. What day works best for you?",
-                "Let's get you scheduled. Do you prefer a morning or afternoon appointment?",
-                "I can help you schedule a visit. What type of appointment do you need?"
-            ],
-            "symptom_inquiry": [
-                "I'm sorry to hear you're experiencing dental issues. Can you describe your symptoms in detail?",
-                "Let me help assess your dental concern. On a scale of 1-10, how severe is your pain?",
-                "To better understand your situation, could you tell me which tooth is bothering you?"
-            ],
-            "service_inquiry": [
-                "We offer a comprehensive range of dental services including cleanings, fillings, crowns, root canals, and cosmetic procedures. What specific service are you interested in?",
-                "Our clinic provides general dentistry, cosmetic procedures, orthodontics, and emergency care. Would you like details about any specific service?",
-                "From routine cleanings to advanced procedures, we offer complete dental care. What would you like to know more about?"
-            ],
-            "cost_inquiry": [
-                "Our pricing varies by procedure. For example, cleanings start at $120, fillings at $150, and crowns at $800. Would you like a specific cost estimate?",
-                "I can provide general pricing information or a personalized estimate based on your insurance. What procedure are you inquiring about?",
-                "We offer transparent pricing and work with most insurance plans. Which treatment are you interested in?"
-            ],
-            "insurance_inquiry": [
-                "We accept most major insurance plans including Delta Dental, Cigna, Aetna, and more. Would you like us to verify your specific coverage?",
-                "Our office works with a wide range of insurance providers. We'd be happy to check your benefits before your appointment.",
-                "Insurance coverage varies by plan. If you provide your insurance details, we can verify your coverage for specific procedures."
-            ],
-            "location_inquiry": [
-                "We're located at 123 Smile Street in Downtown Healthy City. Would you like directions?",
-                "Our clinic is at 123 Smile Street, with convenient parking and public transit access. Can I help you with directions?",
-                "You can find us at 123 Smile Street, Downtown. We're near Central Park with ample parking available."
-            ],
-            "hours_inquiry": [
-                "Our hours are Monday-Friday 8AM-6PM, Saturday 9AM-3PM, and we're closed on Sundays. We also have 24/7 emergency services.",
-                "We're open weekdays from 8AM to 6PM and Saturdays from 9AM to 3PM. How can we help you?",
-                "Our clinic operates Monday through Friday from 8AM to 6PM and Saturdays from 9AM to 3PM. We have on-call emergency services available 24/7."
-            ],
-            "general_question": [
-                "That's a great question. I'll do my best to help you with that.",
-                "I'd be happy to assist with your inquiry. Could you provide a bit more detail?",
-                "I'm here to help with any dental questions you might have."
-            ],
-            "farewell": [
-                "Thank you for chatting with us today! If you need anything else, don't hesitate to reach out.",
-                "Have a great day! Remember to brush and floss regularly.",
-                "Goodbye! We look forward to seeing your smile soon!"
-            ]
-        }
-        
-        import random
-        response_text = random.choice(response_templates.get(detected_intent, response_templates["general_question"]))
-        
-        # Handle emergency cases
-        if emergency_detected:
-            response_text = "🚨 DENTAL EMERGENCY DETECTED: Please call our emergency line immediately at (555) 911-TOOTH. For severe pain or swelling, take over-the-counter pain medication and apply a cold compress while waiting."
-        
-        # Generate suggested actions based on intent
-        suggested_actions = []
-        if detected_intent == "appointment_booking":
-            suggested_actions = ["Book appointment", "View available times", "See doctor profiles"]
-        elif detected_intent == "symptom_inquiry":
-            suggested_actions = ["Use tooth map", "Rate pain level", "View possible conditions"]
-        elif detected_intent == "service_inquiry":
-            suggested_actions = ["View service details", "See before/after gallery", "Check pricing"]
-        elif detected_intent == "cost_inquiry":
-            suggested_actions = ["Verify insurance", "View payment options", "Get detailed estimate"]
-        
-        # Translate response if needed
-        if request.language != Language.ENGLISH:
-            # In a real implementation, this would call a translation service
-            # For now, we'll just note that translation would happen
-            response_text = f"[Translated to {request.language.value}] {response_text}"
-        
-        # Store conversation in database if conversation_id provided
-        if request.conversation_id:
-            await db.conversations.update_one(
-                {"conversation_id": request.conversation_id},
-                {"$push": {"messages": {
-                    "timestamp": datetime.datetime.now(),
-                    "user_message": request.message,
-                    "bot_response": response_text,
-                    "intent": detected_intent,
-                    "emergency_detected": emergency_detected
-                }}},
-                upsert=True
-            )
-        
-        return ChatResponse(
-            response=response_text,
-            detected_intent=detected_intent,
-            suggested_actions=suggested_actions,
-            emergency_detected=emergency_detected
-        )
-        
-    except Exception as e:
-        logger.error(f"Error processing chat message: {e}")
-        return ChatResponse(
-            response="I apologize, but I'm having trouble processing your request right now. Please try again or contact our office directly at (555) 123-SMILE.",
-            emergency_detected=False
-        )
 
-async def schedule_appointment(request: AppointmentRequest) -> AppointmentResponse:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status_holder = {"status": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            metrics.inc("dental_ai_http_requests_total", route=path, method=scope["method"],
+                        status=str(status_holder["status"]))
+            metrics.observe("dental_ai_http_request_duration_seconds", time.perf_counter() - started, route=path)
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# ==================== PROFILING ====================
+
+# Opt-in CPU profiling of individual requests. A request is profiled when it
+# carries PROFILE_HEADER set to PROFILE_TOKEN, or at random with PROFILE_SAMPLE_RATE.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile").lower()
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+_PROFILE_NAME = re.compile(r"^[\w.-]+\.prof$")
+
+class _ProfiledCall:
     """
-    Schedule a dental appointment based on patient preferences and availability.
+    Drive a coroutine with the profiler enabled only while that coroutine is
+    running, so other requests interleaved on the event loop stay out of the profile.
     """
-    try:
-        # Check if patient exists
-        patient = await db.patients.find_one({"patient_id": request.patient_id})
-        if not patient:
-            raise HTTPException(status_code=404, detail="Patient not found")
-        
-        # Check doctor availability
-        available_doctors = ["Dr. Smith", "Dr. Johnson", "Dr. Williams", "Dr. Brown", "Dr. Jones"]
-        assigned_doctor = request.doctor_preference if request.doctor_preference in available_doctors else available_doctors[0]
-        
-        # Check time slot availability (simplified)
-        # In a real system, this would query a calendar database
-        available_times = ["8:00 AM", "9:00 AM", "10:00 AM", "11:00 AM", "1:00 PM", "2:00 PM", "3:00 PM", "4:00 PM"]
-        confirmed_time = request.preferred_time if request.preferred_time in available_times else available_times[0]
-        
-        # Determine appointment duration based on type
-        duration_mapping = {
-            AppointmentType.CONSULTATION: 60,
-            AppointmentType.CLEANING: 45,
-            AppointmentType.CHECKUP: 30,
-            AppointmentType.FILLING: 60,
-            AppointmentType.CROWN: 90,
-            AppointmentType.ROOT_CANAL: 120,
-            AppointmentType.EXTRACTION: 45,
-            AppointmentType.WHITENING: 90,
-            AppointmentType.EMERGENCY: 30
-        }
-        duration = duration_mapping.get(request.appointment_type, 60)
-        
-        # Determine cost based on appointment type
-        cost_mapping = {
-            AppointmentType.CONSULTATION: 75.0,
-            AppointmentType.CLEANING: 120.0,
-            AppointmentType.CHECKUP: 85.0,
-            AppointmentType.FILLING: 200.0,
-            AppointmentType.CROWN: 800.0,
-            AppointmentType.ROOT_CANAL: 900.0,
-            AppointmentType.EXTRACTION: 250.0,
-            AppointmentType.WHITENING: 400.0,
-            AppointmentType.EMERGENCY: 150.0
-        }
-        estimated_cost = cost_mapping.get(request.appointment_type, 100.0)
-        
-        # Calculate insurance coverage if provided
-        insurance_coverage = None
-        patient_responsibility = None
-        
-        if request.insurance_provider:
-            coverage_rates = {
-                InsuranceProvider.DELTA_DENTAL: 0.8,
-                InsuranceProvider.CIGNA: 0.7,
-                InsuranceProvider.AETNA: 0.75,
-                InsuranceProvider.METLIFE: 0.8,
-                InsuranceProvider.GUARDIAN: 0.7,
-                InsuranceProvider.UNITED_HEALTHCARE: 0.75,
-                InsuranceProvider.HUMANA: 0.7,
-                InsuranceProvider.BLUE_CROSS: 0.8,
-                InsuranceProvider.OTHER: 0.6,
-                InsuranceProvider.NONE: 0.0
-            }
-            
-            coverage_rate = coverage_rates.get(request.insurance_provider, 0.0)
-            insurance_coverage = estimated_cost * coverage_rate
-            patient_responsibility = estimated_cost - insurance_coverage
-        
-        # Generate appointment ID
-        import uuid
-        appointment_id = f"APT-{uuid.uuid4().hex[:8].upper()}"
-        
-        # Store appointment in database
-        appointment_data = {
-            "appointment_id": appointment_id,
-            "patient_id": request.patient_id,
-            "appointment_type": request.appointment_type,
-            "date": request.preferred_date,
-            "time": confirmed_time,
-            "doctor": assigned_doctor,
-            "duration_minutes": duration,
-            "estimated_cost": estimated_cost,
-            "insurance_provider": request.insurance_provider,
-            "insurance_coverage": insurance_coverage,
-            "patient_responsibility": patient_responsibility,
-            "notes": request.notes,
-            "status": AppointmentStatus.SCHEDULED,
-            "created_at": datetime.datetime.now()
-        }
-        
-        await db.appointments.insert_one(appointment_data)
-        
-        # Update patient record with next appointment
-        await db.patients.update_one(
-            {"patient_id": request.patient_id},
-            {"$set": {"next_appointment": request.preferred_date}}
-        )
-        
-        # Send confirmation (would integrate with SMS/email service)
-        logger.info(f"Appointment confirmation would be sent for appointment {appointment_id}")
-        
-        return AppointmentResponse(
-            appointment_id=appointment_id,
-            confirmed_date=request.preferred_date,
-            confirmed_time=confirmed_time,
-            doctor=assigned_doctor,
-            duration_minutes=duration,
-            estimated_cost=estimated_cost,
-            insurance_coverage=insurance_coverage,
-            patient_responsibility=patient_responsibility
-        )
-        
-    except HTTPException as http_ex:
-        raise http_ex
-    except Exception as e:
-        logger.error(f"Error scheduling appointment: {e}")
-        raise HTTPException(status_code=500, detail="Failed to schedule appointment")
 
-# ==================== API ENDPOINTS ====================
+    def __init__(self, coro, profiler: cProfile.Profile):
+        self.coro = coro
+        self.profiler = profiler
 
-@app.get("/")
-async def root():
-    return {"message": "Dental AI Service API", "version": "1.0.0", "status": "operational"}
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profiler.enable()
+            try:
+                if error is not None:
+                    yielded = self.coro.throw(error)
+                else:
+                    yielded = self.coro.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profiler.disable()
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:
+                value, error = None, e
 
-@app.post("/api/symptom-analysis", response_model=SymptomAnalysisResponse)
-async def symptom_analysis_endpoint(request: SymptomAnalysisRequest):
+class ProfileStore:
     """
-    Analyze dental symptoms and provide diagnosis and recommendations.
+    Directory of recent request profiles (cProfile .prof files with a JSON
+    sidecar), trimmed to the newest `max_files`.
     """
-    return await analyze_symptoms(request)
 
-@app.post("/api/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+    def __init__(self, directory: str, max_files: int):
+        self.directory = directory
+        self.max_files = max(1, max_files)
+        self._counter = 0
+
+    def save(self, profiler: cProfile.Profile, info: Dict[str, Any]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        self._counter += 1
+        slug = re.sub(r"[^\w]+", "_", info["path"]).strip("_")[:60] or "root"
+        stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        name = f"{stamp}-{os.getpid()}-{self._counter}-{info['method'].lower()}-{slug}.prof"
+        path = os.path.join(self.directory, name)
+        profiler.dump_stats(path)
+        with open(path + ".json", "w") as f:
+            json.dump({**info, "name": name, "created_at": datetime.datetime.utcnow().isoformat()}, f)
+        self._rotate()
+        return name
+
+    def _rotate(self):
+        names = sorted(n for n in os.listdir(self.directory) if _PROFILE_NAME.match(n))
+        for name in names[:-self.max_files]:
+            for path in (name, name + ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, path))
+                except OSError:
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in sorted((n for n in os.listdir(self.directory) if _PROFILE_NAME.match(n)), reverse=True):
+            try:
+                with open(os.path.join(self.directory, name + ".json")) as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                info = {"name": name}
+            info["size_bytes"] = os.path.getsize(os.path.join(self.directory, name))
+            entries.append(info)
+        return entries
+
+    def path_of(self, name: str) -> Optional[str]:
+        if not _PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+profile_store = ProfileStore(PROFILE_DIR, PROFILE_MAX_FILES)
+
+class ProfilingMiddleware:
     """
-    Process a chat message and generate an appropriate response.
+    ASGI middleware profiling selected requests with cProfile. Work the request
+    hands to inference threads or processes shows up as time spent awaiting.
+    Only installed when profiling is enabled.
     """
-    return await process_chat_message(request)
 
-@app.post("/api/appointments", response_model=AppointmentResponse)
-async def appointment_endpoint(request: AppointmentRequest):
+    def __init__(self, app, store: ProfileStore, token: Optional[str], header: str, sample_rate: float):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.header = header.encode("latin-1")
+        self.sample_rate = sample_rate
+
+    def _trigger(self, scope) -> Optional[str]:
+        if self.token:
+            for key, value in scope["headers"]:
+                if key == self.header:
+                    if hmac.compare_digest(value.decode("latin-1"), self.token):
+                        return "header"
+                    break
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        trigger = self._trigger(scope) if scope["type"] == "http" else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profiler = cProfile.Profile()
+        name = f"{scope['method']} {scope['path']}"
+        status_holder = {"status": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await _ProfiledCall(self.app(scope, receive, send_with_status), profiler)
+        finally:
+            info = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status_holder["status"],
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "trigger": trigger,
+            }
+            try:
+                saved = self.store.save(profiler, info)
+                logger.info(f"Profiled {name} ({info['duration_ms']} ms): {saved}")
+            except Exception as e:
+                logger.warning(f"Could not save profile for {name}: {e}")
+
+if PROFILING_ENABLED:
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        token=PROFILE_TOKEN,
+        header=PROFILE_HEADER,
+        sample_rate=PROFILE_SAMPLE_RATE
+    )
+
+# ==================== CACHING ====================
+
+class LRUCache:
     """
-    Schedule a dental appointment.
+    Size-bounded in-process cache with optional per-entry expiry.
     """
-    return await schedule_appointment(request)
 
-@app.get("/api/patients/{patient_id}", response_model=PatientRecord)
-async def get_patient(patient_id: str, current_user: dict = Depends(get_current_user)):
+    def __init__(self, maxsize: int, ttl_seconds: Optional[float] = None):
+        self.maxsize = max(1, maxsize)
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any, ttl_seconds: Optional[float] = None):
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "dental-ai:cache-invalidation")
+
+class CacheInvalidationBus:
+    """
+    Broadcasts cache invalidations to every worker over Redis pub/sub, so in-process
+    cache tiers drop entries changed by another worker.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        # Lets a worker skip its own messages; it already updated its local tier
+        self.origin = os.urandom(6).hex()
+        self._handlers: Dict[str, Callable[[str], None]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.received = 0
+
+    def register(self, kind: str, handler: Callable[[str], None]):
+        self._handlers[kind] = handler
+
+    async def publish(self, kind: str, key: str):
+        try:
+            await redis_client.publish(self.channel, f"{kind}:{self.origin}:{key}")
+        except Exception as e:
+            logger.warning(f"Cache invalidation publish failed for {kind}: {e}")
+
+    def _dispatch(self, data: str):
+        parts = data.split(":", 2)
+        if len(parts) != 3:
+            logger.warning(f"Ignoring malformed cache invalidation message: {data!r}")
+            return
+        kind, origin, key = parts
+        handler = self._handlers.get(kind)
+        if handler is not None and origin != self.origin:
+            self.received += 1
+            handler(key)
+
+    async def _listen(self):
+        while not self._closing:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                while not self._closing:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is not None:
+                        self._dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener error, reconnecting: {e}")
+                await asyncio.sleep(1.0)
+            finally:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = asyncio.create_task(self._listen())
+
+    async def close(self, timeout: float = 5.0):
+        if self._task is not None:
+            self._closing = True
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            self._task = None
+
+cache_invalidation_bus = CacheInvalidationBus(CACHE_INVALIDATION_CHANNEL)
+
+# ==================== FEATURE ENCODING ====================
+
+SYMPTOM_MODEL_PATH = os.getenv("SYMPTOM_MODEL_PATH", "./models/symptom_classifier.pkl")
+# Column schema stored next to the pickled model, e.g. ./models/symptom_classifier.schema.json
+SYMPTOM_SCHEMA_PATH = os.getenv("SYMPTOM_SCHEMA_PATH", os.path.splitext(SYMPTOM_MODEL_PATH)[0] + ".schema.json")
+SYMPTOM_FEATURE_SCHEMA_VERSION = "1"
+
+KNOWN_SYMPTOMS = (
+    "sharp_pain", "dull_pain", "throbbing", "sensitivity_hot",
+    "sensitivity_cold", "swelling", "bleeding", "bad_taste",
+    "bad_breath", "loose_tooth", "discoloration", "broken_tooth",
+    "difficulty_chewing", "jaw_pain", "headache", "fever"
+)
+
+class UnknownSymptomError(ValueError):
+    pass
+
+class SymptomSchemaMismatchError(RuntimeError):
+    pass
+
+class SymptomFeatureEncoder:
+    """
+    Encodes symptom analysis requests against a frozen column schema.
+
+    Columns are pain level, duration, one per known symptom, then one per tooth
+    location; the tooth columns are always present (all zero when no tooth is given)
+    so every row has the same width. Rows are written in place into float32 arrays
+    using precomputed column indices.
+    """
+
+    def __init__(self, symptoms: tuple, tooth_locations: tuple, version: str):
+        self.version = version
+        self.columns = (
+            ("pain_level", "duration_days")
+            + tuple(symptoms)
+            + tuple(f"location_{loc.value}" for loc in tooth_locations)
+        )
+        self.width = len(self.columns)
+        self._symptom_index = {symptom: 2 + i for i, symptom in enumerate(symptoms)}
+        tooth_offset = 2 + len(symptoms)
+        self._tooth_index = {loc: tooth_offset + i for i, loc in enumerate(tooth_locations)}
+
+    def validate(self, symptoms: List[str]):
+        unknown = [symptom for symptom in symptoms if symptom not in self._symptom_index]
+        if unknown:
+            raise UnknownSymptomError(f"Unknown symptoms: {', '.join(sorted(set(unknown)))}")
+
+    def encode_into(self, request: SymptomAnalysisRequest, row: np.ndarray):
+        """
+        Write the features of one request into a preallocated row.
+        """
+        symptom_index = self._symptom_index
+        row[:] = 0.0
+        row[0] = request.pain_level
+        row[1] = request.duration_days or 1
+        for symptom in request.symptoms:
+            column = symptom_index.get(symptom)
+            if column is None:
+                self.validate(request.symptoms)
+            row[column] = 1.0
+        if request.tooth_location:
+            row[self._tooth_index[request.tooth_location]] = 1.0
+
+    def encode(self, request: SymptomAnalysisRequest) -> np.ndarray:
+        features = np.empty((1, self.width), dtype=np.float32)
+        self.encode_into(request, features[0])
+        return features
+
+    def encode_batch(self, requests: List[SymptomAnalysisRequest]) -> np.ndarray:
+        features = np.empty((len(requests), self.width), dtype=np.float32)
+        for row, request in zip(features, requests):
+            self.encode_into(request, row)
+        return features
+
+    def schema(self) -> Dict[str, Any]:
+        return {"version": self.version, "columns": list(self.columns)}
+
+    def write_schema(self, path: str):
+        """
+        Save the schema next to a newly trained model.
+        """
+        with open(path, "w") as f:
+            json.dump(self.schema(), f, indent=2)
+
+    def check_model(self, classifier: Any, schema_path: str):
+        """
+        Refuse a pickled model that was trained against a different column schema.
+        """
+        n_features = getattr(classifier, "n_features_in_", None)
+        if n_features is not None and n_features != self.width:
+            raise SymptomSchemaMismatchError(
+                f"Symptom model expects {n_features} features, encoder produces {self.width}"
+            )
+        if not os.path.exists(schema_path):
+            logger.warning(f"No feature schema found at {schema_path}; assuming schema v{self.version}")
+            return
+        with open(schema_path) as f:
+            saved = json.load(f)
+        if saved.get("version") != self.version or saved.get("columns") != list(self.columns):
+            raise SymptomSchemaMismatchError(
+                f"Symptom model schema v{saved.get('version')} does not match encoder schema v{self.version}"
+            )
+
+symptom_feature_encoder = SymptomFeatureEncoder(
+    KNOWN_SYMPTOMS,
+    tuple(ToothLocation),
+    SYMPTOM_FEATURE_SCHEMA_VERSION
+)
+
+# ==================== AI MODELS ====================
+
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "./models/intent_classifier")
+INTENT_TOKENIZER_NAME = os.getenv("INTENT_TOKENIZER_NAME", "distilbert-base-uncased")
+
+# "background": load and warm up after startup, gated by /api/ready
+# "blocking":   load and warm up before the server accepts traffic
+# "lazy":       load each model on first use
+MODEL_LOAD_MODE = os.getenv("MODEL_LOAD_MODE", "background")
+# After a failed load, wait before retrying; doubles per consecutive failure
+MODEL_RELOAD_BACKOFF_SECONDS = float(os.getenv("MODEL_RELOAD_BACKOFF_SECONDS", "5"))
+MODEL_RELOAD_BACKOFF_MAX_SECONDS = float(os.getenv("MODEL_RELOAD_BACKOFF_MAX_SECONDS", "300"))
+MODEL_WARMUP_MESSAGES = [m for m in os.getenv(
+    "MODEL_WARMUP_MESSAGES",
+    "hello|I need to book an appointment|my tooth hurts when I drink something cold"
+).split("|") if m]
+
+# Intent classifier backend: "torch" (transformers) or "onnx" (ONNX Runtime)
+INTENT_BACKEND = os.getenv("INTENT_BACKEND", "torch")
+INTENT_ONNX_PATH = os.getenv("INTENT_ONNX_PATH", "./models/intent_classifier_onnx/model.int8.onnx")
+INTENT_ONNX_THREADS = int(os.getenv("INTENT_ONNX_THREADS", "0"))  # 0 = ONNX Runtime default
+
+MODEL_NOT_LOADED = "unloaded"
+
+# Map intent ID to intent name
+INTENT_MAPPING = {
+    0: "greeting",
+    1: "appointment_booking",
+    2: "symptom_inquiry",
+    3: "service_inquiry",
+    4: "cost_inquiry",
+    5: "insurance_inquiry",
+    6: "location_inquiry",
+    7: "hours_inquiry",
+    8: "general_question",
+    9: "farewell"
+}
+
+def model_directory_fingerprint(path: str) -> str:
+    """
+    Short hash of the file names, sizes and modification times in a model directory
+    (or of a single model file).
+    """
+    digest = hashlib.sha1()
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        return digest.hexdigest()[:12]
+    for root, _, files in sorted(os.walk(path)):
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            digest.update(f"{os.path.relpath(os.path.join(root, name), path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:12]
+
+class IntentBackend:
+    """
+    Interface for intent classifier runtimes.
+
+    `load()` prepares the model and returns a version string; `predict()` maps a
+    batch of messages to intent ids (keys of INTENT_MAPPING).
+    """
+
+    name = "base"
+
+    def load(self) -> str:
+        raise NotImplementedError
+
+    def predict(self, messages: List[str]) -> List[int]:
+        raise NotImplementedError
+
+class TorchIntentBackend(IntentBackend):
+    name = "torch"
+
+    def __init__(self, model_path: str = INTENT_MODEL_PATH, tokenizer_name: str = INTENT_TOKENIZER_NAME):
+        self.model_path = model_path
+        self.tokenizer_name = tokenizer_name
+        self.tokenizer = None
+        self.model = None
+
+    def load(self) -> str:
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+        self.tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(self.model_path)
+        self.model.eval()
+        return f"{self.name}-{model_directory_fingerprint(self.model_path)}"
+
+    def predict(self, messages: List[str]) -> List[int]:
+        import torch
+        with metrics.span("intent.tokenize"):
+            inputs = self.tokenizer(messages, return_tensors="pt", truncation=True, padding=True)
+        with metrics.span("intent.forward"), torch.inference_mode():
+            outputs = self.model(**inputs)
+        return outputs.logits.argmax(-1).tolist()
+
+class OnnxIntentBackend(IntentBackend):
+    """
+    Intent classifier exported to ONNX (optionally int8-quantized) and run with
+    ONNX Runtime on CPU. Create the model with `python dental_ai_service.py export-onnx`.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path: str = INTENT_ONNX_PATH, tokenizer_name: str = INTENT_TOKENIZER_NAME, threads: int = INTENT_ONNX_THREADS):
+        self.model_path = model_path
+        self.tokenizer_name = tokenizer_name
+        self.threads = threads
+        self.tokenizer = None
+        self.session = None
+        self.input_names: frozenset = frozenset()
+
+    def load(self) -> str:
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads > 0:
+            options.intra_op_num_threads = self.threads
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = frozenset(i.name for i in self.session.get_inputs())
+        return f"{self.name}-{model_directory_fingerprint(self.model_path)}"
+
+    def predict(self, messages: List[str]) -> List[int]:
+        with metrics.span("intent.tokenize"):
+            encoded = self.tokenizer(messages, return_tensors="np", truncation=True, padding=True)
+            feeds = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+        with metrics.span("intent.forward"):
+            logits = self.session.run(None, feeds)[0]
+        return logits.argmax(-1).tolist()
+
+INTENT_BACKENDS: Dict[str, Callable[[], IntentBackend]] = {
+    "torch": TorchIntentBackend,
+    "onnx": OnnxIntentBackend,
+}
+
+def create_intent_backend(name: str) -> IntentBackend:
+    if name not in INTENT_BACKENDS:
+        raise ValueError(f"Unknown intent backend '{name}', expected one of {sorted(INTENT_BACKENDS)}")
+    return INTENT_BACKENDS[name]()
+
+class ModelUnavailableError(RuntimeError):
+    pass
+
+def symptom_model_version(model_bytes: bytes) -> str:
+    return f"{symptom_feature_encoder.version}-{hashlib.sha1(model_bytes).hexdigest()[:12]}"
+
+class ModelManager:
+    """
+    Owns the AI models and their load, warm-up and readiness state.
+
+    Models are loaded on first use (from an inference worker thread, never the event
+    loop) or ahead of traffic by `start()`. Load failures are recorded and reported
+    by the readiness endpoint instead of leaving missing globals behind, and the
+    failed model is not reloaded until its backoff has passed.
+    """
+
+    def __init__(self, load_mode: str, warmup_messages: List[str], intent_backend: str):
+        self.load_mode = load_mode
+        self.warmup_messages = warmup_messages
+        self.intent_backend_name = intent_backend
+        self.intent_backend: Optional[IntentBackend] = None
+        self.symptom_classifier = None
+        self.symptom_model_bytes: Optional[bytes] = None
+        self._sentiment_analyzer = None
+        # Identify the loaded models; cached results are keyed on these
+        self.intent_model_version = MODEL_NOT_LOADED
+        self.symptom_model_version = MODEL_NOT_LOADED
+        self.errors: Dict[str, str] = {}
+        # name -> (consecutive failures, monotonic time of the next allowed attempt)
+        self._failures: Dict[str, tuple] = {}
+        self.warmed_up = False
+        self.load_seconds: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self._started = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _load_intent_model(self):
+        started = time.perf_counter()
+        backend = create_intent_backend(self.intent_backend_name)
+        self.intent_model_version = backend.load()
+        self.intent_backend = backend
+        self.load_seconds["intent"] = time.perf_counter() - started
+        logger.info(f"Intent model ({backend.name}) loaded in {self.load_seconds['intent']:.1f}s")
+
+    def _load_symptom_model(self):
+        started = time.perf_counter()
+        with open(SYMPTOM_MODEL_PATH, "rb") as f:
+            model_bytes = f.read()
+        classifier = pickle.loads(model_bytes)
+        symptom_feature_encoder.check_model(classifier, SYMPTOM_SCHEMA_PATH)
+        self.symptom_classifier = classifier
+        # Kept so inference worker processes run exactly this model
+        self.symptom_model_bytes = model_bytes
+        self.symptom_model_version = symptom_model_version(model_bytes)
+        self.load_seconds["symptom"] = time.perf_counter() - started
+        logger.info(f"Symptom model loaded in {self.load_seconds['symptom']:.1f}s")
+
+    def _ensure(self, name: str, loaded: Callable[[], bool], load: Callable[[], None]):
+        if loaded():
+            return
+        with self._lock:
+            if loaded():
+                return
+            failures, retry_at = self._failures.get(name, (0, 0.0))
+            if time.monotonic() < retry_at:
+                raise ModelUnavailableError(f"{name} model failed to load: {self.errors.get(name)}")
+            try:
+                load()
+                self.errors.pop(name, None)
+                self._failures.pop(name, None)
+            except Exception as e:
+                backoff = min(MODEL_RELOAD_BACKOFF_SECONDS * 2 ** failures, MODEL_RELOAD_BACKOFF_MAX_SECONDS)
+                self._failures[name] = (failures + 1, time.monotonic() + backoff)
+                self.errors[name] = str(e)
+                logger.error(f"Error loading {name} model: {e}; retrying in {backoff:.0f}s")
+                raise
+
+    def get_intent_backend(self) -> IntentBackend:
+        self._ensure("intent", lambda: self.intent_backend is not None, self._load_intent_model)
+        return self.intent_backend
+
+    def get_symptom_classifier(self) -> Any:
+        self._ensure("symptom", lambda: self.symptom_classifier is not None, self._load_symptom_model)
+        return self.symptom_classifier
+
+    @property
+    def sentiment_analyzer(self) -> Any:
+        # Not on any request path yet, so it is only loaded if something asks for it
+        def load():
+            from transformers import pipeline
+            self._sentiment_analyzer = pipeline("sentiment-analysis")
+        self._ensure("sentiment", lambda: self._sentiment_analyzer is not None, load)
+        return self._sentiment_analyzer
+
+    def load_all(self):
+        # Failures are recorded in self.errors by _ensure
+        for loader in (self.get_intent_backend, self.get_symptom_classifier):
+            try:
+                loader()
+            except Exception:
+                pass
+
+    async def warm_up(self):
+        """
+        Run a few real inferences so the first user request does not pay for lazy
+        initialization inside the frameworks.
+        """
+        started = time.perf_counter()
+        if self.intent_backend is not None and self.warmup_messages:
+            await inference_executor.run_torch(classify_intents, self.warmup_messages)
+            for message in self.warmup_messages:
+                await inference_executor.run_torch(classify_intents, [message])
+        if self.symptom_classifier is not None:
+            sample = SymptomAnalysisRequest(pain_level=5, symptoms=["sensitivity_cold"])
+            await inference_executor.predict_symptoms(symptom_feature_encoder.encode(sample))
+        self.warmed_up = True
+        self.load_seconds["warmup"] = time.perf_counter() - started
+        logger.info(f"AI models warmed up in {self.load_seconds['warmup']:.1f}s")
+
+    async def _load_and_warm_up(self):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.load_all)
+            if not self.errors:
+                await self.warm_up()
+                logger.info("AI models loaded successfully")
+        except Exception as e:
+            self.errors["warmup"] = str(e)
+            logger.error(f"Error warming up AI models: {e}")
+        finally:
+            self._started.set()
+
+    async def start(self):
+        if self.load_mode == "lazy":
+            self._started.set()
+        elif self.load_mode == "blocking":
+            await self._load_and_warm_up()
+        else:
+            self._task = asyncio.create_task(self._load_and_warm_up())
+
+    async def wait_started(self):
+        await self._started.wait()
+
+    @property
+    def ready(self) -> bool:
+        if self.load_mode == "lazy":
+            return not self.errors
+        return self._started.is_set() and self.warmed_up and not self.errors
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "load_mode": self.load_mode,
+            "ready": self.ready,
+            "warmed_up": self.warmed_up,
+            "intent_backend": self.intent_backend_name,
+            "models": {
+                "intent": self.intent_model_version if self.intent_backend is not None else MODEL_NOT_LOADED,
+                "symptom": self.symptom_model_version if self.symptom_classifier is not None else MODEL_NOT_LOADED,
+            },
+            "load_seconds": self.load_seconds,
+            "errors": self.errors,
+            "retry_in_seconds": {
+                name: max(0.0, retry_at - time.monotonic()) for name, (_, retry_at) in self._failures.items()
+            },
+        }
+
+model_manager = ModelManager(MODEL_LOAD_MODE, MODEL_WARMUP_MESSAGES, INTENT_BACKEND)
+
+# ==================== INFERENCE EXECUTION ====================
+
+# Model calls never run on the event loop: torch inference releases the GIL and runs
+# in a thread pool, sklearn inference can optionally be moved to worker processes.
+INFERENCE_THREAD_WORKERS = int(os.getenv("INFERENCE_THREAD_WORKERS", "2"))
+INFERENCE_PROCESS_WORKERS = int(os.getenv("INFERENCE_PROCESS_WORKERS", "0"))  # 0 = use threads for sklearn
+# Worker processes are never forked from the threaded server: "spawn" or "forkserver"
+INFERENCE_PROCESS_START_METHOD = os.getenv("INFERENCE_PROCESS_START_METHOD", "spawn")
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "256"))
+
+class InferenceOverloadedError(RuntimeError):
+    pass
+
+class InferencePool:
+    """
+    Bounded asyncio front-end to a concurrent.futures executor.
+
+    At most `max_workers` calls are handed to the executor at once; further callers
+    wait on the event loop, and beyond `max_pending` waiters new calls are rejected
+    so a backlog of model work cannot build up without limit.
+    """
+
+    def __init__(self, name: str, executor: Optional[Executor], max_workers: int, max_pending: int):
+        self.name = name
+        self.executor = executor
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(max_workers)
+
+        self.active = 0
+        self.waiting = 0
+        self.peak_active = 0
+        self.peak_waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_queue_time = 0.0
+        self.total_run_time = 0.0
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        if self.waiting >= self.max_pending:
+            self.rejected += 1
+            raise InferenceOverloadedError(f"Inference pool '{self.name}' is saturated")
+
+        queued = time.perf_counter()
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        started = time.perf_counter()
+        self.total_queue_time += started - queued
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            self.total_run_time += time.perf_counter() - started
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed
+        return {
+            "executor": type(self.executor).__name__,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "active": self.active,
+            "waiting": self.waiting,
+            "saturation": self.active / self.max_workers if self.max_workers else 0.0,
+            "peak_active": self.peak_active,
+            "peak_waiting": self.peak_waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_queue_ms": self.total_queue_time / finished * 1000.0 if finished else 0.0,
+            "avg_run_ms": self.total_run_time / finished * 1000.0 if finished else 0.0,
+        }
+
+# Worker-process copy of the symptom classifier (process pool only)
+_worker_symptom_classifier = None
+
+def _init_symptom_worker(model_bytes: bytes, version: str):
+    """
+    Load the parent's symptom model, with the same schema check ModelManager applies.
+    """
+    global _worker_symptom_classifier
+    if symptom_model_version(model_bytes) != version:
+        raise SymptomSchemaMismatchError(f"Worker cannot serve symptom model {version}")
+    classifier = pickle.loads(model_bytes)
+    symptom_feature_encoder.check_model(classifier, SYMPTOM_SCHEMA_PATH)
+    _worker_symptom_classifier = classifier
+
+def _predict_symptoms_in_process(feature_matrix: np.ndarray) -> np.ndarray:
+    return _worker_symptom_classifier.predict_proba(feature_matrix)
+
+def _predict_symptoms_in_thread(feature_matrix: np.ndarray) -> np.ndarray:
+    return model_manager.get_symptom_classifier().predict_proba(feature_matrix)
+
+class InferenceExecutor:
+    """
+    Execution layer that every model call goes through.
+    """
+
+    def __init__(self, thread_workers: int, process_workers: int, max_pending: int):
+        thread_workers = max(1, thread_workers)
+        self.torch_pool = InferencePool(
+            "torch",
+            ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="torch-inference"),
+            thread_workers,
+            max_pending
+        )
+        self.use_processes = process_workers > 0
+        self.process_workers = process_workers
+        # Version of the symptom model the worker processes were started with
+        self.process_model_version: Optional[str] = None
+        if self.use_processes:
+            # Created on first use, once the parent has loaded and checked the model
+            self.sklearn_pool = InferencePool("sklearn", None, process_workers, max_pending)
+        else:
+            self.sklearn_pool = InferencePool(
+                "sklearn",
+                ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="sklearn-inference"),
+                thread_workers,
+                max_pending
+            )
+
+    async def run_torch(self, fn: Callable, *args, **kwargs) -> Any:
+        return await self.torch_pool.run(fn, *args, **kwargs)
+
+    async def _ensure_process_pool(self):
+        """
+        Start (or restart) the worker processes on the parent's current symptom model.
+        """
+        if model_manager.symptom_classifier is None:
+            await self.torch_pool.run(model_manager.get_symptom_classifier)
+        version = model_manager.symptom_model_version
+        if self.sklearn_pool.executor is not None and self.process_model_version == version:
+            return
+        if self.sklearn_pool.executor is not None:
+            self.sklearn_pool.executor.shutdown(wait=False, cancel_futures=True)
+        self.sklearn_pool.executor = ProcessPoolExecutor(
+            max_workers=self.process_workers,
+            mp_context=multiprocessing.get_context(INFERENCE_PROCESS_START_METHOD),
+            initializer=_init_symptom_worker,
+            initargs=(model_manager.symptom_model_bytes, version)
+        )
+        self.process_model_version = version
+
+    async def predict_symptoms(self, feature_matrix: np.ndarray) -> np.ndarray:
+        if self.use_processes:
+            await self._ensure_process_pool()
+            return await self.sklearn_pool.run(_predict_symptoms_in_process, feature_matrix)
+        return await self.sklearn_pool.run(_predict_symptoms_in_thread, feature_matrix)
+
+    def shutdown(self):
+        for pool in (self.torch_pool, self.sklearn_pool):
+            if pool.executor is not None:
+                pool.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "torch": self.torch_pool.stats(),
+            "sklearn": self.sklearn_pool.stats(),
+        }
+
+inference_executor = InferenceExecutor(
+    INFERENCE_THREAD_WORKERS,
+    INFERENCE_PROCESS_WORKERS,
+    INFERENCE_MAX_PENDING
+)
+
+# ==================== INFERENCE BATCHING ====================
+
+# Micro-batching settings for intent classification
+INTENT_BATCH_MAX_SIZE = int(os.getenv("INTENT_BATCH_MAX_SIZE", "32"))
+INTENT_BATCH_MAX_WAIT_MS = float(os.getenv("INTENT_BATCH_MAX_WAIT_MS", "5"))
+
+async def collect_batch(queue: asyncio.Queue, max_items: int, max_wait: float) -> List[Any]:
+    """
+    Wait for one queued item, then keep taking items until `max_items` are collected
+    or `max_wait` seconds have passed since the first one arrived.
+    """
+    batch = [await queue.get()]
+    deadline = time.perf_counter() + max_wait
+    while len(batch) < max_items:
+        # Take whatever is already queued without yielding to the loop
+        try:
+            batch.append(queue.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+class InferenceBatcher:
+    """
+    Collects concurrent inference requests into a single batch.
+
+    Callers await `submit()` with one input; a background worker drains the queue
+    into batches of at most `max_batch_size` items, waiting no longer than
+    `max_wait_ms` after the first item arrives, awaits `run_batch` once per batch and
+    resolves each caller's future with its own result.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], Awaitable[List[Any]]], max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        # Tuning statistics
+        self.batches = 0
+        self.items = 0
+        self.max_observed_batch = 0
+        self.last_batch_size = 0
+        self.total_wait = 0.0
+        self.max_wait_observed = 0.0
+        self.total_run_time = 0.0
+        self.errors = 0
+
+    def _ensure_worker(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = await collect_batch(self._queue, self.max_batch_size, self.max_wait)
+            started = time.perf_counter()
+            inputs = [item for item, _, _ in batch]
+            try:
+                results = await self.run_batch(inputs)
+                if len(results) != len(batch):
+                    raise RuntimeError(f"Batch of {len(batch)} inputs returned {len(results)} results")
+                for (_, future, _), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                self.errors += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finished = time.perf_counter()
+            self._record(batch, started, finished)
+
+    def _record(self, batch: List[tuple], started: float, finished: float):
+        size = len(batch)
+        self.batches += 1
+        self.items += size
+        self.last_batch_size = size
+        self.max_observed_batch = max(self.max_observed_batch, size)
+        self.total_run_time += finished - started
+        for _, _, enqueued in batch:
+            wait = started - enqueued
+            self.total_wait += wait
+            self.max_wait_observed = max(self.max_wait_observed, wait)
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "items": self.items,
+            "last_batch_size": self.last_batch_size,
+            "max_observed_batch_size": self.max_observed_batch,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "avg_wait_ms": self.total_wait / self.items * 1000.0 if self.items else 0.0,
+            "max_wait_observed_ms": self.max_wait_observed * 1000.0,
+            "avg_batch_run_ms": self.total_run_time / self.batches * 1000.0 if self.batches else 0.0,
+            "errors": self.errors,
+        }
+
+def classify_intents(messages: List[str]) -> List[int]:
+    """
+    Run one padded forward pass of the intent model over a batch of messages.
+    """
+    return model_manager.get_intent_backend().predict(messages)
+
+async def classify_intents_off_loop(messages: List[str]) -> List[int]:
+    return await inference_executor.run_torch(classify_intents, messages)
+
+intent_batcher = InferenceBatcher(
+    classify_intents_off_loop,
+    max_batch_size=INTENT_BATCH_MAX_SIZE,
+    max_wait_ms=INTENT_BATCH_MAX_WAIT_MS
+)
+
+# ==================== CONVERSATION LOGGING ====================
+
+# Conversations are stored as a metadata document in db.conversations plus fixed-size
+# message buckets in db.conversation_messages, so no document grows without bound.
+CONVERSATION_BUCKET_SIZE = int(os.getenv("CONVERSATION_BUCKET_SIZE", "100"))
+
+def conversation_bucket_operations(conversation_id: str, messages: List[Dict[str, Any]], first_seq: int, bucket_size: int) -> List[UpdateOne]:
+    """
+    Build bucket upserts for messages numbered from `first_seq`.
+
+    Each message carries its sequence number, and `$addToSet` makes the upserts
+    idempotent, so a retried flush or migration never duplicates messages.
+    """
+    buckets: Dict[int, List[Dict[str, Any]]] = {}
+    for offset, message in enumerate(messages):
+        seq = first_seq + offset
+        buckets.setdefault(seq // bucket_size, []).append({**message, "seq": seq})
+    return [
+        UpdateOne(
+            {"conversation_id": conversation_id, "bucket": bucket},
+            {"$addToSet": {"messages": {"$each": items}}},
+            upsert=True
+        )
+        for bucket, items in buckets.items()
+    ]
+
+async def migrate_conversation(conversation_id: str) -> bool:
+    """
+    Move a legacy single-document conversation's `messages` array into buckets.
+    """
+    for _ in range(5):
+        legacy = await db.conversations.find_one({"conversation_id": conversation_id, "messages": {"$exists": True}})
+        if not legacy:
+            return False
+        messages = legacy.get("messages") or []
+        bucket_size = legacy.get("bucket_size") or CONVERSATION_BUCKET_SIZE
+        operations = conversation_bucket_operations(conversation_id, messages, 0, bucket_size)
+        if operations:
+            await db.conversation_messages.bulk_write(operations, ordered=False)
+        # Only drop the array if no message was appended to it in the meantime
+        result = await db.conversations.update_one(
+            {"_id": legacy["_id"], "messages": {"$size": len(messages)}},
+            {
+                "$set": {"message_count": len(messages), "bucket_size": bucket_size, "updated_at": datetime.datetime.now()},
+                "$unset": {"messages": ""}
+            }
+        )
+        if result.modified_count:
+            return True
+    raise RuntimeError(f"Conversation {conversation_id} kept changing during migration")
+
+async def migrate_legacy_conversations() -> int:
+    """
+    Migrate every legacy single-document conversation to bucketed storage.
+    """
+    migrated = 0
+    cursor = db.conversations.find({"messages": {"$exists": True}}, {"conversation_id": 1})
+    async for doc in cursor:
+        if await migrate_conversation(doc["conversation_id"]):
+            migrated += 1
+    logger.info(f"Migrated {migrated} conversations to bucketed storage")
+    return migrated
+
+async def reserve_conversation_messages(conversation_id: str, messages: List[Dict[str, Any]]) -> List[UpdateOne]:
+    """
+    Atomically reserve sequence numbers for new messages and return their bucket upserts.
+    """
+    now = datetime.datetime.now()
+
+    async def reserve():
+        return await db.conversations.find_one_and_update(
+            # Legacy documents still holding a messages array are excluded here, which
+            # makes the upsert collide on the unique conversation_id index
+            {"conversation_id": conversation_id, "messages": {"$exists": False}},
+            {
+                "$inc": {"message_count": len(messages)},
+                "$setOnInsert": {"bucket_size": CONVERSATION_BUCKET_SIZE, "created_at": now},
+                "$set": {"updated_at": now}
+            },
+            projection={"message_count": 1, "bucket_size": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    try:
+        meta = await reserve()
+    except DuplicateKeyError:
+        # A legacy conversation or a concurrent first write for the same conversation
+        await migrate_conversation(conversation_id)
+        meta = await reserve()
+    first_seq = meta["message_count"] - len(messages)
+    return conversation_bucket_operations(conversation_id, messages, first_seq, meta["bucket_size"])
+
+CONVERSATION_FLUSH_SIZE = int(os.getenv("CONVERSATION_FLUSH_SIZE", "500"))
+CONVERSATION_FLUSH_INTERVAL_MS = float(os.getenv("CONVERSATION_FLUSH_INTERVAL_MS", "200"))
+CONVERSATION_BUFFER_MAX = int(os.getenv("CONVERSATION_BUFFER_MAX", "10000"))
+CONVERSATION_FLUSH_RETRIES = int(os.getenv("CONVERSATION_FLUSH_RETRIES", "3"))
+CONVERSATION_SHUTDOWN_TIMEOUT = float(os.getenv("CONVERSATION_SHUTDOWN_TIMEOUT", "10"))
+
+class ConversationWriteBuffer:
+    """
+    Write-behind buffer for chat conversation messages.
+
+    Messages are queued without touching the database and flushed with a single
+    unordered `bulk_write` once `flush_size` messages are buffered or
+    `flush_interval_ms` has passed. The queue is bounded: when Mongo falls behind and
+    the buffer fills up, `append` waits for space instead of growing memory.
+    """
+
+    def __init__(self, max_buffered: int, flush_size: int, flush_interval_ms: float, retries: int):
+        self.max_buffered = max_buffered
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000.0
+        self.retries = retries
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._closing = False
+
+        self.appended = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.backpressure_waits = 0
+        self.total_flush_time = 0.0
+
+    def _ensure_worker(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_buffered)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def append(self, conversation_id: str, message: Dict[str, Any]):
+        if self._closing:
+            # Shutting down: write through so nothing is lost
+            await self._write([(conversation_id, message)])
+            return
+        self._ensure_worker()
+        if self._queue.full():
+            self.backpressure_waits += 1
+        await self._queue.put((conversation_id, message))
+        self.appended += 1
+
+    async def _run(self):
+        while True:
+            batch = await collect_batch(self._queue, self.flush_size, self.flush_interval)
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, batch: List[tuple]):
+        # Messages of a conversation keep their order through consecutive sequence numbers
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for conversation_id, message in batch:
+            grouped.setdefault(conversation_id, []).append(message)
+        operations: Dict[str, List[UpdateOne]] = {}
+
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                # Sequence numbers are reserved once per conversation, even across retries
+                pending = [cid for cid in grouped if cid not in operations]
+                reserved = await asyncio.gather(
+                    *(reserve_conversation_messages(cid, grouped[cid]) for cid in pending),
+                    return_exceptions=True
+                )
+                for cid, result in zip(pending, reserved):
+                    if not isinstance(result, Exception):
+                        operations[cid] = result
+                errors = [result for result in reserved if isinstance(result, Exception)]
+                if errors:
+                    raise errors[0]
+                await db.conversation_messages.bulk_write(
+                    [operation for ops in operations.values() for operation in ops],
+                    ordered=False
+                )
+                self.flushes += 1
+                self.written += len(batch)
+                break
+            except Exception as e:
+                self.failed_flushes += 1
+                if attempt == self.retries:
+                    self.dropped += len(batch)
+                    logger.error(f"Dropping {len(batch)} conversation messages after failed flush: {e}")
+                else:
+                    logger.warning(f"Conversation flush failed (attempt {attempt + 1}): {e}")
+                    await asyncio.sleep(0.1 * 2 ** attempt)
+        self.total_flush_time += time.perf_counter() - started
+        metrics.observe("dental_ai_stage_duration_seconds", time.perf_counter() - started, stage="conversation.flush")
+
+    async def close(self, timeout: float = CONVERSATION_SHUTDOWN_TIMEOUT):
+        """
+        Flush everything still buffered, then stop the background writer.
+        """
+        self._closing = True
+        if self._queue is not None and self._worker is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Timed out flushing {self._queue.qsize()} buffered conversation messages")
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": self._queue.qsize() if self._queue is not None else 0,
+            "max_buffered": self.max_buffered,
+            "appended": self.appended,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "backpressure_waits": self.backpressure_waits,
+            "avg_flush_ms": self.total_flush_time / self.flushes * 1000.0 if self.flushes else 0.0,
+        }
+
+conversation_writer = ConversationWriteBuffer(
+    CONVERSATION_BUFFER_MAX,
+    CONVERSATION_FLUSH_SIZE,
+    CONVERSATION_FLUSH_INTERVAL_MS,
+    CONVERSATION_FLUSH_RETRIES
+)
+
+# ==================== AUTHENTICATION ====================
+
+# JWT settings
+SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-for-jwt")
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+# Password hashing
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    to_encode = data.copy()
+    if expires_delta:
+        expire = datetime.datetime.utcnow() + expires_delta
+    else:
+        expire = datetime.datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+PRINCIPAL_CACHE_ENABLED = os.getenv("PRINCIPAL_CACHE_ENABLED", "true").lower() == "true"
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "300"))
+PRINCIPAL_CACHE_LOCAL_SIZE = int(os.getenv("PRINCIPAL_CACHE_LOCAL_SIZE", "10000"))
+
+class PrincipalCache:
+    """
+    Cache of verified principals keyed by the SHA-256 digest of the bearer token.
+
+    An entry never outlives the token's `exp`, so a cache hit skips both signature
+    verification and the user lookup. Revoked tokens are recorded in Redis until
+    they would have expired and dropped from every worker's local tier via the
+    invalidation bus.
+    """
+
+    def __init__(self, enabled: bool, ttl_seconds: int, local_size: int):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.local = LRUCache(local_size, ttl_seconds)
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.revocations = 0
+        self.rejected_revoked = 0
+        cache_invalidation_bus.register("principal", self._drop_local)
+
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _redis_key(digest: str) -> str:
+        return f"principal:{digest}"
+
+    @staticmethod
+    def _revoked_key(digest: str) -> str:
+        return f"revoked-token:{digest}"
+
+    def _drop_local(self, digest: str):
+        self.local.pop(digest)
+
+    def _remaining_seconds(self, payload: Dict[str, Any]) -> float:
+        exp = payload.get("exp")
+        if exp is None:
+            return float(self.ttl_seconds)
+        return min(float(self.ttl_seconds), float(exp) - time.time())
+
+    def get_local(self, digest: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        user = self.local.get(digest)
+        if user is not None:
+            self.local_hits += 1
+        return user
+
+    async def lookup(self, digest: str) -> tuple:
+        """
+        Return (revoked, cached user or None) from Redis. Revocations are honoured
+        even when caching is disabled.
+        """
+        if not self.enabled:
+            return bool(await redis_client.exists(self._revoked_key(digest))), None
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.exists(self._revoked_key(digest))
+        pipe.get(self._redis_key(digest))
+        revoked, payload = await pipe.execute()
+        if revoked:
+            self.rejected_revoked += 1
+            return True, None
+        if payload is None:
+            self.misses += 1
+            return False, None
+        self.redis_hits += 1
+        return False, json_util.loads(payload)
+
+    async def store(self, digest: str, payload: Dict[str, Any], user: Dict[str, Any], shared: bool = True):
+        if not self.enabled:
+            return
+        ttl = self._remaining_seconds(payload)
+        if ttl <= 0:
+            return
+        self.local.set(digest, user, ttl)
+        if shared:
+            try:
+                await redis_client.set(self._redis_key(digest), json_util.dumps(user), ex=max(1, int(ttl)))
+            except Exception as e:
+                logger.warning(f"Principal cache store failed: {e}")
+
+    async def revoke(self, token: str, payload: Dict[str, Any]):
+        """
+        Revoke a token until its expiry, on every worker.
+        """
+        digest = self.digest(token)
+        exp = payload.get("exp")
+        remaining = float(exp) - time.time() if exp is not None else float(ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+        self.revocations += 1
+        self.local.pop(digest)
+        if remaining > 0:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.set(self._revoked_key(digest), "1", ex=max(1, int(remaining) + 1))
+            pipe.delete(self._redis_key(digest))
+            await pipe.execute()
+        await cache_invalidation_bus.publish("principal", digest)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "local_entries": len(self.local),
+            "local_max_entries": self.local.maxsize,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.local_hits + self.redis_hits) / lookups, 4) if lookups else 0.0,
+            "revocations": self.revocations,
+            "rejected_revoked": self.rejected_revoked
+        }
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_ENABLED, PRINCIPAL_CACHE_TTL_SECONDS, PRINCIPAL_CACHE_LOCAL_SIZE)
+
+def decode_access_token(token: str) -> Dict[str, Any]:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id: str = payload.get("sub")
+        if user_id is None:
+            raise credentials_exception
+    except jwt.PyJWTError:
+        raise credentials_exception
+    return payload
+
+async def get_current_user(token: str = Header(...)):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    digest = principal_cache.digest(token)
+    user = principal_cache.get_local(digest)
+    if user is not None:
+        return user
+
+    payload = decode_access_token(token)
+    try:
+        revoked, user = await principal_cache.lookup(digest)
+    except Exception as e:
+        # Without Redis the revocation list is unknown, so a revoked token could pass:
+        # fail closed rather than accept (and cache) it
+        logger.error(f"Principal cache lookup failed: {e}")
+        raise HTTPException(status_code=503, detail="Token revocation status unavailable")
+    if revoked:
+        raise credentials_exception
+
+    if user is None:
+        user = await db.users.find_one({"_id": payload["sub"]})
+        if user is None:
+            raise credentials_exception
+        await principal_cache.store(digest, payload, user)
+    else:
+        await principal_cache.store(digest, payload, user, shared=False)
+    return user
+
+# ==================== RESULT CACHING ====================
+
+class TieredCache:
+    """
+    Two-tier cache: an in-process LRU in front of the shared Redis client.
+
+    Redis keys are namespaced by the current model version, and the local tier is
+    cleared whenever that version changes, so results from a previous model are
+    never served. Redis failures are logged and treated as misses.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        version: Callable[[], str],
+        ttl_seconds: int,
+        local_size: int,
+        encode: Callable[[Any], str] = json.dumps,
+        decode: Callable[[str], Any] = json.loads,
+        enabled: bool = True
+    ):
+        self.namespace = namespace
+        self.version = version
+        self.ttl_seconds = ttl_seconds
+        self.encode = encode
+        self.decode = decode
+        self.enabled = enabled
+        self.local = LRUCache(local_size, ttl_seconds)
+        self._local_version = None
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.namespace}:{self._local_version}:{key}"
+
+    def _check_version(self) -> bool:
+        version = self.version()
+        if self._local_version != version:
+            self.local.clear()
+            self._local_version = version
+        # Nothing is cached until the model has been loaded and versioned
+        return version != MODEL_NOT_LOADED
+
+    async def get_many(self, keys: List[str]) -> List[Any]:
+        if not self.enabled or not self._check_version():
+            return [None] * len(keys)
+        results = [self.local.get(key) for key in keys]
+        self.local_hits += sum(1 for result in results if result is not None)
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            try:
+                cached = await redis_client.mget([self._redis_key(keys[i]) for i in missing])
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning(f"Cache lookup failed for {self.namespace}: {e}")
+                cached = [None] * len(missing)
+            for i, payload in zip(missing, cached):
+                if payload is None:
+                    self.misses += 1
+                    continue
+                results[i] = self.decode(payload)
+                self.local.set(keys[i], results[i])
+                self.redis_hits += 1
+        return results
+
+    async def set_many(self, keys: List[str], values: List[Any]):
+        if not self.enabled or not keys or not self._check_version():
+            return
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for key, value in zip(keys, values):
+                self.local.set(key, value)
+                pipe.set(self._redis_key(key), self.encode(value), ex=self.ttl_seconds)
+            await pipe.execute()
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f"Cache store failed for {self.namespace}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "model_version": self.version(),
+            "local_entries": len(self.local),
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+            "redis_errors": self.redis_errors,
+        }
+
+SYMPTOM_CACHE_ENABLED = os.getenv("SYMPTOM_CACHE_ENABLED", "true").lower() == "true"
+SYMPTOM_CACHE_TTL_SECONDS = int(os.getenv("SYMPTOM_CACHE_TTL_SECONDS", "3600"))
+SYMPTOM_CACHE_LOCAL_SIZE = int(os.getenv("SYMPTOM_CACHE_LOCAL_SIZE", "4096"))
+
+class SymptomResultCache:
+    """
+    Read-through cache for the model part of symptom analysis.
+
+    Entries are keyed on a canonical hash of everything the analysis depends on
+    (pain level, symptom set, tooth, duration as fed to the model) and hold the
+    patient-independent analysis so they can be shared across patients.
+    """
+
+    def __init__(self, enabled: bool, ttl_seconds: int, local_size: int):
+        self.cache = TieredCache(
+            "symptom-analysis",
+            self._version,
+            ttl_seconds,
+            local_size,
+            encode=lambda analysis: analysis.json(),
+            decode=SymptomAnalysisResponse.parse_raw,
+            enabled=enabled
+        )
+
+    @staticmethod
+    def _version() -> str:
+        # Cached analyses include treatment costs, so a tariff change invalidates them too
+        version = model_manager.symptom_model_version
+        return version if version == MODEL_NOT_LOADED else f"{version}-{tariff_engine.version}"
+
+    @staticmethod
+    def _key(request: SymptomAnalysisRequest) -> str:
+        canonical = json.dumps([
+            request.pain_level,
+            sorted(set(request.symptoms)),
+            request.tooth_location.value if request.tooth_location else None,
+            request.duration_days or 1
+        ], separators=(",", ":"))
+        return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+    async def get(self, request: SymptomAnalysisRequest) -> Optional[SymptomAnalysisResponse]:
+        return (await self.get_many([request]))[0]
+
+    async def get_many(self, requests: List[SymptomAnalysisRequest]) -> List[Optional[SymptomAnalysisResponse]]:
+        return await self.cache.get_many([self._key(request) for request in requests])
+
+    async def set(self, request: SymptomAnalysisRequest, analysis: SymptomAnalysisResponse):
+        await self.set_many([request], [analysis])
+
+    async def set_many(self, requests: List[SymptomAnalysisRequest], analyses: List[SymptomAnalysisResponse]):
+        await self.cache.set_many([self._key(request) for request in requests], analyses)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+symptom_result_cache = SymptomResultCache(
+    SYMPTOM_CACHE_ENABLED,
+    SYMPTOM_CACHE_TTL_SECONDS,
+    SYMPTOM_CACHE_LOCAL_SIZE
+)
+
+INTENT_CACHE_ENABLED = os.getenv("INTENT_CACHE_ENABLED", "true").lower() == "true"
+INTENT_CACHE_TTL_SECONDS = int(os.getenv("INTENT_CACHE_TTL_SECONDS", "86400"))
+INTENT_CACHE_LOCAL_SIZE = int(os.getenv("INTENT_CACHE_LOCAL_SIZE", "10000"))
+INTENT_CACHE_MAX_MESSAGE_LENGTH = int(os.getenv("INTENT_CACHE_MAX_MESSAGE_LENGTH", "200"))
+INTENT_CACHE_PRESEED_TOP_N = int(os.getenv("INTENT_CACHE_PRESEED_TOP_N", "500"))
+
+class IntentCache:
+    """
+    Cache of detected intents for repeated chat messages.
+
+    Messages are normalized by case folding and collapsing whitespace, which the
+    uncased intent tokenizer ignores anyway, so a hit returns exactly the intent a
+    forward pass would. Long messages are rarely repeated and are not cached.
+    """
+
+    def __init__(self, enabled: bool, ttl_seconds: int, local_size: int, max_message_length: int):
+        self.max_message_length = max_message_length
+        self.cache = TieredCache(
+            "chat-intent",
+            lambda: model_manager.intent_model_version,
+            ttl_seconds,
+            local_size,
+            encode=str,
+            decode=int,
+            enabled=enabled
+        )
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        return " ".join(message.casefold().split())
+
+    def _key(self, message: str) -> Optional[str]:
+        normalized = self.normalize(message)
+        if not normalized or len(normalized) > self.max_message_length:
+            return None
+        return hashlib.sha256(normalized.encode()).hexdigest()[:32]
+
+    async def get(self, message: str) -> Optional[int]:
+        key = self._key(message)
+        if key is None:
+            return None
+        return (await self.cache.get_many([key]))[0]
+
+    async def set(self, message: str, intent_id: int):
+        key = self._key(message)
+        if key is not None:
+            await self.cache.set_many([key], [intent_id])
+
+    async def preseed(self, top_n: int):
+        """
+        Classify the most frequent recent chat messages ahead of traffic.
+
+        Only the newest `top_n * 10` message buckets are scanned so the query stays
+        bounded on large histories.
+        """
+        if not self.cache.enabled or top_n <= 0:
+            return
+        try:
+            pipeline = [
+                {"$sort": {"_id": -1}},
+                {"$limit": top_n * 10},
+                {"$unwind": "$messages"},
+                {"$group": {"_id": {"$toLower": "$messages.user_message"}, "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+                {"$limit": top_n}
+            ]
+            messages = {}
+            async for doc in db.conversation_messages.aggregate(pipeline):
+                if doc["_id"] and self._key(doc["_id"]) is not None:
+                    messages.setdefault(self._key(doc["_id"]), self.normalize(doc["_id"]))
+            keys = list(messages)
+            cached = await self.cache.get_many(keys)
+            missing = [key for key, value in zip(keys, cached) if value is None]
+            for start in range(0, len(missing), INTENT_BATCH_MAX_SIZE):
+                chunk = missing[start:start + INTENT_BATCH_MAX_SIZE]
+                intent_ids = await classify_intents_off_loop([messages[key] for key in chunk])
+                await self.cache.set_many(chunk, intent_ids)
+            logger.info(f"Intent cache pre-seeded with {len(keys)} messages ({len(missing)} classified)")
+        except Exception as e:
+            logger.error(f"Error pre-seeding intent cache: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+intent_cache = IntentCache(
+    INTENT_CACHE_ENABLED,
+    INTENT_CACHE_TTL_SECONDS,
+    INTENT_CACHE_LOCAL_SIZE,
+    INTENT_CACHE_MAX_MESSAGE_LENGTH
+)
+
+# ==================== PATIENT CACHE ====================
+
+PATIENT_CACHE_ENABLED = os.getenv("PATIENT_CACHE_ENABLED", "true").lower() == "true"
+PATIENT_CACHE_TTL_SECONDS = int(os.getenv("PATIENT_CACHE_TTL_SECONDS", "300"))
+PATIENT_CACHE_LOCAL_SIZE = int(os.getenv("PATIENT_CACHE_LOCAL_SIZE", "10000"))
+
+class PatientCache:
+    """
+    Read-through cache of patient documents.
+
+    Callers ask for the fields they need; the local tier keeps whatever fields have
+    been fetched for a patient and serves any request they cover, so hot paths like
+    insurance lookups only load a projection. Full documents are also shared through
+    Redis. Writes invalidate the entry in Redis and, via the invalidation bus, in
+    every worker's local tier.
+    """
+
+    def __init__(self, enabled: bool, ttl_seconds: int, local_size: int):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        # patient_id -> (document, fetched field names or None for the full document)
+        self.local = LRUCache(local_size, ttl_seconds)
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        cache_invalidation_bus.register("patient", self._drop_local)
+
+    @staticmethod
+    def _redis_key(patient_id: str) -> str:
+        return f"patient:{patient_id}"
+
+    def _drop_local(self, patient_id: str):
+        self.local.pop(patient_id)
+
+    def _from_local(self, patient_id: str, fields: Optional[tuple]) -> Optional[Dict[str, Any]]:
+        entry = self.local.get(patient_id)
+        if entry is None:
+            return None
+        doc, fetched = entry
+        if fetched is None or (fields is not None and fetched.issuperset(fields)):
+            return doc
+        return None
+
+    def _store_local(self, patient_id: str, doc: Dict[str, Any], fields: Optional[tuple]):
+        fetched = None
+        if fields is not None:
+            previous = self.local.get(patient_id)
+            if previous is not None and previous[1] is None:
+                return
+            fetched = frozenset(fields) | {"patient_id"}
+            if previous is not None:
+                doc = {**previous[0], **doc}
+                fetched |= previous[1]
+        self.local.set(patient_id, (doc, fetched))
+
+    async def get(self, patient_id: str, fields: Optional[tuple] = None) -> Optional[Dict[str, Any]]:
+        """
+        Return the patient document (only `fields` are guaranteed present when given),
+        or None if the patient does not exist.
+        """
+        return (await self.get_many([patient_id], fields)).get(patient_id)
+
+    async def get_many(self, patient_ids: List[str], fields: Optional[tuple] = None) -> Dict[str, Dict[str, Any]]:
+        if not self.enabled:
+            return await self._fetch(patient_ids, fields)
+
+        found: Dict[str, Dict[str, Any]] = {}
+        missing = []
+        for patient_id in dict.fromkeys(patient_ids):
+            doc = self._from_local(patient_id, fields)
+            if doc is not None:
+                found[patient_id] = doc
+                self.local_hits += 1
+            else:
+                missing.append(patient_id)
+
+        if missing:
+            try:
+                cached = await redis_client.mget([self._redis_key(pid) for pid in missing])
+            except Exception as e:
+                logger.warning(f"Patient cache lookup failed: {e}")
+                cached = [None] * len(missing)
+            still_missing = []
+            for patient_id, payload in zip(missing, cached):
+                if payload is None:
+                    still_missing.append(patient_id)
+                    continue
+                doc = json_util.loads(payload)
+                self._store_local(patient_id, doc, None)
+                found[patient_id] = doc
+                self.redis_hits += 1
+            missing = still_missing
+
+        if missing:
+            self.misses += len(missing)
+            # Extend the projection with fields already cached so the entry keeps them
+            projection = None
+            if fields is not None:
+                projection = set(fields)
+                for patient_id in missing:
+                    entry = self.local.get(patient_id)
+                    if entry is not None and entry[1] is not None:
+                        projection |= entry[1]
+                projection = tuple(projection)
+            fetched = await self._fetch(missing, projection)
+            for patient_id, doc in fetched.items():
+                self._store_local(patient_id, doc, projection)
+                found[patient_id] = doc
+            if projection is None and fetched:
+                await self._store_redis(list(fetched.values()))
+        return found
+
+    async def _fetch(self, patient_ids: List[str], fields: Optional[tuple]) -> Dict[str, Dict[str, Any]]:
+        projection = {field: 1 for field in fields} if fields is not None else None
+        if projection is not None:
+            projection["patient_id"] = 1
+        if len(patient_ids) == 1:
+            doc = await db.patients.find_one({"patient_id": patient_ids[0]}, projection)
+            return {patient_ids[0]: doc} if doc else {}
+        docs = {}
+        async for doc in db.patients.find({"patient_id": {"$in": patient_ids}}, projection):
+            docs[doc["patient_id"]] = doc
+        return docs
+
+    async def _store_redis(self, docs: List[Dict[str, Any]]):
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for doc in docs:
+                pipe.set(self._redis_key(doc["patient_id"]), json_util.dumps(doc), ex=self.ttl_seconds)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Patient cache store failed: {e}")
+
+    async def invalidate(self, patient_id: str):
+        if not self.enabled:
+            return
+        self.invalidations += 1
+        self.local.pop(patient_id)
+        try:
+            await redis_client.delete(self._redis_key(patient_id))
+        except Exception as e:
+            logger.warning(f"Patient cache invalidation failed: {e}")
+        await cache_invalidation_bus.publish("patient", patient_id)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "local_entries": len(self.local),
+            "local_max_entries": self.local.maxsize,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+patient_cache = PatientCache(
+    PATIENT_CACHE_ENABLED,
+    PATIENT_CACHE_TTL_SECONDS,
+    PATIENT_CACHE_LOCAL_SIZE
+)
+
+# ==================== PATIENT IMPORT ====================
+
+PATIENT_IMPORT_BATCH_SIZE = int(os.getenv("PATIENT_IMPORT_BATCH_SIZE", "1000"))
+PATIENT_IMPORT_MAX_ERRORS = int(os.getenv("PATIENT_IMPORT_MAX_ERRORS", "1000"))
+PATIENT_IMPORT_MAX_RECORD_LENGTH = int(os.getenv("PATIENT_IMPORT_MAX_RECORD_LENGTH", "65536"))
+PATIENT_IMPORT_PROGRESS_TTL_SECONDS = int(os.getenv("PATIENT_IMPORT_PROGRESS_TTL_SECONDS", "86400"))
+
+IMPORT_MEDIA_TYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/json-lines": "ndjson",
+}
+
+# CSV columns holding lists (";"-separated) and JSON objects
+_PATIENT_LIST_FIELDS = {name for name, field in PatientRecord.__fields__.items() if field.shape == SHAPE_LIST}
+_PATIENT_DICT_FIELDS = {name for name, field in PatientRecord.__fields__.items() if field.shape == SHAPE_DICT}
+
+class RecordSplitter:
+    """
+    Incrementally splits decoded upload text into (line number, record) pairs.
+
+    A record is one line or, when `quoted` (CSV), as many lines as it takes to
+    close its quotes. Only the record being read is held; one longer than
+    `max_length` characters is dropped and returned as None.
+    """
+
+    def __init__(self, quoted: bool, max_length: int):
+        self.quoted = quoted
+        self.max_length = max_length
+        self.line = 0
+        self._start = 1
+        self._parts: List[str] = []
+        self._length = 0
+        self._quotes = 0
+        self._oversized = False
+
+    def _append(self, text: str):
+        if self.quoted:
+            self._quotes += text.count('"')
+        if self._oversized:
+            return
+        self._length += len(text)
+        if self._length > self.max_length:
+            self._oversized = True
+            self._parts = []
+        else:
+            self._parts.append(text)
+
+    def _finish(self) -> tuple:
+        record = None if self._oversized else "".join(self._parts)
+        item = (self._start, record)
+        self._start = self.line + 1
+        self._parts, self._length, self._quotes, self._oversized = [], 0, 0, False
+        return item
+
+    def feed(self, text: str) -> List[tuple]:
+        records = []
+        *lines, rest = text.split("\n")
+        for piece in lines:
+            self._append(piece)
+            self.line += 1
+            if self.quoted and self._quotes % 2:
+                # The newline is inside a quoted field
+                self._append("\n")
+                continue
+            records.append(self._finish())
+        self._append(rest)
+        return records
+
+    def close(self) -> List[tuple]:
+        if not self._parts and not self._oversized:
+            return []
+        self.line += 1
+        return [self._finish()]
+
+def csv_patient_fields(header: List[str], values: List[str]) -> Dict[str, Any]:
+    """
+    Map a CSV row onto PatientRecord fields: empty cells are left out, list
+    columns are split on ";" and object columns are parsed as JSON.
+    """
+    if len(values) != len(header):
+        raise ValueError(f"Expected {len(header)} columns, got {len(values)}")
+    data: Dict[str, Any] = {}
+    for name, value in zip(header, values):
+        value = value.strip()
+        if not value:
+            continue
+        if name in _PATIENT_LIST_FIELDS:
+            data[name] = [item.strip() for item in value.split(";") if item.strip()]
+        elif name in _PATIENT_DICT_FIELDS:
+            data[name] = json.loads(value)
+        else:
+            data[name] = value
+    return data
+
+def describe_validation_error(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors())
+    return str(error)
+
+class PatientImportJob:
+    """
+    One streaming patient import.
+
+    Records are validated as they arrive and inserted in unordered bulk writes of
+    `batch_size`; the next batch is parsed while the previous one is written, so
+    at most two batches are held at a time. Row errors are counted, with the
+    first `max_errors` kept for the report. Progress is published to Redis after
+    every batch so any worker can answer status queries.
+    """
+
+    def __init__(self, import_id: str, upload_format: str, batch_size: int = PATIENT_IMPORT_BATCH_SIZE,
+                 max_errors: int = PATIENT_IMPORT_MAX_ERRORS):
+        self.import_id = import_id
+        self.format = upload_format
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.status = "running"
+        self.bytes_received = 0
+        self.rows = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.started_at = datetime.datetime.now()
+        self.finished_at: Optional[datetime.datetime] = None
+        self._header: Optional[List[str]] = None
+
+    @staticmethod
+    def redis_key(import_id: str) -> str:
+        return f"patient-import:{import_id}"
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "import_id": self.import_id,
+            "status": self.status,
+            "format": self.format,
+            "bytes_received": self.bytes_received,
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+            "errors_truncated": self.failed > len(self.errors),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+    async def publish(self, only_new: bool = False) -> bool:
+        """
+        Store the current report; with `only_new`, only if the import id is unused.
+        """
+        try:
+            stored = await redis_client.set(
+                self.redis_key(self.import_id), dumps_json(self.report()),
+                ex=PATIENT_IMPORT_PROGRESS_TTL_SECONDS, nx=only_new
+            )
+            return bool(stored)
+        except Exception as e:
+            logger.warning(f"Patient import progress update failed: {e}")
+            return True
+
+    def _error(self, line: int, patient_id: Optional[str], message: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "patient_id": patient_id, "error": message})
+
+    def _parse(self, line: int, record: Optional[str]) -> Optional[Dict[str, Any]]:
+        if record is None:
+            self.rows += 1
+            self._error(line, None, f"Record exceeds {PATIENT_IMPORT_MAX_RECORD_LENGTH} characters")
+            return None
+        if not record.strip():
+            return None
+        data = None
+        try:
+            if self.format == "csv":
+                values = next(csv.reader([record]))
+                if self._header is None:
+                    self._header = [name.strip() for name in values]
+                    return None
+                self.rows += 1
+                data = csv_patient_fields(self._header, values)
+            else:
+                self.rows += 1
+                data = json.loads(record)
+                if not isinstance(data, dict):
+                    raise ValueError("Expected a JSON object")
+            return mongo_dates(PatientRecord.parse_obj(data).dict())
+        except (ValueError, csv.Error) as e:
+            patient_id = data.get("patient_id") if isinstance(data, dict) else None
+            self._error(line, patient_id if isinstance(patient_id, str) else None, describe_validation_error(e))
+            return None
+
+    async def _write(self, batch: List[tuple]):
+        with metrics.span("patient_import.write"):
+            try:
+                result = await db.patients.bulk_write([InsertOne(doc) for _, doc in batch], ordered=False)
+                self.inserted += result.inserted_count
+            except BulkWriteError as e:
+                self.inserted += e.details.get("nInserted", 0)
+                for write_error in e.details.get("writeErrors", []):
+                    line, doc = batch[write_error["index"]]
+                    message = ("Patient ID already exists" if write_error.get("code") == 11000
+                               else write_error.get("errmsg", "Write failed"))
+                    self._error(line, doc["patient_id"], message)
+        await self.publish()
+
+    async def run(self, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        splitter = RecordSplitter(self.format == "csv", PATIENT_IMPORT_MAX_RECORD_LENGTH)
+        batch: List[tuple] = []
+        writing: Optional[asyncio.Task] = None
+
+        async def flush():
+            nonlocal batch, writing
+            if writing is not None:
+                await writing
+            writing = asyncio.create_task(self._write(batch))
+            batch = []
+
+        def take(records: List[tuple]):
+            for line, record in records:
+                doc = self._parse(line, record)
+                if doc is not None:
+                    batch.append((line, doc))
+
+        try:
+            async for chunk in chunks:
+                self.bytes_received += len(chunk)
+                take(splitter.feed(decoder.decode(chunk)))
+                if len(batch) >= self.batch_size:
+                    await flush()
+                # Validation is CPU-bound; let other requests run between chunks
+                await asyncio.sleep(0)
+            take(splitter.feed(decoder.decode(b"", final=True)) + splitter.close())
+            if batch:
+                await flush()
+            if writing is not None:
+                await writing
+            self.status = "completed"
+        except BaseException:
+            self.status = "failed"
+            if writing is not None and not writing.done():
+                writing.cancel()
+            raise
+        finally:
+            self.finished_at = datetime.datetime.now()
+            await self.publish()
+        return self.report()
+
+# ==================== DATA EXPORT ====================
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_MAX_BATCH_SIZE = int(os.getenv("EXPORT_MAX_BATCH_SIZE", "10000"))
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))
+
+class ExportDataset(NamedTuple):
+    collection: str
+    fields: List[str]
+    # Dates stored as midnight datetimes, exported as dates
+    date_fields: frozenset = frozenset()
+    # Array whose elements are exported as one row each, with their own fields
+    unwind: Optional[str] = None
+    unwind_fields: List[str] = []
+
+    @property
+    def columns(self) -> List[str]:
+        return ["_id"] + self.fields + self.unwind_fields
+
+EXPORT_DATASETS: Dict[str, ExportDataset] = {
+    "patients": ExportDataset(
+        "patients",
+        list(PatientRecord.__fields__),
+        frozenset(name for name, field in PatientRecord.__fields__.items() if field.type_ is datetime.date)
+    ),
+    "appointments": ExportDataset(
+        "appointments",
+        ["appointment_id", "patient_id", "appointment_type", "date", "time", "start", "end", "doctor",
+         "duration_minutes", "estimated_cost", "insurance_provider", "insurance_coverage",
+         "patient_responsibility", "notes", "status", "created_at"],
+        frozenset({"date"})
+    ),
+    # Conversation messages are stored in buckets; each message is a row
+    "conversations": ExportDataset(
+        "conversation_messages",
+        ["conversation_id", "bucket"],
+        unwind="messages",
+        unwind_fields=list(ConversationMessage.__fields__)
+    ),
+}
+
+def export_id_bound(value: str) -> Any:
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
+def csv_cell(value: Any) -> Any:
+    """
+    A CSV cell in the format the patient import reads back.
+    """
+    if value is None:
+        return ""
+    if type(value) in (str, int, float):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, list):
+        return ";".join(str(item) for item in value)
+    if isinstance(value, dict):
+        return dumps_json(value).decode("utf-8")
+    return value
+
+async def export_documents(
+    dataset: ExportDataset,
+    columns: List[str],
+    after_id: Optional[str] = None,
+    before_id: Optional[str] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    limit: int = 0
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Yield the export rows of each document in `_id` order, reading through a
+    cursor with a server-side projection of `columns`. Bounds are exclusive, so
+    passing the last exported `_id` as `after_id` resumes an export.
+    """
+    id_range: Dict[str, Any] = {}
+    if after_id:
+        id_range["$gt"] = export_id_bound(after_id)
+    if before_id:
+        id_range["$lt"] = export_id_bound(before_id)
+    outer = [name for name in dataset.fields if name in columns]
+    inner = [name for name in dataset.unwind_fields if name in columns]
+    projection = {"_id": 1, **{name: 1 for name in outer}}
+    if dataset.unwind:
+        # Elements are needed even when none of their fields are selected
+        projection.update({f"{dataset.unwind}.{name}": 1 for name in inner or ["seq"]})
+
+    cursor = db[dataset.collection].find(
+        {"_id": id_range} if id_range else {},
+        projection,
+        sort=[("_id", 1)],
+        batch_size=batch_size,
+        limit=limit
+    )
+    async for doc in cursor:
+        row: Dict[str, Any] = {"_id": str(doc["_id"])}
+        for name in outer:
+            value = doc.get(name)
+            if name in dataset.date_fields and isinstance(value, datetime.datetime):
+                value = value.date()
+            row[name] = value
+        if not dataset.unwind:
+            yield [row]
+            continue
+        elements = sorted(doc.get(dataset.unwind) or [], key=lambda element: element.get("seq", 0))
+        yield [{**row, **{name: element.get(name) for name in inner}} for element in elements]
+
+async def export_chunks(
+    dataset_name: str,
+    export_format: str,
+    columns: Optional[List[str]] = None,
+    header: bool = True,
+    stats: Optional[Dict[str, Any]] = None,
+    **query: Any
+) -> AsyncIterator[bytes]:
+    """
+    Stream a dataset as NDJSON or CSV in chunks of roughly EXPORT_CHUNK_BYTES.
+
+    Chunks end on document boundaries, so an interrupted file only ever loses its
+    last, partially written line. `stats` (documents, rows, last_id) is updated
+    as chunks are produced.
+    """
+    dataset = EXPORT_DATASETS[dataset_name]
+    columns = [name for name in dataset.columns if columns is None or name == "_id" or name in columns]
+    stats = stats if stats is not None else {}
+    stats.update(documents=0, rows=0, last_id=None)
+
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if header:
+            writer.writerow(columns)
+        async for rows in export_documents(dataset, columns, **query):
+            writer.writerows([csv_cell(row[name]) for name in columns] for row in rows)
+            stats["documents"] += 1
+            stats["rows"] += len(rows)
+            if rows:
+                stats["last_id"] = rows[0]["_id"]
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+        return
+
+    pending: List[bytes] = []
+    size = 0
+    async for rows in export_documents(dataset, columns, **query):
+        for row in rows:
+            line = dumps_json(row) + b"\n"
+            pending.append(line)
+            size += len(line)
+        stats["documents"] += 1
+        stats["rows"] += len(rows)
+        if rows:
+            stats["last_id"] = rows[0]["_id"]
+        if size >= EXPORT_CHUNK_BYTES:
+            yield b"".join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b"".join(pending)
+
+def export_columns(dataset_name: str, fields: Optional[str]) -> Optional[List[str]]:
+    """
+    Parse a comma-separated column selection (None for every column).
+    """
+    if not fields:
+        return None
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in EXPORT_DATASETS[dataset_name].columns]
+    if unknown:
+        raise ValueError(f"Unknown fields for {dataset_name}: {', '.join(unknown)}")
+    return requested
+
+def prepare_export_resume(path: str, window_bytes: int = 4 * 1024 * 1024) -> Optional[str]:
+    """
+    Trim an interrupted NDJSON export back to its last complete document and
+    return that document's `_id` to resume after (None to start over).
+
+    The trailing partial line and every row of the last document are removed,
+    since a document's rows may have been cut off part way.
+    """
+    with open(path, "r+b") as f:
+        size = f.seek(0, os.SEEK_END)
+        start = max(0, size - window_bytes)
+        f.seek(start)
+        tail = f.read()
+        lines = tail[:tail.rfind(b"\n") + 1].splitlines(keepends=True)
+        offset = start
+        if start and lines:
+            # The first line in the window may be cut off
+            offset += len(lines.pop(0))
+        entries = []  # (_id, file offset just past the line)
+        for line in lines:
+            offset += len(line)
+            if line.strip():
+                entries.append((json.loads(line)["_id"], offset))
+
+        keep = len(entries)
+        while keep and entries[keep - 1][0] == entries[-1][0]:
+            keep -= 1
+        if keep:
+            f.truncate(entries[keep - 1][1])
+            return entries[keep - 1][0]
+        if start:
+            raise ValueError(f"No complete document in the last {window_bytes} bytes of {path}")
+        f.truncate(0)
+        return None
+
+async def export_to_file(dataset_name: str, export_format: str, path: str, resume: bool = False,
+                         columns: Optional[List[str]] = None, **query: Any) -> Dict[str, Any]:
+    """
+    Write an export to `path` ('-' for stdout). With `resume`, an interrupted
+    NDJSON export at `path` is trimmed and continued after its last document.
+    """
+    mode = "wb"
+    if resume and path != "-" and os.path.exists(path):
+        if export_format != "ndjson":
+            raise ValueError("Only NDJSON exports can be resumed")
+        query["after_id"] = prepare_export_resume(path)
+        mode = "ab"
+    stats: Dict[str, Any] = {}
+    out = sys.stdout.buffer if path == "-" else open(path, mode)
+    try:
+        async for chunk in export_chunks(dataset_name, export_format, columns, stats=stats, **query):
+            out.write(chunk)
+        out.flush()
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    return stats
+
+# ==================== APPOINTMENT AVAILABILITY ====================
+
+CLINIC_DOCTORS = [d.strip() for d in os.getenv(
+    "CLINIC_DOCTORS", "Dr. Smith,Dr. Johnson,Dr. Williams,Dr. Brown,Dr. Jones"
+).split(",") if d.strip()]
+CLINIC_OPEN_TIME = os.getenv("CLINIC_OPEN_TIME", "08:00")
+CLINIC_CLOSE_TIME = os.getenv("CLINIC_CLOSE_TIME", "17:00")
+# Comma-separated HH:MM-HH:MM ranges when no appointment may run, e.g. lunch
+CLINIC_BREAKS = os.getenv("CLINIC_BREAKS", "12:00-13:00")
+APPOINTMENT_SLOT_MINUTES = int(os.getenv("APPOINTMENT_SLOT_MINUTES", "15"))
+# How long a loaded day is trusted before it is re-read; bookings made by other
+# workers are also pushed through the invalidation bus
+AVAILABILITY_REFRESH_SECONDS = float(os.getenv("AVAILABILITY_REFRESH_SECONDS", "30"))
+APPOINTMENT_BOOKING_ATTEMPTS = int(os.getenv("APPOINTMENT_BOOKING_ATTEMPTS", "3"))
+# Widest date range a single availability search may cover, and how far ahead
+# appointments can be searched or booked
+AVAILABILITY_MAX_DAYS = int(os.getenv("AVAILABILITY_MAX_DAYS", "62"))
+
+APPOINTMENT_DURATION_MINUTES: Dict[AppointmentType, int] = {
+    AppointmentType.CONSULTATION: 60,
+    AppointmentType.CLEANING: 45,
+    AppointmentType.CHECKUP: 30,
+    AppointmentType.FILLING: 60,
+    AppointmentType.CROWN: 90,
+    AppointmentType.ROOT_CANAL: 120,
+    AppointmentType.EXTRACTION: 45,
+    AppointmentType.WHITENING: 90,
+    AppointmentType.EMERGENCY: 30
+}
+
+_CLOCK_TIME_FORMATS = ("%I:%M %p", "%I:%M%p", "%I %p", "%H:%M")
+
+def parse_clock_time(value: str) -> Optional[datetime.time]:
+    """
+    Parse "9:00 AM", "1:30PM", "2 PM" or "14:30"; None if unrecognised.
+    """
+    text = value.strip().upper()
+    for fmt in _CLOCK_TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt).time()
+        except ValueError:
+            continue
+    return None
+
+def format_clock_time(value: datetime.time) -> str:
+    hour = value.hour % 12 or 12
+    return f"{hour}:{value.minute:02d} {'AM' if value.hour < 12 else 'PM'}"
+
+def day_start(day: datetime.date) -> datetime.datetime:
+    return datetime.datetime.combine(day, datetime.time.min)
+
+def booking_horizon(today: datetime.date) -> datetime.date:
+    """
+    Last day that can be searched or booked; keeps the availability index bounded.
+    """
+    return today + timedelta(days=AVAILABILITY_MAX_DAYS - 1)
+
+def legacy_appointment_day(value: Any) -> Optional[datetime.date]:
+    """
+    The day of an appointment `date` stored as a datetime, date or ISO string.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+class SlotConflictError(Exception):
+    pass
+
+def new_appointment_id() -> str:
+    return f"APT-{uuid.uuid4().hex[:8].upper()}"
+
+class AvailabilityIndex:
+    """
+    Per-doctor, per-day slot bitmaps for appointment booking.
+
+    Each day is split into fixed slots from opening time; bit i of a doctor's day
+    mask is set when slot i is booked. The source of truth is the
+    `appointment_slots` collection, one document per booked slot with a unique
+    (doctor, date, slot) index, so concurrent reservations of overlapping slots
+    cannot both succeed. Days are loaded with a single query and then answered
+    from memory.
+    """
+
+    def __init__(self, doctors: List[str], open_time: str, close_time: str, breaks: str,
+                 slot_minutes: int, refresh_seconds: float):
+        self.doctors = list(doctors)
+        self.slot_minutes = slot_minutes
+        self.open_minutes = self._minutes(open_time)
+        self.slots_per_day = (self._minutes(close_time) - self.open_minutes) // slot_minutes
+        if self.slots_per_day <= 0:
+            raise ValueError("Clinic closing time must be after opening time")
+        self.day_mask = (1 << self.slots_per_day) - 1
+        blocked = 0
+        for span in filter(None, (b.strip() for b in breaks.split(","))):
+            start, end = (self._minutes(t) - self.open_minutes for t in span.split("-"))
+            # Any slot overlapping the break is blocked
+            for slot in range(max(start // slot_minutes, 0), min(-(-end // slot_minutes), self.slots_per_day)):
+                blocked |= 1 << slot
+        # Slots that can never be booked (breaks)
+        self.blocked_mask = blocked
+        # day -> (loaded at, {doctor: booked mask})
+        self._days: Dict[datetime.date, tuple] = {}
+        self.refresh_seconds = refresh_seconds
+        self.loads = 0
+        self.evictions = 0
+        self.reservations = 0
+        self.conflicts = 0
+        cache_invalidation_bus.register("availability", self._drop_day)
+
+    @staticmethod
+    def _minutes(value: str) -> int:
+        hours, minutes = value.strip().split(":")
+        return int(hours) * 60 + int(minutes)
+
+    def _drop_day(self, key: str):
+        self._days.pop(datetime.date.fromisoformat(key), None)
+
+    def slots_for(self, duration_minutes: int) -> int:
+        return max(1, -(-duration_minutes // self.slot_minutes))
+
+    def slot_of(self, value: datetime.time) -> Optional[int]:
+        """
+        Slot index starting at `value`, or None if it is not a slot boundary within opening hours.
+        """
+        offset = value.hour * 60 + value.minute - self.open_minutes
+        if offset < 0 or offset % self.slot_minutes or value.second:
+            return None
+        slot = offset // self.slot_minutes
+        return slot if slot < self.slots_per_day else None
+
+    def first_start(self, day: datetime.date, not_before: Optional[datetime.datetime]) -> int:
+        """
+        First slot of `day` that starts no earlier than `not_before` (slots_per_day if none).
+        """
+        if not_before is None or day > not_before.date():
+            return 0
+        if day < not_before.date():
+            return self.slots_per_day
+        offset = not_before.hour * 60 + not_before.minute - self.open_minutes
+        return min(max(0, -(-offset // self.slot_minutes)), self.slots_per_day)
+
+    def slot_time(self, slot: int) -> datetime.time:
+        minutes = self.open_minutes + slot * self.slot_minutes
+        return datetime.time(minutes // 60, minutes % 60)
+
+    async def load(self, days: List[datetime.date]):
+        """
+        Make sure the bitmaps for `days` are in memory, reading any missing or
+        stale days from the database in one query. Past days not requested are evicted.
+        """
+        today = datetime.date.today()
+        for day in [day for day in self._days if day < today and day not in days]:
+            del self._days[day]
+            self.evictions += 1
+        now = time.monotonic()
+        stale = [day for day in dict.fromkeys(days)
+                 if day not in self._days or now - self._days[day][0] > self.refresh_seconds]
+        if not stale:
+            return
+        booked: Dict[datetime.date, Dict[str, int]] = {day: {} for day in stale}
+        cursor = db.appointment_slots.find(
+            {"date": {"$in": [day_start(day) for day in stale]}},
+            {"_id": 0, "doctor": 1, "date": 1, "slot": 1}
+        )
+        async for doc in cursor:
+            masks = booked[doc["date"].date()]
+            masks[doc["doctor"]] = masks.get(doc["doctor"], 0) | (1 << doc["slot"])
+        for day, masks in booked.items():
+            self._days[day] = (now, masks)
+        self.loads += 1
+
+    def free_mask(self, doctor: str, day: datetime.date) -> int:
+        """
+        Bitmap of free slots for a loaded day.
+        """
+        booked = self._days[day][1].get(doctor, 0)
+        return self.day_mask & ~(booked | self.blocked_mask)
+
+    def start_mask(self, doctor: str, day: datetime.date, slots_needed: int) -> int:
+        """
+        Bitmap of slots where `slots_needed` consecutive free slots begin.
+        """
+        free = self.free_mask(doctor, day)
+        starts = free
+        for offset in range(1, slots_needed):
+            starts &= free >> offset
+        return starts
+
+    async def search(self, start_date: datetime.date, end_date: datetime.date, doctors: List[str],
+                     slots_needed: int, limit: int,
+                     not_before: Optional[datetime.datetime] = None) -> List[tuple]:
+        """
+        Earliest `limit` (day, slot, doctor) starts with `slots_needed` consecutive
+        free slots, in time order and then roster order.
+        """
+        days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        await self.load(days)
+        found = []
+        for day in days:
+            # Starts before `not_before` are masked off on its day
+            cutoff = self.first_start(day, not_before)
+            if cutoff >= self.slots_per_day:
+                continue
+            day_starts = []
+            for order, doctor in enumerate(doctors):
+                starts = (self.start_mask(doctor, day, slots_needed) >> cutoff) << cutoff
+                for _ in range(limit):
+                    if not starts:
+                        break
+                    low = starts & -starts
+                    day_starts.append((low.bit_length() - 1, order, doctor))
+                    starts ^= low
+            day_starts.sort()
+            for slot, _, doctor in day_starts[:limit - len(found)]:
+                found.append((day, slot, doctor))
+            if len(found) >= limit:
+                break
+        return found
+
+    def _mark(self, doctor: str, day: datetime.date, slots: List[int], booked: bool):
+        entry = self._days.get(day)
+        if entry is None:
+            return
+        masks = entry[1]
+        bits = 0
+        for slot in slots:
+            bits |= 1 << slot
+        current = masks.get(doctor, 0)
+        masks[doctor] = current | bits if booked else current & ~bits
+
+    async def reserve(self, doctor: str, day: datetime.date, start_slot: int, slots_needed: int,
+                      appointment_id: str):
+        """
+        Atomically claim consecutive slots; raises SlotConflictError if any is taken.
+        """
+        slots = list(range(start_slot, start_slot + slots_needed))
+        try:
+            await db.appointment_slots.insert_many([
+                {"doctor": doctor, "date": day_start(day), "slot": slot, "appointment_id": appointment_id}
+                for slot in slots
+            ])
+        except (BulkWriteError, DuplicateKeyError) as e:
+            self.conflicts += 1
+            await db.appointment_slots.delete_many(self._held(doctor, day, slots, appointment_id))
+            # Another worker booked this day; re-read it on next use
+            self._days.pop(day, None)
+            raise SlotConflictError(f"{doctor} is not free at {self.slot_time(start_slot)} on {day}") from e
+        self.reservations += 1
+        self._mark(doctor, day, slots, True)
+        await cache_invalidation_bus.publish("availability", day.isoformat())
+
+    @staticmethod
+    def _held(doctor: str, day: datetime.date, slots: List[int], appointment_id: str) -> Dict[str, Any]:
+        # Only the slots this reservation inserted, even if another appointment shares the id
+        return {"doctor": doctor, "date": day_start(day), "slot": {"$in": slots}, "appointment_id": appointment_id}
+
+    async def rekey(self, doctor: str, day: datetime.date, start_slot: int, slots_needed: int,
+                    appointment_id: str, new_appointment_id: str):
+        """
+        Move a reservation to another appointment id.
+        """
+        slots = list(range(start_slot, start_slot + slots_needed))
+        await db.appointment_slots.update_many(
+            self._held(doctor, day, slots, appointment_id),
+            {"$set": {"appointment_id": new_appointment_id}}
+        )
+
+    async def release(self, appointment_id: str):
+        """
+        Free every slot held by an appointment.
+        """
+        held = [doc async for doc in db.appointment_slots.find({"appointment_id": appointment_id})]
+        if not held:
+            return
+        await db.appointment_slots.delete_many({"appointment_id": appointment_id})
+        for doc in held:
+            self._mark(doc["doctor"], doc["date"].date(), [doc["slot"]], False)
+        for day in {doc["date"].date() for doc in held}:
+            await cache_invalidation_bus.publish("availability", day.isoformat())
+
+    def covering_slots(self, start: datetime.time, duration_minutes: int) -> List[int]:
+        """
+        Every slot an appointment overlaps, even when it does not start on a slot boundary.
+        """
+        offset = start.hour * 60 + start.minute - self.open_minutes
+        first = max(0, offset // self.slot_minutes)
+        last = min(self.slots_per_day, -(-(offset + duration_minutes) // self.slot_minutes))
+        return list(range(first, last))
+
+    async def backfill(self, today: Optional[datetime.date] = None) -> Dict[str, int]:
+        """
+        Create slot documents for appointments booked before `appointment_slots`
+        existed (they have no `start`). Upcoming appointments get their slots; every
+        migrated appointment gets `start`/`end`, so later runs skip it.
+        """
+        today = today or datetime.date.today()
+        counts = {"migrated": 0, "slots": 0, "conflicts": 0, "skipped": 0}
+        cursor = db.appointments.find({
+            "start": {"$exists": False},
+            "status": {"$nin": [AppointmentStatus.CANCELLED.value, AppointmentStatus.COMPLETED.value]}
+        })
+        async for appointment in cursor:
+            day = legacy_appointment_day(appointment.get("date"))
+            clock = parse_clock_time(str(appointment.get("time") or ""))
+            if day is None or clock is None or not appointment.get("doctor"):
+                counts["skipped"] += 1
+                continue
+            duration = appointment.get("duration_minutes")
+            if not duration:
+                try:
+                    duration = APPOINTMENT_DURATION_MINUTES[AppointmentType(appointment.get("appointment_type"))]
+                except (KeyError, ValueError):
+                    duration = 60
+            if day >= today:
+                slots = self.covering_slots(clock, duration)
+                try:
+                    if slots:
+                        await db.appointment_slots.insert_many([
+                            {"doctor": appointment["doctor"], "date": day_start(day), "slot": slot,
+                             "appointment_id": appointment["appointment_id"]}
+                            for slot in slots
+                        ], ordered=False)
+                    counts["slots"] += len(slots)
+                except BulkWriteError as e:
+                    if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                        raise
+                    # Already double-booked before the migration; keep the slots that were free
+                    counts["slots"] += e.details.get("nInserted", 0)
+                    counts["conflicts"] += 1
+                    logger.warning(f"Appointment {appointment['appointment_id']} overlaps another booking")
+                self._days.pop(day, None)
+            start = datetime.datetime.combine(day, clock)
+            await db.appointments.update_one(
+                {"_id": appointment["_id"]},
+                {"$set": {"start": start, "end": start + timedelta(minutes=duration)}}
+            )
+            counts["migrated"] += 1
+        logger.info(f"Backfilled appointment slots: {counts}")
+        return counts
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "doctors": len(self.doctors),
+            "slots_per_day": self.slots_per_day,
+            "slot_minutes": self.slot_minutes,
+            "loaded_days": len(self._days),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "reservations": self.reservations,
+            "conflicts": self.conflicts
+        }
+
+availability_index = AvailabilityIndex(
+    CLINIC_DOCTORS, CLINIC_OPEN_TIME, CLINIC_CLOSE_TIME, CLINIC_BREAKS,
+    APPOINTMENT_SLOT_MINUTES, AVAILABILITY_REFRESH_SECONDS
+)
+
+# ==================== EMERGENCY DETECTION ====================
+
+EMERGENCY_KEYWORDS: Dict[Language, tuple] = {
+    Language.ENGLISH: (
+        "emergency", "severe pain", "unbearable", "bleeding", "swelling", "swollen",
+        "accident", "broken", "knocked out", "can't sleep", "cannot sleep", "cant sleep", "extreme"
+    ),
+    Language.SPANISH: (
+        "emergencia", "urgencia", "dolor severo", "dolor intenso", "insoportable", "sangrado",
+        "sangra", "hinchazón", "hinchado", "hinchada", "accidente", "roto", "rota", "no puedo dormir", "extremo"
+    ),
+    Language.FRENCH: (
+        "urgence", "douleur intense", "douleur sévère", "insupportable", "saignement", "saigne",
+        "gonflement", "gonflé", "gonflée", "accident", "cassé", "cassée", "impossible de dormir", "extrême"
+    ),
+    Language.GERMAN: (
+        "notfall", "starke schmerzen", "unerträglich", "blutung", "blutet", "schwellung",
+        "geschwollen", "unfall", "abgebrochen", "ausgeschlagen", "kann nicht schlafen", "extrem"
+    ),
+    Language.CHINESE: (
+        "紧急", "急诊", "剧痛", "剧烈疼痛", "无法忍受", "受不了", "出血", "流血", "肿胀", "肿了",
+        "事故", "断了", "撞掉", "睡不着"
+    ),
+    Language.JAPANESE: (
+        "緊急", "救急", "激痛", "耐えられない", "我慢できない", "出血", "血が出", "腫れ", "事故",
+        "折れ", "欠け", "抜けた", "眠れない"
+    ),
+}
+
+# Negation cues that precede a keyword ("no swelling", "sin sangrado", "没有出血").
+# "never" and its translations are left out: "never had such extreme pain" is an emergency.
+EMERGENCY_NEGATION_CUES: Dict[Language, frozenset] = {
+    Language.ENGLISH: frozenset({"no", "not", "without", "isn't", "isnt", "wasn't", "don't", "dont", "doesn't", "didn't", "none"}),
+    Language.SPANISH: frozenset({"no", "sin", "ningún", "ninguna"}),
+    Language.FRENCH: frozenset({"pas", "sans", "aucun", "aucune", "ni"}),
+    Language.GERMAN: frozenset({"kein", "keine", "keinen", "nicht", "ohne"}),
+    Language.CHINESE: frozenset({"没有", "没", "无", "未"}),
+    Language.JAPANESE: frozenset(),
+}
+# Cues that only negate when directly attached to the keyword ("不出血"), since they
+# also occur inside "止不住" (can't stop) and "不停" (nonstop)
+EMERGENCY_ADJACENT_NEGATION_CUES: Dict[Language, tuple] = {
+    Language.CHINESE: ("不",),
+}
+# Japanese negates after the keyword ("出血はない")
+EMERGENCY_NEGATION_SUFFIXES: Dict[Language, tuple] = {
+    Language.JAPANESE: ("ない", "なし", "ません", "ありません"),
+}
+# Contrast conjunctions end a negation's scope ("no swelling but bleeding")
+EMERGENCY_CONTRAST_WORDS: Dict[Language, tuple] = {
+    Language.ENGLISH: ("but", "however", "although", "though", "except"),
+    Language.SPANISH: ("pero", "sino", "aunque", "sin embargo"),
+    Language.FRENCH: ("mais", "cependant", "pourtant", "sauf"),
+    Language.GERMAN: ("aber", "doch", "sondern", "jedoch", "außer"),
+    Language.CHINESE: ("但是", "可是", "不过", "但", "而是"),
+    Language.JAPANESE: ("けど", "けれど", "しかし", "でも"),
+}
+EMERGENCY_NEGATION_WINDOW = 3  # words (characters for unsegmented scripts)
+UNSEGMENTED_LANGUAGES = frozenset({Language.CHINESE, Language.JAPANESE})
+
+# Optional JSON file of extra keywords per language code, e.g. {"en": ["abscess", ...]}
+EMERGENCY_KEYWORDS_PATH = os.getenv("EMERGENCY_KEYWORDS_PATH")
+
+class EmergencyMatch(NamedTuple):
+    keyword: str
+    start: int
+    end: int
+    language: Language
+    negated: bool
+
+def compile_keyword_trie(keywords: List[str]) -> str:
+    """
+    Build a regex alternation shaped like a prefix trie of the keywords.
+
+    Shared prefixes are matched once, so the pattern stays a single left-to-right
+    scan however many keywords there are.
+    """
+    trie: Dict[str, Any] = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def char_pattern(char: str) -> str:
+        if char == " ":
+            return r"\s+"
+        if char in "'’":
+            return "['’]"
+        return re.escape(char)
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [char_pattern(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            pattern = "(?:" + pattern + ")?"
+        return pattern
+
+    return build(trie)
+
+class EmergencyDetector:
+    """
+    Single-pass emergency keyword detector with per-language keyword sets.
+
+    Each language's keywords (plus English, which patients often mix in) are compiled
+    once into a trie-shaped regex. Space-delimited languages match on word boundaries,
+    and matches preceded by a negation cue in the same clause are flagged as negated.
+    """
+
+    _clause_break = re.compile(
+        r"[.,;:!?¿¡。、！？\n]"
+        + "".join(
+            "|" + (re.escape(word) if language in UNSEGMENTED_LANGUAGES else rf"(?<!\w){re.escape(word)}(?!\w)")
+            for language, words in EMERGENCY_CONTRAST_WORDS.items()
+            for word in words
+        ),
+        re.IGNORECASE,
+    )
+    _words = re.compile(r"[\w'’]+")
+
+    def __init__(self, keywords: Dict[Language, tuple]):
+        self.keywords = {language: tuple(dict.fromkeys(k.casefold() for k in terms)) for language, terms in keywords.items()}
+        self._keyword_sets = {language: frozenset(terms) for language, terms in self.keywords.items()}
+        self._patterns = {language: self._compile(language) for language in Language}
+
+    def _compile(self, language: Language) -> "re.Pattern":
+        alternatives = []
+        for lang in (language, Language.ENGLISH):
+            terms = self.keywords.get(lang, ())
+            if not terms:
+                continue
+            body = compile_keyword_trie(list(terms))
+            if lang in UNSEGMENTED_LANGUAGES:
+                alternatives.append(body)
+            else:
+                alternatives.append(r"(?<!\w)" + body + r"(?!\w)")
+        return re.compile("|".join(f"(?:{alt})" for alt in dict.fromkeys(alternatives)), re.IGNORECASE)
+
+    def _is_negated(self, text: str, start: int, end: int, language: Language) -> bool:
+        clause_start = 0
+        for match in self._clause_break.finditer(text, max(0, start - 80), start):
+            clause_start = match.end()
+        preceding = text[max(clause_start, start - 80):start]
+        if language in UNSEGMENTED_LANGUAGES:
+            window = preceding[-EMERGENCY_NEGATION_WINDOW:]
+            if any(cue in window for cue in EMERGENCY_NEGATION_CUES.get(language, ())):
+                return True
+            if preceding.endswith(EMERGENCY_ADJACENT_NEGATION_CUES.get(language, ())):
+                return True
+            following = text[end:end + EMERGENCY_NEGATION_WINDOW + 3]
+            return any(following.lstrip("はがもを").startswith(suffix) for suffix in EMERGENCY_NEGATION_SUFFIXES.get(language, ()))
+        cues = EMERGENCY_NEGATION_CUES.get(language, frozenset()) | EMERGENCY_NEGATION_CUES[Language.ENGLISH]
+        words = self._words.findall(preceding.casefold())[-EMERGENCY_NEGATION_WINDOW:]
+        return any(word.replace("’", "'") in cues for word in words)
+
+    def detect(self, text: str, language: Language = Language.ENGLISH) -> List[EmergencyMatch]:
+        matches = []
+        for match in self._patterns[language].finditer(text):
+            keyword = match.group(0)
+            normalized = " ".join(keyword.casefold().replace("’", "'").split())
+            keyword_language = language if normalized in self._keyword_sets.get(language, ()) else Language.ENGLISH
+            matches.append(EmergencyMatch(
+                keyword=keyword,
+                start=match.start(),
+                end=match.end(),
+                language=keyword_language,
+                negated=self._is_negated(text, match.start(), match.end(), keyword_language)
+            ))
+        return matches
+
+    @staticmethod
+    def is_emergency(matches: List[EmergencyMatch]) -> bool:
+        return any(not match.negated for match in matches)
+
+def load_emergency_keywords() -> Dict[Language, tuple]:
+    keywords = dict(EMERGENCY_KEYWORDS)
+    if EMERGENCY_KEYWORDS_PATH:
+        try:
+            with open(EMERGENCY_KEYWORDS_PATH) as f:
+                extra = json.load(f)
+            for code, terms in extra.items():
+                language = Language(code)
+                keywords[language] = keywords.get(language, ()) + tuple(terms)
+        except Exception as e:
+            logger.error(f"Error loading emergency keywords from {EMERGENCY_KEYWORDS_PATH}: {e}")
+    return keywords
+
+emergency_detector = EmergencyDetector(load_emergency_keywords())
+
+# ==================== PRICING ====================
+
+# Optional JSON file overriding the built-in tariff:
+# {"treatments": {...}, "appointment_types": {...}, "coverage_rates": {...}}
+TARIFF_PATH = os.getenv("TARIFF_PATH")
+
+TREATMENT_COSTS: Dict[str, float] = {
+    "Filling": 150.00,
+    "Crown": 1200.00,
+    "Root Canal": 1000.00,
+    "Deep Cleaning": 200.00,
+    "Antibiotics": 50.00,
+    "Gum Surgery": 1500.00,
+    "Bonding": 300.00,
+    "Extraction": 250.00,
+    "Surgery": 2000.00,
+    "Pain Management": 100.00,
+    "Desensitizing Toothpaste": 20.00,
+    "Fluoride Treatment": 35.00,
+    "Mouthguard": 400.00,
+    "Night Guard": 500.00,
+    "Physical Therapy": 150.00,
+    "Medication": 75.00,
+    "Stress Management": 100.00,
+    "Dental Correction": 1500.00,
+    "Biopsy": 800.00,
+    "Radiation Therapy": 5000.00
+}
+
+APPOINTMENT_COSTS: Dict[AppointmentType, float] = {
+    AppointmentType.CONSULTATION: 75.0,
+    AppointmentType.CLEANING: 120.0,
+    AppointmentType.CHECKUP: 85.0,
+    AppointmentType.FILLING: 200.0,
+    AppointmentType.CROWN: 800.0,
+    AppointmentType.ROOT_CANAL: 900.0,
+    AppointmentType.EXTRACTION: 250.0,
+    AppointmentType.WHITENING: 400.0,
+    AppointmentType.EMERGENCY: 150.0
+}
+
+COVERAGE_RATES: Dict[InsuranceProvider, float] = {
+    InsuranceProvider.DELTA_DENTAL: 0.8,
+    InsuranceProvider.CIGNA: 0.7,
+    InsuranceProvider.AETNA: 0.75,
+    InsuranceProvider.METLIFE: 0.8,
+    InsuranceProvider.GUARDIAN: 0.7,
+    InsuranceProvider.UNITED_HEALTHCARE: 0.75,
+    InsuranceProvider.HUMANA: 0.7,
+    InsuranceProvider.BLUE_CROSS: 0.8,
+    InsuranceProvider.OTHER: 0.6,
+    InsuranceProvider.NONE: 0.0
+}
+
+class UnknownTreatmentError(ValueError):
+    pass
+
+class TariffEngine:
+    """
+    Treatment costs, appointment costs and insurance coverage rates held in
+    read-only NumPy arrays.
+
+    Appointment types and providers index their arrays in enum order; treatments
+    are indexed by name. Coverage for any set of costs and providers is one
+    outer product, so every caller computes the same numbers.
+    """
+
+    def __init__(self, treatment_costs: Dict[str, float], appointment_costs: Dict[AppointmentType, float],
+                 coverage_rates: Dict[InsuranceProvider, float]):
+        self.treatments = tuple(treatment_costs)
+        self._treatment_index = {name: i for i, name in enumerate(self.treatments)}
+        self.treatment_costs = self._frozen([treatment_costs[name] for name in self.treatments])
+        self._appointment_index = {member: i for i, member in enumerate(AppointmentType)}
+        # Appointment types without a tariff fall back to the old flat 100.0
+        self.appointment_costs = self._frozen([appointment_costs.get(member, 100.0) for member in AppointmentType])
+        self._provider_index = {member: i for i, member in enumerate(InsuranceProvider)}
+        self.coverage_rates = self._frozen([coverage_rates.get(member, 0.0) for member in InsuranceProvider])
+        digest = hashlib.sha256(json.dumps(self.treatments).encode("utf-8"))
+        for array in (self.treatment_costs, self.appointment_costs, self.coverage_rates):
+            digest.update(array.tobytes())
+        self.version = digest.hexdigest()[:12]
+
+    @staticmethod
+    def _frozen(values: List[float]) -> np.ndarray:
+        array = np.array(values, dtype=np.float64)
+        array.setflags(write=False)
+        return array
+
+    @classmethod
+    def from_file(cls, path: str) -> "TariffEngine":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        treatments = {**TREATMENT_COSTS, **data.get("treatments", {})}
+        appointments = {**APPOINTMENT_COSTS, **{AppointmentType(k): v for k, v in data.get("appointment_types", {}).items()}}
+        rates = {**COVERAGE_RATES, **{InsuranceProvider(k): v for k, v in data.get("coverage_rates", {}).items()}}
+        return cls(treatments, appointments, rates)
+
+    def treatment_cost_array(self, treatments: List[str], strict: bool = False) -> np.ndarray:
+        """
+        Costs for treatment names; unknown names cost 0.0 unless `strict`.
+        """
+        index = np.fromiter(
+            (self._treatment_index.get(name, -1) for name in treatments), dtype=np.intp, count=len(treatments)
+        )
+        unknown = index < 0
+        if strict and unknown.any():
+            missing = [name for name, flag in zip(treatments, unknown) if flag]
+            raise UnknownTreatmentError(f"Unknown treatments: {', '.join(missing)}")
+        costs = self.treatment_costs[np.where(unknown, 0, index)]
+        costs[unknown] = 0.0
+        return costs
+
+    def appointment_cost_array(self, appointment_types: List[AppointmentType]) -> np.ndarray:
+        index = np.fromiter(
+            (self._appointment_index[AppointmentType(t)] for t in appointment_types), dtype=np.intp,
+            count=len(appointment_types)
+        )
+        return self.appointment_costs[index]
+
+    def coverage_rate_array(self, providers: List[InsuranceProvider]) -> np.ndarray:
+        index = np.fromiter(
+            (self._provider_index[InsuranceProvider(p)] for p in providers), dtype=np.intp, count=len(providers)
+        )
+        return self.coverage_rates[index]
+
+    def estimate(self, costs: np.ndarray, providers: List[InsuranceProvider]) -> tuple:
+        """
+        (coverage, patient responsibility) arrays of shape (providers, costs).
+        """
+        coverage = np.outer(self.coverage_rate_array(providers), costs)
+        return coverage, costs - coverage
+
+    def appointment_estimate(self, appointment_type: AppointmentType,
+                             provider: Optional[InsuranceProvider]) -> tuple:
+        """
+        (cost, coverage or None, patient responsibility or None) for one appointment.
+        """
+        costs = self.appointment_cost_array([appointment_type])
+        if not provider:
+            return float(costs[0]), None, None
+        coverage, responsibility = self.estimate(costs, [provider])
+        return float(costs[0]), float(coverage[0, 0]), float(responsibility[0, 0])
+
+def load_tariff_engine() -> TariffEngine:
+    if TARIFF_PATH:
+        try:
+            return TariffEngine.from_file(TARIFF_PATH)
+        except Exception as e:
+            logger.error(f"Error loading tariff from {TARIFF_PATH}, using built-in tariff: {e}")
+    return TariffEngine(TREATMENT_COSTS, APPOINTMENT_COSTS, COVERAGE_RATES)
+
+tariff_engine = load_tariff_engine()
+
+# ==================== RESPONSE CATALOG ====================
+
+# Per-language response files named by language code (en.json, es.json, ...)
+LOCALES_DIR = os.getenv("LOCALES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales"))
+SOURCE_LANGUAGE = Language.ENGLISH
+# Translator that pre-renders languages without a complete file: "prefix" or "none"
+CHAT_TRANSLATOR = os.getenv("CHAT_TRANSLATOR", "prefix")
+# Optional directory keeping pre-rendered translations across restarts
+TRANSLATION_CACHE_DIR = os.getenv("TRANSLATION_CACHE_DIR")
+
+class Translator:
+    """
+    Interface for offline translators.
+
+    `translate()` renders a batch of source-language strings in another language.
+    It runs when the catalog is loaded, never on the request path.
+    """
+
+    name = "base"
+
+    def translate(self, texts: List[str], language: Language) -> List[str]:
+        raise NotImplementedError
+
+class PrefixTranslator(Translator):
+    """
+    Placeholder until a translation service is configured: marks the English text
+    with the target language.
+    """
+
+    name = "prefix"
+
+    def translate(self, texts: List[str], language: Language) -> List[str]:
+        return [f"[Translated to {language.value}] {text}" for text in texts]
+
+class UntranslatedTranslator(Translator):
+    name = "none"
+
+    def translate(self, texts: List[str], language: Language) -> List[str]:
+        return list(texts)
+
+CHAT_TRANSLATORS: Dict[str, Callable[[], Translator]] = {
+    "prefix": PrefixTranslator,
+    "none": UntranslatedTranslator,
+}
+
+def create_translator(name: str) -> Translator:
+    if name not in CHAT_TRANSLATORS:
+        raise ValueError(f"Unknown translator '{name}', expected one of {sorted(CHAT_TRANSLATORS)}")
+    return CHAT_TRANSLATORS[name]()
+
+class ResponseCatalog:
+    """
+    Chat responses compiled into read-only tables.
+
+    `responses[language][intent_id]` is the tuple of alternatives for an intent and
+    `emergency[language]` the emergency notice, so rendering a response is an
+    indexed lookup and a random choice. Intent ids outside INTENT_MAPPING get the
+    general_question responses.
+    """
+
+    def __init__(self, catalogs: Dict[Language, Dict[str, Any]]):
+        intents = [INTENT_MAPPING.get(i, "general_question") for i in range(max(INTENT_MAPPING) + 1)]
+        self._general = intents.index("general_question")
+        self.responses = MappingProxyType({
+            language: tuple(tuple(catalog["responses"][intent]) for intent in intents)
+            for language, catalog in catalogs.items()
+        })
+        self.emergency = MappingProxyType({language: catalog["emergency"] for language, catalog in catalogs.items()})
+
+    def render(self, intent_id: int, emergency_detected: bool, language: Language) -> str:
+        if emergency_detected:
+            return self.emergency[language]
+        table = self.responses[language]
+        if not 0 <= intent_id < len(table):
+            intent_id = self._general
+        return random.choice(table[intent_id])
+
+def read_locale(language: Language) -> Optional[Dict[str, Any]]:
+    path = os.path.join(LOCALES_DIR, f"{language.value}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def is_complete_locale(catalog: Dict[str, Any]) -> bool:
+    responses = catalog.get("responses", {})
+    return "emergency" in catalog and all(intent in responses for intent in INTENT_MAPPING.values())
+
+def translate_locale(source: Dict[str, Any], language: Language, translator: Translator) -> Dict[str, Any]:
+    """
+    Render the source catalog in `language` with a single translator call.
+    """
+    intents = list(source["responses"])
+    texts = [source["emergency"]] + [text for intent in intents for text in source["responses"][intent]]
+    translated = translator.translate(texts, language)
+    if len(translated) != len(texts):
+        raise ValueError(f"Translator '{translator.name}' returned {len(translated)} of {len(texts)} strings")
+    rendered = iter(translated)
+    emergency = next(rendered)
+    responses = {intent: [next(rendered) for _ in source["responses"][intent]] for intent in intents}
+    return {"responses": responses, "emergency": emergency}
+
+def cached_translation(source: Dict[str, Any], source_version: str, language: Language,
+                       translator: Translator) -> Dict[str, Any]:
+    """
+    `translate_locale`, reusing a rendering from TRANSLATION_CACHE_DIR made from the
+    same source catalog and translator.
+    """
+    path = None
+    if TRANSLATION_CACHE_DIR:
+        path = os.path.join(TRANSLATION_CACHE_DIR, f"{language.value}.{translator.name}.{source_version}.json")
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable translation cache {path}: {e}")
+    rendered = translate_locale(source, language, translator)
+    if path:
+        try:
+            os.makedirs(TRANSLATION_CACHE_DIR, exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(rendered, f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning(f"Could not cache translation to {path}: {e}")
+    return rendered
+
+def load_response_catalog(translator_name: str = CHAT_TRANSLATOR) -> ResponseCatalog:
+    """
+    Load the source-language catalog and every language file, pre-rendering what
+    the files leave out with the configured translator.
+    """
+    source = read_locale(SOURCE_LANGUAGE)
+    if source is None or not is_complete_locale(source):
+        raise ValueError(f"{LOCALES_DIR}/{SOURCE_LANGUAGE.value}.json must define every intent and the emergency notice")
+    source_version = hashlib.sha256(json.dumps(source, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    translator = create_translator(translator_name)
+
+    catalogs = {SOURCE_LANGUAGE: source}
+    translated = []
+    for language in Language:
+        if language == SOURCE_LANGUAGE:
+            continue
+        own = None
+        try:
+            own = read_locale(language)
+        except Exception as e:
+            logger.error(f"Error loading {language.value} responses from {LOCALES_DIR}: {e}")
+        if own is not None and is_complete_locale(own):
+            catalogs[language] = own
+            continue
+        rendered = cached_translation(source, source_version, language, translator)
+        if own is not None:
+            rendered = {
+                "responses": {**rendered["responses"], **own.get("responses", {})},
+                "emergency": own.get("emergency", rendered["emergency"])
+            }
+        catalogs[language] = rendered
+        translated.append(language.value)
+
+    if translated:
+        logger.info(f"Response catalog: pre-rendered {', '.join(translated)} with the '{translator.name}' translator")
+    return ResponseCatalog(catalogs)
+
+response_catalog = load_response_catalog()
+
+# ==================== CORE AI FUNCTIONS ====================
+
+# Upper bound on intake forms accepted by a single batch symptom analysis call
+SYMPTOM_BATCH_MAX_ITEMS = int(os.getenv("SYMPTOM_BATCH_MAX_ITEMS", "10000"))
+
+def build_symptom_analysis(request: SymptomAnalysisRequest, condition_probs: np.ndarray) -> SymptomAnalysisResponse:
+    """
+    Turn classifier probabilities into a diagnosis, urgency, treatment and cost response.
+
+    The result does not depend on the patient; insurance coverage is applied
+    separately with `apply_insurance_coverage`.
+    """
+    condition_indices = condition_probs.argsort()[-3:][::-1]  # Top 3 conditions
+    
+    # Map indices to condition names
+    all_conditions = [
+        "Cavity", "Gum Disease", "Tooth Fracture", "Abscess", 
+        "Pulpitis", "Impacted Tooth", "Tooth Sensitivity", 
+        "TMJ Disorder", "Bruxism", "Oral Cancer"
+    ]
+    
+    possible_conditions = [all_conditions[i] for i in condition_indices]
+    
+    # Determine urgency based on symptoms and pain level
+    urgency = UrgencyLevel.LOW
+    if request.pain_level >= 8 or "swelling" in request.symptoms or "fever" in request.symptoms:
+        urgency = UrgencyLevel.EMERGENCY
+    elif request.pain_level >= 6 or "throbbing" in request.symptoms:
+        urgency = UrgencyLevel.HIGH
+    elif request.pain_level >= 4:
+        urgency = UrgencyLevel.MEDIUM
+        
+    # Generate recommendations
+    recommendations = []
+    needs_immediate = urgency == UrgencyLevel.EMERGENCY
+    
+    if needs_immediate:
+        recommendations.append("Seek immediate emergency dental care")
+        recommendations.append("Take over-the-counter pain medication as directed")
+        recommendations.append("Apply cold compress for swelling")
+    elif urgency == UrgencyLevel.HIGH:
+        recommendations.append("Schedule an appointment within 24-48 hours")
+        recommendations.append("Take over-the-counter pain medication as needed")
+        recommendations.append("Avoid hot, cold, or sweet foods and beverages")
+    else:
+        recommendations.append("Schedule a regular dental appointment")
+        recommendations.append("Maintain good oral hygiene")
+        recommendations.append("Monitor symptoms and seek care if they worsen")
+        
+    # Treatment options based on conditions
+    treatment_mapping = {
+        "Cavity": ["Filling", "Crown", "Root Canal"],
+        "Gum Disease": ["Deep Cleaning", "Antibiotics", "Gum Surgery"],
+        "Tooth Fracture": ["Bonding", "Crown", "Extraction"],
+        "Abscess": ["Drainage", "Root Canal", "Antibiotics"],
+        "Pulpitis": ["Root Canal", "Medication", "Extraction"],
+        "Impacted Tooth": ["Extraction", "Surgery", "Pain Management"],
+        "Tooth Sensitivity": ["Desensitizing Toothpaste", "Fluoride Treatment", "Bonding"],
+        "TMJ Disorder": ["Mouthguard", "Physical Therapy", "Medication"],
+        "Bruxism": ["Night Guard", "Stress Management", "Dental Correction"],
+        "Oral Cancer": ["Biopsy", "Surgery", "Radiation Therapy"]
+    }
+    
+    treatment_options = []
+    for condition in possible_conditions:
+        if condition in treatment_mapping:
+            treatment_options.extend(treatment_mapping[condition])
+            
+    # Remove duplicates while preserving order
+    treatment_options = list(dict.fromkeys(treatment_options))
+    
+    estimated_costs = dict(zip(treatment_options, tariff_engine.treatment_cost_array(treatment_options).tolist()))
+    
+    return SymptomAnalysisResponse(
+        possible_conditions=possible_conditions,
+        urgency=urgency,
+        recommendations=recommendations,
+        needs_immediate_attention=needs_immediate,
+        treatment_options=treatment_options,
+        estimated_costs=estimated_costs
+    )
+
+def apply_insurance_coverage(analysis: SymptomAnalysisResponse, insurance_provider: Optional[str]) -> SymptomAnalysisResponse:
+    """
+    Return a copy of a patient-independent analysis with the patient's insurance coverage.
+    """
+    insurance_coverage = None
+    if insurance_provider:
+        treatments = list(analysis.estimated_costs)
+        costs = np.fromiter(analysis.estimated_costs.values(), dtype=np.float64, count=len(treatments))
+        coverage, _ = tariff_engine.estimate(costs, [InsuranceProvider(insurance_provider)])
+        insurance_coverage = dict(zip(treatments, coverage[0].tolist()))
+    
+    return analysis.copy(update={"insurance_coverage": insurance_coverage})
+
+def fallback_symptom_analysis() -> SymptomAnalysisResponse:
+    return SymptomAnalysisResponse(
+        possible_conditions=["Unable to determine - please consult a dentist"],
+        urgency=UrgencyLevel.MEDIUM,
+        recommendations=["Schedule an appointment with a dentist for proper diagnosis"],
+        needs_immediate_attention=False,
+        treatment_options=["Professional dental examination"],
+        estimated_costs={"Consultation": 75.00}
+    )
+
+async def analyze_symptoms(request: SymptomAnalysisRequest) -> SymptomAnalysisResponse:
+    """
+    Analyze dental symptoms using machine learning to provide diagnosis and recommendations.
+    """
+    try:
+        with metrics.span("symptom.cache_lookup"):
+            analysis = await symptom_result_cache.get(request)
+        if analysis is None:
+            # Prepare features for the model
+            with metrics.span("symptom.encode"):
+                feature_vector = symptom_feature_encoder.encode(request)
+            
+            # Make prediction off the event loop
+            with metrics.span("symptom.predict"):
+                condition_probs = (await inference_executor.predict_symptoms(feature_vector))[0]
+            with metrics.span("symptom.build"):
+                analysis = build_symptom_analysis(request, condition_probs)
+                await symptom_result_cache.set(request, analysis)
+        
+        # Get insurance provider if patient_id is provided
+        insurance_provider = None
+        if request.patient_id:
+            with metrics.span("symptom.patient_lookup"):
+                patient = await patient_cache.get(request.patient_id, ("insurance_provider",))
+            if patient:
+                insurance_provider = patient.get("insurance_provider")
+        
+        with metrics.span("symptom.coverage"):
+            return apply_insurance_coverage(analysis, insurance_provider)
+        
+    except UnknownSymptomError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in symptom analysis: {e}")
+        metrics.inc("dental_ai_fallback_responses_total", kind="symptom_analysis")
+        # Fallback response
+        return fallback_symptom_analysis()
+
+async def analyze_symptoms_batch(requests: List[SymptomAnalysisRequest]) -> List[SymptomAnalysisResponse]:
+    """
+    Analyze many symptom requests with one classifier call and one patient query.
+
+    Results are in request order and identical to calling `analyze_symptoms` on each
+    item; an item that fails gets the same fallback response as the single path.
+    """
+    # Reject the whole batch up front if any item uses an unknown symptom
+    for index, request in enumerate(requests):
+        try:
+            symptom_feature_encoder.validate(request.symptoms)
+        except UnknownSymptomError as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Item {index}: {e}"
+            )
+
+    try:
+        analyses = await symptom_result_cache.get_many(requests)
+        missing = [i for i, analysis in enumerate(analyses) if analysis is None]
+        if missing:
+            with metrics.span("symptom_batch.encode"):
+                feature_matrix = symptom_feature_encoder.encode_batch([requests[i] for i in missing])
+            with metrics.span("symptom_batch.predict"):
+                condition_probs = await inference_executor.predict_symptoms(feature_matrix)
+            if len(condition_probs) != len(missing):
+                raise RuntimeError(f"Classifier returned {len(condition_probs)} rows for {len(missing)} requests")
+            for i, row_probs in zip(missing, condition_probs):
+                analyses[i] = build_symptom_analysis(requests[i], row_probs)
+            await symptom_result_cache.set_many([requests[i] for i in missing], [analyses[i] for i in missing])
+    except Exception as e:
+        logger.error(f"Error in batch symptom analysis: {e}")
+        metrics.inc("dental_ai_fallback_responses_total", len(requests), kind="symptom_analysis")
+        return [fallback_symptom_analysis() for _ in requests]
+
+    # Resolve every patient's insurance provider with at most a single query
+    insurance_providers: Dict[str, Optional[str]] = {}
+    patients_failed = False
+    patient_ids = list({r.patient_id for r in requests if r.patient_id})
+    if patient_ids:
+        try:
+            patients = await patient_cache.get_many(patient_ids, ("insurance_provider",))
+            for patient_id, patient in patients.items():
+                insurance_providers[patient_id] = patient.get("insurance_provider")
+        except Exception as e:
+            logger.error(f"Error loading patients for batch symptom analysis: {e}")
+            patients_failed = True
+
+    results = []
+    for i, request in enumerate(requests):
+        if request.patient_id and patients_failed:
+            metrics.inc("dental_ai_fallback_responses_total", kind="symptom_analysis")
+            results.append(fallback_symptom_analysis())
+            continue
+        try:
+            results.append(apply_insurance_coverage(
+                analyses[i],
+                insurance_providers.get(request.patient_id) if request.patient_id else None
+            ))
+        except Exception as e:
+            logger.error(f"Error in symptom analysis for batch item {i}: {e}")
+            metrics.inc("dental_ai_fallback_responses_total", kind="symptom_analysis")
+            results.append(fallback_symptom_analysis())
+
+    return results
+
+def suggest_chat_actions(detected_intent: str) -> List[str]:
+    """
+    Follow-up actions offered to the patient for a detected intent.
+    """
+    suggested_actions = []
+    if detected_intent == "appointment_booking":
+        suggested_actions = ["Book appointment", "View available times", "See doctor profiles"]
+    elif detected_intent == "symptom_inquiry":
+        suggested_actions = ["Use tooth map", "Rate pain level", "View possible conditions"]
+    elif detected_intent == "service_inquiry":
+        suggested_actions = ["View service details", "See before/after gallery", "Check pricing"]
+    elif detected_intent == "cost_inquiry":
+        suggested_actions = ["Verify insurance", "View payment options", "Get detailed estimate"]
+    return suggested_actions
+
+CHAT_ERROR_RESPONSE = "I apologize, but I'm having trouble processing your request right now. Please try again or contact our office directly at (555) 123-SMILE."
+
+async def stream_chat_events(request: ChatRequest) -> AsyncIterator[tuple]:
+    """
+    Process a chat message as a sequence of (event, data) pairs, each emitted as
+    soon as it is known: "emergency" right after keyword detection, then
+    "intent", "response" and "actions", and finally "done" with the full
+    ChatResponse once the conversation has been logged.
+    """
+    emergency_detected = False
+    try:
+        # Check for emergency keywords first
+        with metrics.span("chat.emergency_detection"):
+            emergency_matches = emergency_detector.detect(request.message, request.language)
+            emergency_detected = emergency_detector.is_emergency(emergency_matches)
+        if emergency_detected:
+            metrics.inc("dental_ai_emergencies_total", language=request.language.value)
+            logger.info(f"Emergency keywords detected: {[m.keyword for m in emergency_matches if not m.negated]}")
+        yield "emergency", {"emergency_detected": emergency_detected}
+        
+        # Detect intent, skipping the model for repeated messages
+        with metrics.span("chat.intent"):
+            intent_id = await intent_cache.get(request.message)
+            if intent_id is None:
+                # Batched with concurrent requests
+                intent_id = await intent_batcher.submit(request.message)
+                await intent_cache.set(request.message, intent_id)
+        
+        detected_intent = INTENT_MAPPING.get(intent_id, "general_question")
+        yield "intent", {"detected_intent": detected_intent}
+
+        with metrics.span("chat.response"):
+            response_text = response_catalog.render(intent_id, emergency_detected, request.language)
+        yield "response", {"response": response_text}
+
+        suggested_actions = suggest_chat_actions(detected_intent)
+        yield "actions", {"suggested_actions": suggested_actions}
+        
+        # Store conversation in database if conversation_id provided (written behind)
+        if request.conversation_id:
+            with metrics.span("chat.conversation_log"):
+                await conversation_writer.append(request.conversation_id, {
+                    "timestamp": datetime.datetime.now(),
+                    "user_message": request.message,
+                    "bot_response": response_text,
+                    "intent": detected_intent,
+                    "emergency_detected": emergency_detected
+                })
+        
+        result = ChatResponse(
+            response=response_text,
+            detected_intent=detected_intent,
+            suggested_actions=suggested_actions,
+            emergency_detected=emergency_detected
+        )
+        
+    except Exception as e:
+        logger.error(f"Error processing chat message: {e}")
+        metrics.inc("dental_ai_fallback_responses_total", kind="chat")
+        result = ChatResponse(response=CHAT_ERROR_RESPONSE, emergency_detected=emergency_detected)
+    yield "done", result.dict()
+
+async def process_chat_message(request: ChatRequest) -> ChatResponse:
+    """
+    Process a chat message using NLP to detect intent and generate appropriate responses.
+    """
+    async for event, data in stream_chat_events(request):
+        if event == "done":
+            return ChatResponse(**data)
+
+async def schedule_appointment(request: AppointmentRequest) -> AppointmentResponse:
+    """
+    Schedule a dental appointment based on patient preferences and availability.
+    """
+    try:
+        # Only days within the booking horizon are bookable, and today only from now on
+        now = datetime.datetime.now()
+        if request.preferred_date < now.date():
+            raise HTTPException(status_code=422, detail="preferred_date must not be in the past")
+        if request.preferred_date > booking_horizon(now.date()):
+            raise HTTPException(
+                status_code=422,
+                detail=f"Appointments can be booked at most {AVAILABILITY_MAX_DAYS} days ahead"
+            )
+
+        # Check if patient exists
+        with metrics.span("appointment.patient_lookup"):
+            patient = await patient_cache.get(request.patient_id, ("patient_id",))
+        if not patient:
+            raise HTTPException(status_code=404, detail="Patient not found")
+        
+        # Determine appointment duration based on type
+        duration = APPOINTMENT_DURATION_MINUTES.get(request.appointment_type, 60)
+        slots_needed = availability_index.slots_for(duration)
+
+        # The preferred doctor wins over a closer time with anyone else
+        candidate_doctors = availability_index.doctors
+        preferred_slot = None
+        preferred_clock = parse_clock_time(request.preferred_time)
+        if preferred_clock is not None:
+            preferred_slot = availability_index.slot_of(preferred_clock)
+
+        appointment_id = new_appointment_id()
+
+        # Reserve the preferred slot, or the nearest free one after it that day
+        # (earliest of the day if none); retry when another booking wins the race
+        day = request.preferred_date
+        cutoff = availability_index.first_start(day, now)
+        assigned_doctor = None
+        start_slot = None
+        for _ in range(APPOINTMENT_BOOKING_ATTEMPTS):
+            with metrics.span("appointment.availability_load"):
+                await availability_index.load([day])
+            choice = None
+            for doctor in candidate_doctors:
+                starts = (availability_index.start_mask(doctor, day, slots_needed) >> cutoff) << cutoff
+                if not starts:
+                    continue
+                if preferred_slot is not None and starts >> preferred_slot:
+                    later = (starts >> preferred_slot) << preferred_slot
+                    slot = (later & -later).bit_length() - 1
+                    rank = (doctor != request.doctor_preference, 0, slot - preferred_slot)
+                else:
+                    slot = (starts & -starts).bit_length() - 1
+                    rank = (doctor != request.doctor_preference, 1, slot)
+                if choice is None or rank < choice[0]:
+                    choice = (rank, doctor, slot)
+            if choice is None:
+                raise HTTPException(status_code=409, detail=f"No availability on {day.isoformat()}")
+            _, doctor, slot = choice
+            try:
+                with metrics.span("appointment.reserve"):
+                    await availability_index.reserve(doctor, day, slot, slots_needed, appointment_id)
+            except SlotConflictError:
+                continue
+            assigned_doctor, start_slot = doctor, slot
+            break
+        if assigned_doctor is None:
+            raise HTTPException(status_code=409, detail="Selected time was just booked, please retry")
+
+        start_time = availability_index.slot_time(start_slot)
+        confirmed_time = format_clock_time(start_time)
+        start = datetime.datetime.combine(day, start_time)
+        
+        # Cost and insurance coverage from the shared tariff
+        estimated_cost, insurance_coverage, patient_responsibility = tariff_engine.appointment_estimate(
+            request.appointment_type, request.insurance_provider
+        )
+        
+        # Store appointment in database
+        appointment_data = {
+            "appointment_id": appointment_id,
+            "patient_id": request.patient_id,
+            "appointment_type": request.appointment_type,
+            "date": day_start(day),
+            "time": confirmed_time,
+            "start": start,
+            "end": start + timedelta(minutes=duration),
+            "doctor": assigned_doctor,
+            "duration_minutes": duration,
+            "estimated_cost": estimated_cost,
+            "insurance_provider": request.insurance_provider,
+            "insurance_coverage": insurance_coverage,
+            "patient_responsibility": patient_responsibility,
+            "notes": request.notes,
+            "status": AppointmentStatus.SCHEDULED,
+            "created_at": datetime.datetime.now()
+        }
+        
+        with metrics.span("appointment.insert"):
+            for _ in range(APPOINTMENT_BOOKING_ATTEMPTS):
+                try:
+                    await db.appointments.insert_one(appointment_data)
+                    break
+                except DuplicateKeyError:
+                    # The short appointment id collided with an existing one: move the held slots to a new id
+                    retry_id = new_appointment_id()
+                    await availability_index.rekey(
+                        assigned_doctor, day, start_slot, slots_needed, appointment_id, retry_id
+                    )
+                    appointment_id = appointment_data["appointment_id"] = retry_id
+                except Exception:
+                    await availability_index.release(appointment_id)
+                    raise
+            else:
+                await availability_index.release(appointment_id)
+                raise HTTPException(status_code=500, detail="Could not allocate an appointment ID")
+        
+        # Update patient record with next appointment
+        with metrics.span("appointment.patient_update"):
+            await db.patients.update_one(
+                {"patient_id": request.patient_id},
+                {"$set": {"next_appointment": day_start(day)}}
+            )
+            await patient_cache.invalidate(request.patient_id)
+        
+        # Send confirmation (would integrate with SMS/email service)
+        logger.info(f"Appointment confirmation would be sent for appointment {appointment_id}")
+        
+        return AppointmentResponse(
+            appointment_id=appointment_id,
+            confirmed_date=request.preferred_date,
+            confirmed_time=confirmed_time,
+            doctor=assigned_doctor,
+            duration_minutes=duration,
+            estimated_cost=estimated_cost,
+            insurance_coverage=insurance_coverage,
+            patient_responsibility=patient_responsibility
+        )
+        
+    except HTTPException as http_ex:
+        raise http_ex
+    except Exception as e:
+        logger.error(f"Error scheduling appointment: {e}")
+        raise HTTPException(status_code=500, detail="Failed to schedule appointment")
+
+# ==================== RESPONSE SERIALIZATION ====================
+
+JSON_RESPONSE_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson else 0
+
+def _json_default(value: Any) -> Any:
+    """
+    Encode the types the JSON encoder does not handle natively.
+    """
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_json(content: Any) -> bytes:
+    """
+    Compact UTF-8 JSON, the same bytes Starlette's JSONResponse produces for the
+    same data (orjson only writes large and small exponents without a "+" or
+    leading zero, e.g. 1e16 for 1e+16).
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_json_default, option=JSON_RESPONSE_OPTIONS)
+    return json.dumps(
+        content, default=_json_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response for endpoints that already hold a validated model or plain data.
+
+    Returning a Response from an endpoint skips FastAPI's response_model
+    re-validation and jsonable_encoder pass; the response_model is still
+    declared on the route for the OpenAPI schema.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            content = content.dict()
+        return dumps_json(content)
+
+# (name, field, is a date field) for PatientRecord, in declaration order
+_PATIENT_FIELDS = [
+    (name, field, field.type_ is datetime.date)
+    for name, field in PatientRecord.__fields__.items()
+]
+
+def patient_document_payload(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    A stored patient document in PatientRecord's JSON shape without building the
+    model: fields in declaration order, defaults for missing fields, Mongo-only
+    keys dropped and date fields (stored as datetimes) narrowed back to dates.
+    """
+    payload = {}
+    for name, field, is_date in _PATIENT_FIELDS:
+        value = doc[name] if name in doc else field.get_default()
+        if is_date and isinstance(value, datetime.datetime):
+            value = value.date()
+        payload[name] = value
+    return payload
+
+# ==================== API ENDPOINTS ====================
+
+@app.get("/")
+async def root():
+    return {"message": "Dental AI Service API", "version": "1.0.0", "status": "operational"}
+
+@app.post("/api/symptom-analysis", response_model=SymptomAnalysisResponse)
+async def symptom_analysis_endpoint(request: SymptomAnalysisRequest):
+    """
+    Analyze dental symptoms and provide diagnosis and recommendations.
+    """
+    return FastJSONResponse(await analyze_symptoms(request))
+
+@app.post("/api/symptom-analysis/batch")
+async def symptom_analysis_batch_endpoint(requests: List[SymptomAnalysisRequest]):
+    """
+    Analyze a list of symptom reports, streaming one JSON result per line in request order.
+    """
+    if len(requests) > SYMPTOM_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch size exceeds the maximum of {SYMPTOM_BATCH_MAX_ITEMS} items"
+        )
+    results = await analyze_symptoms_batch(requests)
+    
+    def ndjson_lines():
+        for result in results:
+            yield result.json() + "\n"
+    
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+@app.post("/api/chat", response_model=ChatResponse)
+async def chat_endpoint(request: ChatRequest):
+    """
+    Process a chat message and generate an appropriate response.
+    """
+    return FastJSONResponse(await process_chat_message(request))
+
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Process a chat message, streaming each stage as a Server-Sent Event.
+    """
+    async def events():
+        async for event, data in stream_chat_events(request):
+            yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Persistent chat session. Each incoming JSON frame is a chat message; fields
+    given once (conversation_id, patient_id, language) are remembered for the
+    session. Every stage is sent back as a {"event": ..., "data": ...} frame.
+    """
+    await websocket.accept()
+    session: Dict[str, Any] = {key: websocket.query_params[key]
+                               for key in ("conversation_id", "patient_id", "language")
+                               if key in websocket.query_params}
+    try:
+        while True:
+            frame = await websocket.receive_text()
+            try:
+                payload = json.loads(frame)
+                if not isinstance(payload, dict):
+                    raise ValueError("Expected a JSON object")
+                session.update({key: payload[key] for key in ("conversation_id", "patient_id", "language") if key in payload})
+                request = ChatRequest(**{**session, "message": payload.get("message")})
+            except (ValueError, ValidationError) as e:
+                await websocket.send_text(json.dumps({"event": "error", "data": {"detail": str(e)}}))
+                continue
+            async for event, data in stream_chat_events(request):
+                await websocket.send_text(json.dumps({"event": event, "data": data}, default=str))
+    except WebSocketDisconnect:
+        pass
+
+@app.post("/api/appointments", response_model=AppointmentResponse)
+async def appointment_endpoint(request: AppointmentRequest):
+    """
+    Schedule a dental appointment.
+    """
+    return FastJSONResponse(await schedule_appointment(request))
+
+@app.post("/api/estimates", response_model=EstimateResponse)
+async def estimate_costs(request: EstimateRequest):
+    """
+    Costs, insurance coverage and patient responsibility for treatments and
+    appointment types under each provider, as provider x item matrices.
+
+    With no items the whole tariff is priced; with no providers every provider is.
+    """
+    treatments = request.treatments
+    appointment_types = request.appointment_types
+    if not treatments and not appointment_types:
+        treatments = list(tariff_engine.treatments)
+        appointment_types = list(AppointmentType)
+    providers = request.insurance_providers or list(InsuranceProvider)
+
+    try:
+        treatment_costs = tariff_engine.treatment_cost_array(treatments, strict=True)
+    except UnknownTreatmentError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    costs = np.concatenate([treatment_costs, tariff_engine.appointment_cost_array(appointment_types)])
+    coverage, responsibility = tariff_engine.estimate(costs, providers)
+
+    items = [EstimateItem(item=name, kind="treatment", cost=cost)
+             for name, cost in zip(treatments, treatment_costs.tolist())]
+    items.extend(EstimateItem(item=AppointmentType(t).value, kind="appointment", cost=cost)
+                 for t, cost in zip(appointment_types, costs[len(treatments):].tolist()))
+    return FastJSONResponse(EstimateResponse(
+        items=items,
+        insurance_providers=providers,
+        coverage=coverage.tolist(),
+        patient_responsibility=responsibility.tolist()
+    ))
+
+@app.get("/api/availability", response_model=AvailabilityResponse)
+async def get_availability(
+    appointment_type: AppointmentType,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    doctor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=200)
+):
+    """
+    Next free appointment starts that fit the appointment type's duration.
+    """
+    now = datetime.datetime.now()
+    start_date = start_date or now.date()
+    end_date = end_date or start_date + timedelta(days=6)
+    if end_date < start_date:
+        raise HTTPException(status_code=422, detail="end_date must not be before start_date")
+    if (end_date - start_date).days + 1 > AVAILABILITY_MAX_DAYS:
+        raise HTTPException(status_code=422, detail=f"Date range is limited to {AVAILABILITY_MAX_DAYS} days")
+    if end_date > booking_horizon(now.date()):
+        raise HTTPException(status_code=422, detail=f"Availability is limited to the next {AVAILABILITY_MAX_DAYS} days")
+    if doctor is not None and doctor not in availability_index.doctors:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+
+    duration = APPOINTMENT_DURATION_MINUTES.get(appointment_type, 60)
+    found = await availability_index.search(
+        start_date, end_date,
+        [doctor] if doctor else availability_index.doctors,
+        availability_index.slots_for(duration), limit, not_before=now
+    )
+    return FastJSONResponse(AvailabilityResponse(
+        appointment_type=appointment_type,
+        duration_minutes=duration,
+        start_date=start_date,
+        end_date=end_date,
+        slots=[
+            AvailableSlot(date=day, time=format_clock_time(availability_index.slot_time(slot)), doctor=name)
+            for day, slot, name in found
+        ]
+    ))
+
+@app.get("/api/availability/stats")
+async def availability_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Size and activity of the in-memory availability index.
+    """
+    return availability_index.stats()
+
+@app.get("/api/patients/{patient_id}", response_model=PatientRecord)
+async def get_patient(patient_id: str, current_user: dict = Depends(get_current_user)):
     """
     Get patient record by ID.
     """
-    patient = await db.patients.find_one({"patient_id": patient_id})
+    patient = await patient_cache.get(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
-    return PatientRecord(**patient)
+    return FastJSONResponse(patient_document_payload(patient))
 
 @app.post("/api/patients", response_model=PatientRecord)
 async def create_patient(patient: PatientRecord, current_user: dict = Depends(get_current_user)):
     """
     Create a new patient record.
     """
-    existing = await db.patients.find_one({"patient_id": patient.patient_id})
-    if existing:
+    patient_dict = mongo_dates(patient.dict())
+    try:
+        # The unique patient_id index makes the insert its own existence check
+        await db.patients.insert_one(patient_dict)
+    except DuplicateKeyError:
         raise HTTPException(status_code=400, detail="Patient ID already exists")
-    
-    patient_dict = patient.dict()
-    await db.patients.insert_one(patient_dict)
-    return patient
+    await patient_cache.invalidate(patient_dict["patient_id"])
+    return FastJSONResponse(patient_document_payload(patient_dict))
 
 @app.put("/api/patients/{patient_id}", response_model=PatientRecord)
 async def update_patient(patient_id: str, patient_update: PatientRecord, current_user: dict = Depends(get_current_user)):
     """
     Update an existing patient record.
     """
-    existing = await db.patients.find_one({"patient_id": patient_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Patient not found")
-    
-    patient_dict = patient_update.dict(exclude_unset=True)
-    patient_dict["updated_at"] = datetime.datetime.now()
+    patient_dict = mongo_dates({**patient_update.dict(exclude_unset=True), "updated_at": datetime.datetime.now()})
     
-    await db.patients.update_one({"patient_id": patient_id}, {"$set": patient_dict})
-    updated_patient = await db.patients.find_one({"patient_id": patient_id})
-    return PatientRecord(**updated_patient)
+    try:
+        updated_patient = await db.patients.find_one_and_update(
+            {"patient_id": patient_id},
+            {"$set": patient_dict},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Patient ID already exists")
+    if not updated_patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    if updated_patient["patient_id"] != patient_id:
+        await patient_cache.invalidate(patient_id)
+    # Invalidate rather than cache this snapshot: a concurrent update could otherwise
+    # land an older snapshot last and keep it cached for the full TTL
+    await patient_cache.invalidate(updated_patient["patient_id"])
+    return FastJSONResponse(patient_document_payload(updated_patient))
+
+@app.post("/api/patients/import", response_model=PatientImportReport)
+async def import_patients(
+    request: Request,
+    upload_format: Optional[str] = Query(None, alias="format", regex="^(ndjson|csv)$"),
+    import_id: Optional[str] = Query(None, regex=r"^[\w.-]{1,64}$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Bulk-create patients from an NDJSON or CSV upload (one patient per line or
+    row; CSV needs a header row). The body is processed as it streams in and
+    invalid or duplicate rows are reported without stopping the import.
+    Progress is available from /api/patients/imports/{import_id}.
+    """
+    if upload_format is None:
+        media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        upload_format = IMPORT_MEDIA_TYPES.get(media_type)
+        if upload_format is None:
+            raise HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail="Send text/csv or application/x-ndjson, or pass format=csv|ndjson"
+            )
+
+    job = PatientImportJob(import_id or uuid.uuid4().hex, upload_format)
+    if not await job.publish(only_new=True):
+        raise HTTPException(status_code=409, detail="Import ID already in use")
+    try:
+        report = await job.run(request.stream())
+    except Exception as e:
+        logger.error(f"Patient import {job.import_id} failed after {job.inserted} inserts: {e}")
+        raise HTTPException(status_code=500, detail=f"Import failed; {job.inserted} patients were inserted")
+    logger.info(f"Patient import {job.import_id}: {job.inserted} inserted, {job.failed} failed")
+    return FastJSONResponse(report)
+
+@app.get("/api/patients/imports/{import_id}", response_model=PatientImportReport)
+async def patient_import_status(import_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Progress, or the final report, of a patient import.
+    """
+    try:
+        payload = await redis_client.get(PatientImportJob.redis_key(import_id))
+    except Exception as e:
+        logger.error(f"Patient import status lookup failed: {e}")
+        raise HTTPException(status_code=503, detail="Import progress is temporarily unavailable")
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return Response(content=payload, media_type="application/json")
+
+@app.get("/api/exports/{dataset}")
+async def export_dataset(
+    dataset: str,
+    export_format: str = Query("ndjson", alias="format", regex="^(ndjson|csv)$"),
+    fields: Optional[str] = None,
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=EXPORT_MAX_BATCH_SIZE),
+    after_id: Optional[str] = None,
+    before_id: Optional[str] = None,
+    limit: int = Query(0, ge=0),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Stream patients, appointments or conversation messages as NDJSON or CSV in
+    `_id` order. Every row carries its document's `_id`; pass the last one as
+    `after_id` to resume.
+    """
+    if dataset not in EXPORT_DATASETS:
+        raise HTTPException(status_code=404, detail="Unknown dataset")
+    try:
+        columns = export_columns(dataset, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    chunks = export_chunks(
+        dataset, export_format, columns,
+        after_id=after_id, before_id=before_id, batch_size=batch_size, limit=limit
+    )
+    extension, media_type = ("csv", "text/csv; charset=utf-8") if export_format == "csv" else ("ndjson", "application/x-ndjson")
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{dataset}.{extension}"'}
+    )
+
+@app.post("/api/auth/logout")
+async def logout(token: str = Header(...), current_user: dict = Depends(get_current_user)):
+    """
+    Revoke the presented token on every worker until it expires.
+    """
+    payload = decode_access_token(token)
+    try:
+        await principal_cache.revoke(token, payload)
+    except Exception as e:
+        logger.error(f"Token revocation failed: {e}")
+        raise HTTPException(status_code=503, detail="Token revocation unavailable")
+    return {"status": "revoked"}
+
+@app.get("/api/inference/stats")
+async def inference_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Inference batching and executor pool statistics.
+    """
+    return {
+        "intent_batcher": intent_batcher.stats(),
+        "executor": inference_executor.stats()
+    }
+
+@app.get("/api/cache/stats")
+async def cache_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Hit and miss counters for the result caches.
+    """
+    return {
+        "symptom_analysis": symptom_result_cache.stats(),
+        "chat_intent": intent_cache.stats(),
+        "patients": patient_cache.stats(),
+        "principals": principal_cache.stats()
+    }
+
+@app.on_event("startup")
+async def start_cache_invalidation():
+    cache_invalidation_bus.start()
+
+@app.on_event("shutdown")
+async def stop_cache_invalidation():
+    await cache_invalidation_bus.close()
+
+@app.on_event("startup")
+async def start_models():
+    await model_manager.start()
+
+@app.on_event("startup")
+async def preseed_intent_cache():
+    # Runs in the background so startup is not delayed by the historical query
+    async def preseed():
+        await model_manager.wait_started()
+        await intent_cache.preseed(INTENT_CACHE_PRESEED_TOP_N)
+    app.state.intent_cache_preseed = asyncio.create_task(preseed())
+
+@app.get("/api/conversations/stats")
+async def conversation_logging_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Write-behind conversation buffer statistics.
+    """
+    return conversation_writer.stats()
+
+@app.get("/api/conversations/{conversation_id}", response_model=ConversationPage)
+async def get_conversation(
+    conversation_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get a page of a conversation's messages, reading only the buckets that hold it.
+    """
+    meta = await db.conversations.find_one(
+        {"conversation_id": conversation_id},
+        {"message_count": 1, "bucket_size": 1}
+    )
+    if not meta:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if "bucket_size" not in meta:
+        # Legacy single-document conversation: migrate it on first read
+        await migrate_conversation(conversation_id)
+        meta = await db.conversations.find_one(
+            {"conversation_id": conversation_id},
+            {"message_count": 1, "bucket_size": 1}
+        )
+
+    total = meta.get("message_count", 0)
+    bucket_size = meta["bucket_size"]
+    end = min(offset + limit, total)
+    messages = []
+    if offset < end:
+        cursor = db.conversation_messages.find(
+            {
+                "conversation_id": conversation_id,
+                "bucket": {"$gte": offset // bucket_size, "$lte": (end - 1) // bucket_size}
+            },
+            {"messages": 1}
+        )
+        async for bucket in cursor:
+            messages.extend(m for m in bucket["messages"] if offset <= m["seq"] < end)
+        messages.sort(key=lambda m: m["seq"])
+
+    return FastJSONResponse(ConversationPage(
+        conversation_id=conversation_id,
+        total_messages=total,
+        offset=offset,
+        limit=limit,
+        messages=[ConversationMessage(**m) for m in messages]
+    ))
+
+@app.on_event("startup")
+async def create_indexes():
+    for collection in MONGO_INDEXES:
+        try:
+            await ensure_indexes([collection])
+        except Exception as e:
+            logger.error(f"Error creating {collection} indexes: {e}")
+
+@app.on_event("startup")
+async def backfill_appointment_slots():
+    # Registered after create_indexes so the unique slot index is in place
+    try:
+        await availability_index.backfill()
+    except Exception as e:
+        logger.error(f"Error backfilling appointment slots: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_conversation_logging():
+    await conversation_writer.close()
+
+@app.on_event("shutdown")
+async def shutdown_inference():
+    await intent_batcher.close()
+    inference_executor.shutdown()
 
 @app.get("/api/health")
 async def health_check():
@@ -816,7 +4724,7 @@ async def health_check():
         redis_status = "disconnected"
     
     # Check AI models
-    models_status = "loaded" if "model" in globals() and model is not None else "not loaded"
+    models_status = "loaded" if model_manager.intent_backend is not None else "not loaded"
     
     return {
         "status": "healthy" if db_status == "connected" and redis_status == "connected" else "degraded",
@@ -829,8 +4737,226 @@ async def health_check():
         }
     }
 
+@app.get("/api/ready")
+async def readiness_check():
+    """
+    Readiness endpoint: 503 until the AI models are loaded and warmed up.
+    Unlike /api/health this only reports whether the service should receive traffic.
+    """
+    report = model_manager.status()
+    if not model_manager.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=report)
+    return report
+
+metrics.describe("dental_ai_cache_hits_total", "counter", "Cache hits by cache and tier.")
+metrics.describe("dental_ai_cache_misses_total", "counter", "Cache misses by cache.")
+metrics.describe("dental_ai_inference_active", "gauge", "Inference calls currently running, by pool.")
+metrics.describe("dental_ai_inference_waiting", "gauge", "Inference calls waiting for a worker, by pool.")
+metrics.describe("dental_ai_inference_rejected_total", "counter", "Inference calls rejected because the pool was saturated.")
+metrics.describe("dental_ai_intent_batch_queue_depth", "gauge", "Messages waiting for the intent batcher.")
+metrics.describe("dental_ai_conversation_buffered", "gauge", "Conversation messages waiting to be written.")
+metrics.describe("dental_ai_conversation_dropped_total", "counter", "Conversation messages dropped after failed flushes.")
+metrics.describe("dental_ai_model_ready", "gauge", "1 when the AI models are loaded and warmed up.")
+
+def collect_component_metrics() -> List[tuple]:
+    samples = []
+    caches = {
+        "symptom_analysis": symptom_result_cache.stats(),
+        "chat_intent": intent_cache.stats(),
+        "patients": patient_cache.stats(),
+        "principals": principal_cache.stats(),
+    }
+    for cache, cache_stats in caches.items():
+        for tier in ("local", "redis"):
+            samples.append(("dental_ai_cache_hits_total", {"cache": cache, "tier": tier}, cache_stats[f"{tier}_hits"]))
+        samples.append(("dental_ai_cache_misses_total", {"cache": cache}, cache_stats["misses"]))
+    for pool, pool_stats in inference_executor.stats().items():
+        samples.append(("dental_ai_inference_active", {"pool": pool}, pool_stats["active"]))
+        samples.append(("dental_ai_inference_waiting", {"pool": pool}, pool_stats["waiting"]))
+        samples.append(("dental_ai_inference_rejected_total", {"pool": pool}, pool_stats["rejected"]))
+    samples.append(("dental_ai_intent_batch_queue_depth", {}, intent_batcher.stats()["queue_depth"]))
+    conversation_stats = conversation_writer.stats()
+    samples.append(("dental_ai_conversation_buffered", {}, conversation_stats["buffered"]))
+    samples.append(("dental_ai_conversation_dropped_total", {}, conversation_stats["dropped"]))
+    samples.append(("dental_ai_model_ready", {}, 1 if model_manager.ready else 0))
+    return samples
+
+metrics.register_collector(collect_component_metrics)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus scrape endpoint: stage latency histograms, request counters and
+    cache, inference and logging statistics.
+    """
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+async def require_profile_admin(x_profile_token: Optional[str] = Header(None)):
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not PROFILE_TOKEN or not x_profile_token or not hmac.compare_digest(x_profile_token, PROFILE_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_profile_admin)])
+async def list_profiles():
+    """
+    Recent request profiles, newest first.
+    """
+    return {"directory": profile_store.directory, "profiles": profile_store.list()}
+
+@app.get("/api/admin/profiles/{name}", dependencies=[Depends(require_profile_admin)])
+async def download_profile(name: str):
+    """
+    Download a profile in cProfile format (open with pstats or snakeviz).
+    """
+    path = profile_store.path_of(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
+
+# ==================== MODEL TOOLING ====================
+
+def export_intent_onnx(output_dir: str, quantize: bool = True, opset: int = 14) -> str:
+    """
+    Export the PyTorch intent classifier to ONNX and optionally apply dynamic int8
+    quantization. Returns the path of the model to use as INTENT_ONNX_PATH.
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(INTENT_TOKENIZER_NAME)
+    model = AutoModelForSequenceClassification.from_pretrained(INTENT_MODEL_PATH)
+    model.eval()
+
+    sample = tokenizer(["I need to book a cleaning"], return_tensors="pt")
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=opset
+        )
+    logger.info(f"Exported intent classifier to {fp32_path}")
+    if not quantize:
+        return fp32_path
+
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    int8_path = os.path.join(output_dir, "model.int8.onnx")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    logger.info(f"Quantized intent classifier written to {int8_path}")
+    return int8_path
+
+def check_intent_parity(sample_path: str, candidate: str = "onnx", reference: str = "torch", batch_size: int = 32) -> Dict[str, Any]:
+    """
+    Compare two intent backends on a labeled JSONL sample of {"message", "intent"}
+    records, reporting accuracy, agreement and latency for each.
+    """
+    with open(sample_path) as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    messages = [sample["message"] for sample in samples]
+    labels = [sample["intent"] for sample in samples]
+
+    report: Dict[str, Any] = {"samples": len(samples)}
+    predictions = {}
+    for name in (reference, candidate):
+        backend = create_intent_backend(name)
+        backend.load()
+        backend.predict(messages[:batch_size])  # warm-up
+        started = time.perf_counter()
+        intent_ids = []
+        for start in range(0, len(messages), batch_size):
+            intent_ids.extend(backend.predict(messages[start:start + batch_size]))
+        elapsed = time.perf_counter() - started
+        intents = [INTENT_MAPPING.get(i, "general_question") for i in intent_ids]
+        predictions[name] = intents
+        report[name] = {
+            "accuracy": sum(p == l for p, l in zip(intents, labels)) / len(samples) if samples else 0.0,
+            "ms_per_message": elapsed / len(samples) * 1000.0 if samples else 0.0,
+        }
+    report["agreement"] = (
+        sum(a == b for a, b in zip(predictions[reference], predictions[candidate])) / len(samples) if samples else 0.0
+    )
+    return report
+
 # ==================== MAIN ENTRY POINT ====================
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("dental_ai_service:app", host="0.0.0.0", port=8000, reload=True)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Dental AI Service")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("serve", help="Run the API server (default)")
+
+    export_parser = commands.add_parser("export-onnx", help="Export the intent classifier to ONNX")
+    export_parser.add_argument("--output-dir", default=os.path.dirname(INTENT_ONNX_PATH))
+    export_parser.add_argument("--no-quantize", action="store_true", help="Skip dynamic int8 quantization")
+    export_parser.add_argument("--opset", type=int, default=14)
+
+    commands.add_parser("migrate-conversations", help="Move single-document conversations into message buckets")
+
+    commands.add_parser("ensure-indexes", help="Create the declared MongoDB indexes")
+
+    commands.add_parser("backfill-slots", help="Create availability slots for appointments booked before slot tracking")
+
+    export_parser = commands.add_parser("export", help="Stream a dataset to an NDJSON or CSV file")
+    export_parser.add_argument("dataset", choices=sorted(EXPORT_DATASETS))
+    export_parser.add_argument("--format", dest="export_format", choices=("ndjson", "csv"), default="ndjson")
+    export_parser.add_argument("--output", default="-", help="File to write ('-' for stdout)")
+    export_parser.add_argument("--fields", help="Comma-separated columns (default: all)")
+    export_parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    export_parser.add_argument("--after-id", help="Export documents after this _id")
+    export_parser.add_argument("--before-id", help="Export documents before this _id")
+    export_parser.add_argument("--limit", type=int, default=0, help="Maximum documents (0 for all)")
+    export_parser.add_argument("--resume", action="store_true", help="Continue an interrupted NDJSON export in --output")
+
+    parity_parser = commands.add_parser("check-intent-parity", help="Compare intent backends on a labeled sample")
+    parity_parser.add_argument("sample", help="JSONL file of {\"message\": ..., \"intent\": ...} records")
+    parity_parser.add_argument("--candidate", default="onnx")
+    parity_parser.add_argument("--reference", default="torch")
+    parity_parser.add_argument("--min-agreement", type=float, default=0.99)
+
+    args = parser.parse_args()
+
+    if args.command == "export-onnx":
+        print(export_intent_onnx(args.output_dir, quantize=not args.no_quantize, opset=args.opset))
+    elif args.command == "migrate-conversations":
+        async def migrate():
+            await ensure_indexes(["conversations", "conversation_messages"])
+            print(await migrate_legacy_conversations())
+        asyncio.run(migrate())
+    elif args.command == "ensure-indexes":
+        print(json.dumps(asyncio.run(ensure_indexes()), indent=2))
+    elif args.command == "backfill-slots":
+        async def backfill():
+            await ensure_indexes(["appointments", "appointment_slots"])
+            print(json.dumps(await availability_index.backfill()))
+        asyncio.run(backfill())
+    elif args.command == "export":
+        try:
+            stats = asyncio.run(export_to_file(
+                args.dataset, args.export_format, args.output, resume=args.resume,
+                columns=export_columns(args.dataset, args.fields),
+                after_id=args.after_id, before_id=args.before_id, batch_size=args.batch_size, limit=args.limit
+            ))
+        except ValueError as e:
+            parser.error(str(e))
+        print(json.dumps(stats), file=sys.stderr)
+    elif args.command == "check-intent-parity":
+        parity = check_intent_parity(args.sample, candidate=args.candidate, reference=args.reference)
+        print(json.dumps(parity, indent=2))
+        if parity["agreement"] < args.min_agreement:
+            raise SystemExit(1)
+    else:
+        import uvicorn
+        uvicorn.run("dental_ai_service:app", host="0.0.0.0", port=8000, reload=True)
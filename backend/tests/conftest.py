@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dental_ai_service  # noqa: E402
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """
+    The service module with its MongoDB and Redis clients swapped for in-process
+    stand-ins. Tests drive it from their own `asyncio.run`.
+    """
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    fakeredis = pytest.importorskip("fakeredis")
+    monkeypatch.setattr(dental_ai_service, "db", mongomock_motor.AsyncMongoMockClient().dental_ai_db)
+    monkeypatch.setattr(dental_ai_service, "redis_client", fakeredis.FakeAsyncRedis(decode_responses=True))
+    # In-process tiers would otherwise carry state from one test to the next
+    for local in (
+        dental_ai_service.symptom_result_cache.cache.local,
+        dental_ai_service.patient_cache.local,
+        dental_ai_service.principal_cache.local,
+    ):
+        local.clear()
+    dental_ai_service.availability_index._days.clear()
+    return dental_ai_service
@@ -0,0 +1,151 @@
+import asyncio
+import datetime
+
+import pytest
+
+DAY = datetime.date.today() + datetime.timedelta(days=2)
+
+
+def slots_of(service, appointment_id=None):
+    async def query():
+        match = {"appointment_id": appointment_id} if appointment_id else {}
+        return sorted([
+            (doc["doctor"], doc["slot"], doc["appointment_id"])
+            async for doc in service.db.appointment_slots.find(match)
+        ])
+    return query()
+
+
+def test_reserve_rejects_overlapping_booking_and_keeps_no_partial_slots(service):
+    index = service.availability_index
+
+    async def scenario():
+        await service.ensure_indexes(["appointment_slots"])
+        await index.load([DAY])
+        await index.reserve("Dr. Smith", DAY, 4, 3, "APT-A")
+        with pytest.raises(service.SlotConflictError):
+            # Overlaps slot 6 only; slots 7 and 8 must not stay held
+            await index.reserve("Dr. Smith", DAY, 6, 3, "APT-B")
+        await index.reserve("Dr. Johnson", DAY, 6, 3, "APT-C")
+        return await slots_of(service)
+
+    assert asyncio.run(scenario()) == [
+        ("Dr. Johnson", 6, "APT-C"), ("Dr. Johnson", 7, "APT-C"), ("Dr. Johnson", 8, "APT-C"),
+        ("Dr. Smith", 4, "APT-A"), ("Dr. Smith", 5, "APT-A"), ("Dr. Smith", 6, "APT-A"),
+    ]
+    assert index.conflicts >= 1
+
+
+def test_concurrent_reservations_of_one_slot_admit_exactly_one(service):
+    index = service.availability_index
+
+    async def scenario():
+        await service.ensure_indexes(["appointment_slots"])
+        return await asyncio.gather(
+            *(index.reserve("Dr. Brown", DAY, 10, 2, f"APT-{n}") for n in range(5)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert sum(result is None for result in results) == 1
+    assert sum(isinstance(result, service.SlotConflictError) for result in results) == 4
+
+
+def test_search_skips_booked_slots_breaks_and_past_starts(service):
+    index = service.availability_index
+    doctors = ["Dr. Smith"]
+    noon_slot = index.slot_of(datetime.time(12, 0))
+
+    async def scenario():
+        await service.ensure_indexes(["appointment_slots"])
+        await index.reserve("Dr. Smith", DAY, 0, 2, "APT-A")
+        first = await index.search(DAY, DAY, doctors, 1, 3)
+        # 11:30 start for an hour would run into the lunch break
+        before_lunch = await index.search(DAY, DAY, doctors, 4, 100)
+        after_ten = await index.search(
+            DAY, DAY, doctors, 1, 1, not_before=datetime.datetime.combine(DAY, datetime.time(10, 5))
+        )
+        return first, before_lunch, after_ten
+
+    first, before_lunch, after_ten = asyncio.run(scenario())
+    assert [slot for _, slot, _ in first] == [2, 3, 4]
+    starts = {slot for _, slot, _ in before_lunch}
+    assert all(not (slot < noon_slot < slot + 4) for slot in starts)
+    assert noon_slot not in starts
+    assert after_ten == [(DAY, index.slot_of(datetime.time(10, 15)), "Dr. Smith")]
+
+
+def test_rekey_and_release_move_and_free_held_slots(service):
+    index = service.availability_index
+
+    async def scenario():
+        await service.ensure_indexes(["appointment_slots"])
+        await index.load([DAY])
+        await index.reserve("Dr. Williams", DAY, 8, 2, "APT-OLD")
+        await index.rekey("Dr. Williams", DAY, 8, 2, "APT-OLD", "APT-NEW")
+        moved = await slots_of(service)
+        await index.release("APT-NEW")
+        return moved, await slots_of(service), index.free_mask("Dr. Williams", DAY)
+
+    moved, released, free = asyncio.run(scenario())
+    assert moved == [("Dr. Williams", 8, "APT-NEW"), ("Dr. Williams", 9, "APT-NEW")]
+    assert released == []
+    assert free >> 8 & 0b11 == 0b11
+
+
+def test_backfill_blocks_slots_of_existing_appointments(service):
+    index = service.availability_index
+    past = datetime.date.today() - datetime.timedelta(days=3)
+
+    async def scenario():
+        await service.ensure_indexes(["appointments", "appointment_slots"])
+        await service.db.appointments.insert_many([
+            {"appointment_id": "OLD-1", "doctor": "Dr. Smith", "date": service.day_start(DAY),
+             "time": "9:00 AM", "duration_minutes": 45, "status": "scheduled"},
+            # Off the slot grid: blocks every slot it overlaps
+            {"appointment_id": "OLD-2", "doctor": "Dr. Jones", "date": DAY.isoformat(),
+             "time": "9:10 AM", "appointment_type": "checkup", "status": "confirmed"},
+            {"appointment_id": "OLD-3", "doctor": "Dr. Brown", "date": service.day_start(DAY),
+             "time": "9:00 AM", "duration_minutes": 30, "status": "cancelled"},
+            {"appointment_id": "OLD-4", "doctor": "Dr. Brown", "date": service.day_start(past),
+             "time": "9:00 AM", "duration_minutes": 30, "status": "scheduled"},
+        ])
+        counts = await index.backfill()
+        again = await index.backfill()
+        found = await index.search(DAY, DAY, ["Dr. Smith"], 1, 1,
+                                   not_before=datetime.datetime.combine(DAY, datetime.time(9, 0)))
+        return counts, again, await slots_of(service), found
+
+    counts, again, slots, found = asyncio.run(scenario())
+    assert counts == {"migrated": 3, "slots": 6, "conflicts": 0, "skipped": 0}
+    assert again["migrated"] == 0
+    assert slots == [
+        ("Dr. Jones", 4, "OLD-2"), ("Dr. Jones", 5, "OLD-2"), ("Dr. Jones", 6, "OLD-2"),
+        ("Dr. Smith", 4, "OLD-1"), ("Dr. Smith", 5, "OLD-1"), ("Dr. Smith", 6, "OLD-1"),
+    ]
+    assert found == [(DAY, index.slot_of(datetime.time(9, 45)), "Dr. Smith")]
+
+
+def test_load_evicts_days_before_today(service):
+    index = service.availability_index
+    today = datetime.date.today()
+    past = [today - datetime.timedelta(days=n) for n in (1, 2)]
+
+    async def scenario():
+        await index.load(past)
+        await index.load([today])
+
+    asyncio.run(scenario())
+    assert list(index._days) == [today]
+    assert index.evictions >= 2
+
+
+@pytest.mark.parametrize("offset", [-1, 10000])
+def test_schedule_rejects_dates_outside_the_booking_horizon(service, offset):
+    request = service.AppointmentRequest(
+        patient_id="P1", appointment_type="cleaning",
+        preferred_date=datetime.date.today() + datetime.timedelta(days=offset), preferred_time="9:00 AM"
+    )
+    with pytest.raises(service.HTTPException) as error:
+        asyncio.run(service.schedule_appointment(request))
+    assert error.value.status_code == 422
@@ -0,0 +1,91 @@
+import asyncio
+
+
+def message(text):
+    return {"role": "user", "content": text}
+
+
+async def stored_messages(service, conversation_id):
+    """
+    Every bucketed message in sequence order, checking each sits in its own bucket.
+    """
+    meta = await service.db.conversations.find_one({"conversation_id": conversation_id})
+    messages = []
+    async for bucket in service.db.conversation_messages.find({"conversation_id": conversation_id}):
+        for item in bucket["messages"]:
+            assert item["seq"] // meta["bucket_size"] == bucket["bucket"]
+            messages.append(item)
+    return sorted(messages, key=lambda item: item["seq"])
+
+
+async def append(service, conversation_id, texts):
+    operations = await service.reserve_conversation_messages(conversation_id, [message(t) for t in texts])
+    await service.db.conversation_messages.bulk_write(operations, ordered=False)
+
+
+def test_bucket_operations_split_messages_by_sequence_number(service):
+    operations = service.conversation_bucket_operations("c1", [message(str(n)) for n in range(5)], 2, 3)
+    assert [(op._filter["bucket"], [item["seq"] for item in op._doc["$addToSet"]["messages"]["$each"]])
+            for op in operations] == [(0, [2]), (1, [3, 4, 5]), (2, [6])]
+
+
+def test_concurrent_appends_reserve_disjoint_sequence_numbers(service, monkeypatch):
+    monkeypatch.setattr(service, "CONVERSATION_BUCKET_SIZE", 3)
+
+    async def scenario():
+        await service.ensure_indexes(["conversations", "conversation_messages"])
+        await asyncio.gather(*(append(service, "c1", [f"{w}-{n}" for n in range(4)]) for w in range(3)))
+        return await stored_messages(service, "c1"), await service.db.conversations.find_one({"conversation_id": "c1"})
+
+    messages, meta = asyncio.run(scenario())
+    assert [item["seq"] for item in messages] == list(range(12))
+    assert sorted(item["content"] for item in messages) == sorted(f"{w}-{n}" for w in range(3) for n in range(4))
+    assert meta["message_count"] == 12
+
+
+def test_retried_bucket_writes_are_idempotent(service):
+    async def scenario():
+        await service.ensure_indexes(["conversations", "conversation_messages"])
+        operations = await service.reserve_conversation_messages("c1", [message("a"), message("b")])
+        await service.db.conversation_messages.bulk_write(operations, ordered=False)
+        await service.db.conversation_messages.bulk_write(operations, ordered=False)
+        return await stored_messages(service, "c1")
+
+    assert [item["content"] for item in asyncio.run(scenario())] == ["a", "b"]
+
+
+def test_append_to_a_legacy_conversation_migrates_it_first(service, monkeypatch):
+    monkeypatch.setattr(service, "CONVERSATION_BUCKET_SIZE", 2)
+
+    async def scenario():
+        await service.ensure_indexes(["conversations", "conversation_messages"])
+        await service.db.conversations.insert_one(
+            {"conversation_id": "legacy", "messages": [message(f"old-{n}") for n in range(3)]}
+        )
+        await append(service, "legacy", ["new-0", "new-1"])
+        meta = await service.db.conversations.find_one({"conversation_id": "legacy"})
+        return meta, await stored_messages(service, "legacy"), await service.migrate_conversation("legacy")
+
+    meta, messages, migrated_again = asyncio.run(scenario())
+    assert "messages" not in meta
+    assert meta["message_count"] == 5
+    assert [(item["seq"], item["content"]) for item in messages] == [
+        (0, "old-0"), (1, "old-1"), (2, "old-2"), (3, "new-0"), (4, "new-1"),
+    ]
+    assert migrated_again is False
+
+
+def test_migrate_legacy_conversations_moves_every_array(service):
+    async def scenario():
+        await service.ensure_indexes(["conversations", "conversation_messages"])
+        await service.db.conversations.insert_many([
+            {"conversation_id": f"c{n}", "messages": [message(str(m)) for m in range(n + 1)]} for n in range(3)
+        ] + [{"conversation_id": "bucketed", "message_count": 0, "bucket_size": 100}])
+        migrated = await service.migrate_legacy_conversations()
+        remaining = await service.db.conversations.count_documents({"messages": {"$exists": True}})
+        return migrated, remaining, [len(await stored_messages(service, f"c{n}")) for n in range(3)]
+
+    migrated, remaining, lengths = asyncio.run(scenario())
+    assert migrated == 3
+    assert remaining == 0
+    assert lengths == [1, 2, 3]
@@ -0,0 +1,69 @@
+import pytest
+
+from dental_ai_service import Language, emergency_detector
+
+
+def is_emergency(text: str, language: Language) -> bool:
+    return emergency_detector.is_emergency(emergency_detector.detect(text, language))
+
+
+@pytest.mark.parametrize("language, text", [
+    (Language.ENGLISH, "no swelling but bleeding heavily"),
+    (Language.ENGLISH, "There is no swelling, however I am bleeding heavily"),
+    (Language.ENGLISH, "not swollen although bleeding heavily"),
+    (Language.SPANISH, "sin hinchazón pero sangrado"),
+    (Language.SPANISH, "no hay hinchazón sino sangrado"),
+    (Language.FRENCH, "pas de gonflement mais saignement"),
+    (Language.FRENCH, "sans gonflement mais un saignement"),
+    (Language.GERMAN, "keine Schwellung aber Blutung"),
+    (Language.GERMAN, "keine Schwellung doch starke Blutung"),
+    (Language.CHINESE, "没有肿胀但是出血"),
+    (Language.CHINESE, "没有肿胀可是出血"),
+    (Language.JAPANESE, "腫れはないけど出血がある"),
+    (Language.JAPANESE, "腫れはない。しかし出血がある"),
+])
+def test_contrast_word_ends_negation(language, text):
+    assert is_emergency(text, language)
+
+
+@pytest.mark.parametrize("language, text", [
+    (Language.ENGLISH, "Never had such extreme pain"),
+    (Language.ENGLISH, "I have never felt such unbearable pain"),
+    (Language.SPANISH, "Nunca tuve un dolor tan insoportable"),
+    (Language.FRENCH, "Je n'ai jamais eu une douleur aussi insupportable"),
+    (Language.GERMAN, "Ich hatte nie so starke Schmerzen"),
+    (Language.CHINESE, "止不住出血"),
+    (Language.CHINESE, "牙齿不停地出血"),
+    (Language.CHINESE, "一直不断流血"),
+    (Language.JAPANESE, "出血が止まらない"),
+])
+def test_cue_not_attached_to_keyword_stays_emergency(language, text):
+    assert is_emergency(text, language)
+
+
+@pytest.mark.parametrize("language, text", [
+    (Language.ENGLISH, "no swelling"),
+    (Language.ENGLISH, "I am not bleeding heavily"),
+    (Language.SPANISH, "sin hinchazón"),
+    (Language.SPANISH, "sin sangrado"),
+    (Language.FRENCH, "pas de gonflement"),
+    (Language.GERMAN, "keine Schwellung"),
+    (Language.CHINESE, "没有肿胀"),
+    (Language.CHINESE, "没有出血"),
+    (Language.CHINESE, "不出血"),
+    (Language.JAPANESE, "出血はない"),
+])
+def test_negated_keyword_is_not_emergency(language, text):
+    assert not is_emergency(text, language)
+
+
+@pytest.mark.parametrize("language, text", [
+    (Language.ENGLISH, "bleeding heavily"),
+    (Language.SPANISH, "sangrado"),
+    (Language.FRENCH, "saignement"),
+    (Language.GERMAN, "Blutung"),
+    (Language.CHINESE, "出血"),
+    (Language.JAPANESE, "出血がある"),
+])
+def test_keyword_is_emergency(language, text):
+    assert is_emergency(text, language)
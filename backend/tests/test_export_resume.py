@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import pytest
+
+from dental_ai_service import prepare_export_resume
+
+
+def rows(*ids):
+    return b"".join(json.dumps({"_id": _id, "n": n}).encode() + b"\n" for n, _id in enumerate(ids))
+
+
+def test_resume_trims_the_partial_line_and_the_last_document(tmp_path):
+    path = tmp_path / "export.ndjson"
+    complete = rows("a", "b", "b")
+    path.write_bytes(complete + rows("c", "c") + b'{"_id": "c", "n"')
+
+    assert prepare_export_resume(str(path)) == "b"
+    assert path.read_bytes() == complete
+
+
+def test_resume_starts_over_when_no_document_is_complete(tmp_path):
+    path = tmp_path / "export.ndjson"
+    path.write_bytes(rows("a", "a") + b'{"_id": "a"')
+
+    assert prepare_export_resume(str(path)) is None
+    assert path.read_bytes() == b""
+
+
+def test_resume_reads_only_a_window_at_the_end_of_the_file(tmp_path):
+    path = tmp_path / "export.ndjson"
+    body = rows(*[f"id{n:03d}" for n in range(200)])
+    path.write_bytes(body + b'{"_id": "id2')
+
+    assert prepare_export_resume(str(path), window_bytes=100) == "id198"
+    assert path.read_bytes() == rows(*[f"id{n:03d}" for n in range(199)])
+
+
+def test_resume_refuses_a_window_without_a_complete_document(tmp_path):
+    path = tmp_path / "export.ndjson"
+    path.write_bytes(rows("a") + rows(*["b"] * 20))
+
+    with pytest.raises(ValueError):
+        prepare_export_resume(str(path), window_bytes=60)
+
+
+def test_interrupted_patient_export_resumes_to_the_full_export(service, tmp_path):
+    full_path = tmp_path / "full.ndjson"
+    path = tmp_path / "resumed.ndjson"
+
+    async def scenario():
+        await service.db.patients.insert_many([
+            {"patient_id": f"P{n}", "name": f"Patient {n}", "allergies": ["latex"] if n % 2 else []}
+            for n in range(25)
+        ])
+        await service.export_to_file("patients", "ndjson", str(full_path))
+        # Cut the file part way through a line, as a killed export would leave it
+        data = full_path.read_bytes()
+        path.write_bytes(data[:len(data) // 2])
+        return await service.export_to_file("patients", "ndjson", str(path), resume=True)
+
+    stats = asyncio.run(scenario())
+    assert path.read_bytes() == full_path.read_bytes()
+    assert 0 < stats["documents"] < 25
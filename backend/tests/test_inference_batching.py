@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from dental_ai_service import InferenceBatcher, collect_batch
+
+
+def test_collect_batch_takes_queued_items_up_to_the_limit():
+    async def scenario():
+        queue = asyncio.Queue()
+        for item in range(5):
+            queue.put_nowait(item)
+        batch = await collect_batch(queue, max_items=3, max_wait=1.0)
+        return batch, queue.qsize()
+
+    batch, left = asyncio.run(scenario())
+    assert batch == [0, 1, 2]
+    assert left == 2
+
+
+def test_collect_batch_waits_for_late_items_until_the_deadline():
+    async def scenario():
+        queue = asyncio.Queue()
+
+        async def produce():
+            queue.put_nowait("first")
+            await asyncio.sleep(0.01)
+            queue.put_nowait("late")
+            await asyncio.sleep(0.5)
+            queue.put_nowait("too late")
+
+        producer = asyncio.create_task(produce())
+        batch = await collect_batch(queue, max_items=10, max_wait=0.1)
+        producer.cancel()
+        return batch
+
+    assert asyncio.run(scenario()) == ["first", "late"]
+
+
+def test_batcher_groups_concurrent_calls_and_resolves_each_caller():
+    calls = []
+
+    async def double(items):
+        calls.append(list(items))
+        return [item * 2 for item in items]
+
+    async def scenario():
+        batcher = InferenceBatcher(double, max_batch_size=8, max_wait_ms=20)
+        try:
+            return await asyncio.gather(*(batcher.submit(i) for i in range(5))), batcher.stats()
+        finally:
+            await batcher.close()
+
+    results, stats = asyncio.run(scenario())
+    assert results == [0, 2, 4, 6, 8]
+    assert calls == [[0, 1, 2, 3, 4]]
+    assert stats["batches"] == 1
+    assert stats["items"] == 5
+
+
+def test_batcher_fails_every_caller_when_results_do_not_match_inputs():
+    async def drop_last(items):
+        return items[:-1]
+
+    async def scenario():
+        batcher = InferenceBatcher(drop_last, max_batch_size=4, max_wait_ms=20)
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*(batcher.submit(i) for i in range(4)), return_exceptions=True), timeout=2
+            )
+            return results, batcher.errors
+        finally:
+            await batcher.close()
+
+    results, errors = asyncio.run(scenario())
+    assert len(results) == 4
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert errors == 1
+
+
+def test_batcher_propagates_run_batch_errors_and_keeps_serving():
+    failures = [ValueError("model failed")]
+
+    async def flaky(items):
+        if failures:
+            raise failures.pop()
+        return items
+
+    async def scenario():
+        batcher = InferenceBatcher(flaky, max_batch_size=4, max_wait_ms=1)
+        try:
+            with pytest.raises(ValueError):
+                await batcher.submit("a")
+            return await batcher.submit("b")
+        finally:
+            await batcher.close()
+
+    assert asyncio.run(scenario()) == "b"
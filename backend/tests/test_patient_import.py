@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+import pytest
+
+from dental_ai_service import RecordSplitter
+
+CSV_TEXT = (
+    'patient_id,name,date_of_birth,email,phone,address\n'
+    'P1,Ann,1990-01-02,ann@example.com,555-0101,"12 Main St\n'
+    'Apt 4"\n'
+    'P2,Bob,1985-05-06,bob@example.com,555-0102,\n'
+)
+
+
+def split(text, quoted, max_length=1000, chunk_size=None):
+    splitter = RecordSplitter(quoted, max_length)
+    records = []
+    step = chunk_size or len(text)
+    for start in range(0, len(text), step):
+        records.extend(splitter.feed(text[start:start + step]))
+    return records + splitter.close()
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 3, 7])
+def test_splitter_keeps_quoted_newlines_inside_one_csv_record(chunk_size):
+    assert split(CSV_TEXT, quoted=True, chunk_size=chunk_size) == [
+        (1, "patient_id,name,date_of_birth,email,phone,address"),
+        (2, 'P1,Ann,1990-01-02,ann@example.com,555-0101,"12 Main St\nApt 4"'),
+        (4, "P2,Bob,1985-05-06,bob@example.com,555-0102,"),
+        (5, ""),
+    ]
+
+
+def test_splitter_drops_oversized_records_but_keeps_line_numbers():
+    text = '{"a": 1}\n' + "x" * 50 + '\n{"b": 2}'
+    assert split(text, quoted=False, max_length=20, chunk_size=4) == [
+        (1, '{"a": 1}'),
+        (2, None),
+        (3, '{"b": 2}'),
+    ]
+
+
+def ndjson(start, stop):
+    return "".join(
+        json.dumps({
+            "patient_id": f"P{n}", "name": f"Patient {n}", "date_of_birth": "1990-01-02",
+            "email": f"p{n}@example.com", "phone": "555-0100"
+        }) + "\n"
+        for n in range(start, stop)
+    ).encode()
+
+
+async def chunked(data, size=13):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def run_import(service, import_id, data, batch_size=2):
+    job = service.PatientImportJob(import_id, "ndjson", batch_size=batch_size)
+    return job.run(chunked(data))
+
+
+def test_import_reports_invalid_rows_by_line_and_publishes_progress(service):
+    data = ndjson(0, 3) + b'{"patient_id": "BAD"}\n' + b"not json\n" + ndjson(3, 5)
+
+    async def scenario():
+        await service.ensure_indexes(["patients"])
+        report = await run_import(service, "imp-1", data)
+        stored = json.loads(await service.redis_client.get(service.PatientImportJob.redis_key("imp-1")))
+        return report, stored, await service.db.patients.count_documents({})
+
+    report, stored, count = asyncio.run(scenario())
+    assert report["status"] == "completed"
+    assert (report["rows"], report["inserted"], report["failed"]) == (7, 5, 2)
+    assert [(error["line"], error["patient_id"]) for error in report["errors"]] == [(4, "BAD"), (5, None)]
+    assert stored["inserted"] == 5 and stored["status"] == "completed"
+    assert count == 5
+
+
+def test_rerunning_an_interrupted_import_inserts_only_the_remaining_rows(service):
+    data = ndjson(0, 6)
+
+    async def scenario():
+        await service.ensure_indexes(["patients"])
+        # The first attempt only got the first three records through
+        first = await run_import(service, "imp-a", ndjson(0, 3))
+        resumed = await run_import(service, "imp-b", data)
+        return first, resumed, await service.db.patients.count_documents({})
+
+    first, resumed, count = asyncio.run(scenario())
+    assert first["inserted"] == 3
+    assert (resumed["inserted"], resumed["failed"]) == (3, 3)
+    assert {error["error"] for error in resumed["errors"]} == {"Patient ID already exists"}
+    assert [error["line"] for error in resumed["errors"]] == [1, 2, 3]
+    assert count == 6
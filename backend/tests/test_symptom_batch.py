@@ -0,0 +1,44 @@
+import asyncio
+
+import numpy as np
+
+
+def condition_probabilities(rows: int) -> np.ndarray:
+    return np.stack([np.roll(np.linspace(0, 1, 10), row) for row in range(rows)])
+
+
+def requests(service):
+    return [
+        service.SymptomAnalysisRequest(pain_level=8, symptoms=["swelling", "throbbing"]),
+        service.SymptomAnalysisRequest(pain_level=2, symptoms=["sensitivity_cold"]),
+        service.SymptomAnalysisRequest(pain_level=5, symptoms=["bleeding"], duration_days=3),
+    ]
+
+
+def test_batch_matches_single_analyses_in_request_order(service, monkeypatch):
+    async def predict(feature_matrix):
+        # A different probability row per distinct feature vector
+        return condition_probabilities(10)[[int(row.sum() * 7) % 10 for row in feature_matrix]]
+
+    monkeypatch.setattr(service.inference_executor, "predict_symptoms", predict)
+    monkeypatch.setattr(service.symptom_result_cache.cache, "enabled", False)
+
+    async def scenario():
+        batch = await service.analyze_symptoms_batch(requests(service))
+        single = [await service.analyze_symptoms(request) for request in requests(service)]
+        return batch, single
+
+    batch, single = asyncio.run(scenario())
+    assert [result.dict() for result in batch] == [result.dict() for result in single]
+
+
+def test_batch_falls_back_when_the_classifier_drops_rows(service, monkeypatch):
+    async def predict(feature_matrix):
+        return condition_probabilities(len(feature_matrix) - 1)
+
+    monkeypatch.setattr(service.inference_executor, "predict_symptoms", predict)
+    monkeypatch.setattr(service.symptom_result_cache.cache, "enabled", False)
+
+    results = asyncio.run(service.analyze_symptoms_batch(requests(service)))
+    assert len(results) == 3
+    assert all(result == service.fallback_symptom_analysis() for result in results)